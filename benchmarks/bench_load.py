@@ -0,0 +1,409 @@
+# benchmarks/bench_load.py
+#
+# End-to-end load test. Simulated users talk to the real handlers over long
+# polling: each one sends /start, browses /mode and picks a mode, opens and
+# leaves /settings, then chats. The bot runs against the fake Bot API, a fake
+# streaming Ollama and in-memory Mongo collections, so the numbers show the
+# bot's own overhead at a given model speed and Telegram latency.
+#
+#   python -m benchmarks.bench_load --users 50 --messages 5 --tokens-per-sec 40
+#   python -m benchmarks.bench_load --output after.json --baseline before.json
+#
+# Results are printed and written as JSON; --baseline prints the change of
+# each headline metric against an earlier run.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from benchmarks.fake_mongo import install
+from benchmarks.fake_ollama import FakeOllama
+from benchmarks.fake_telegram import FakeTelegramAPI
+
+BENCH_MODEL = "llama3.1:8b"
+
+# Metrics compared against --baseline, and whether lower is better
+HEADLINE_METRICS = {
+    "updates_per_sec": False,
+    "first_token_ms.p50": True,
+    "first_token_ms.p95": True,
+    "reply_ms.p95": True,
+    "edits_per_reply.mean": True,
+    "db_ops_per_message": True,
+    "loop_lag_ms.p99": True,
+}
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(quantile: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(quantile * len(ordered)))], 2)
+
+    return {
+        "p50": at(0.5),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "max": round(ordered[-1], 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+    }
+
+
+class LoopLagMonitor:
+    """
+    Samples how late a short sleep wakes up, i.e. how long the event loop
+    was busy with other work.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append((loop.time() - start - self.interval) * 1000)
+
+
+def has_button(event: dict, prefix: str) -> bool:
+    markup = event.get("reply_markup") or {}
+    return any(
+        button.get("callback_data", "").startswith(prefix)
+        for row in markup.get("inline_keyboard", [])
+        for button in row
+    )
+
+
+class SimulatedUser:
+    def __init__(self, fake: FakeTelegramAPI, chat_id: int, args, stats: dict):
+        self.fake = fake
+        self.chat_id = chat_id
+        self.args = args
+        self.stats = stats
+        self.random = random.Random(chat_id)
+
+    def _position(self) -> int:
+        return len(self.fake.outgoing.get(self.chat_id, []))
+
+    async def _step(self, push, predicate) -> dict:
+        """
+        Pushes one update and waits for the bot's answer to it.
+        """
+        start = self._position()
+        started_at = time.monotonic()
+        await push
+        self.stats["updates"] += 1
+        event = await self.fake.wait_for(
+            self.chat_id, predicate, start, self.args.timeout
+        )
+        self.stats["command_ms"].append((time.monotonic() - started_at) * 1000)
+        return event
+
+    def _command(self, text: str, predicate):
+        return self._step(self.fake.push_update(self.chat_id, text), predicate)
+
+    def _press(self, event: dict, data: str, predicate):
+        return self._step(
+            self.fake.push_callback(self.chat_id, event["message_id"], data),
+            predicate,
+        )
+
+    async def run(self, mode_keys: list):
+        try:
+            await self._script(mode_keys)
+        except asyncio.TimeoutError:
+            # The bot never answered, e.g. a command reply lost to a 429
+            self.stats["abandoned_users"] += 1
+
+    async def _script(self, mode_keys: list):
+        await self._command("/start", lambda e: e["method"] == "sendMessage")
+
+        # Browse the mode menu, then pick a mode
+        menu = await self._command("/mode", lambda e: has_button(e, "page:"))
+        await self._press(
+            menu, "page:1", lambda e: e["method"] == "editMessageText"
+        )
+        # With --same-prompt everyone is in the same mode, like after a
+        # channel post telling people what to ask
+        mode_key = mode_keys[0]
+        if not self.args.same_prompt:
+            mode_key = self.random.choice(mode_keys)
+        await self._press(
+            menu,
+            f"mode:{mode_key}",
+            lambda e: e["method"] == "sendMessage",
+        )
+
+        # Open the model list and leave the settings again
+        settings = await self._command("/settings", lambda e: has_button(e, "ai_model"))
+        await self._press(
+            settings, "ai_model", lambda e: has_button(e, "select_model:")
+        )
+        await self._press(
+            settings, "back_to_settings", lambda e: has_button(e, "ai_model")
+        )
+        await self._press(
+            settings,
+            "exit_settings",
+            lambda e: e["method"] == "sendMessage" and e["text"].startswith("🚪"),
+        )
+
+        for index in range(self.args.messages):
+            await asyncio.sleep(self.random.uniform(0, 2 * self.args.think))
+            if self.args.same_prompt:
+                await self.chat(f"Question {index}")
+            else:
+                await self.chat(f"Question {index} from user {self.chat_id}")
+
+    async def chat(self, text: str):
+        start = self._position()
+        started_at = time.monotonic()
+        await self.fake.push_update(self.chat_id, text)
+        self.stats["updates"] += 1
+
+        # The reply starts with a placeholder, unless it failed right away
+        placeholder = await self.fake.wait_for(
+            self.chat_id,
+            lambda e: e["method"] == "sendMessage"
+            and (e["text"] == "Processing..." or e["text"].startswith("Something")),
+            start,
+            self.args.timeout,
+        )
+        reply_id = placeholder["message_id"]
+        events = self.fake.outgoing[self.chat_id]
+        placeholder_index = events.index(placeholder)
+        # The final edit drops the Stop button
+        final = await self.fake.wait_for(
+            self.chat_id,
+            lambda e: e["reply_markup"] is None,
+            placeholder_index,
+            self.args.timeout,
+        )
+        self.stats["reply_ms"].append((time.monotonic() - started_at) * 1000)
+        if final["text"].startswith(("Something", "🚦")):
+            self.stats["failed_replies"] += 1
+            return
+        self.stats["replies"] += 1
+
+        reply_events = events[placeholder_index + 1 : events.index(final) + 1]
+        visible = next(
+            event
+            for event in reply_events
+            if event["message_id"] == reply_id and not event["text"].startswith("⏳")
+        )
+        self.stats["first_token_ms"].append((visible["at"] - started_at) * 1000)
+        self.stats["edits_per_reply"].append(
+            sum(event["method"] == "editMessageText" for event in reply_events)
+        )
+
+
+async def run(args) -> dict:
+    # The bot reads its configuration at import time, so point it at the
+    # fakes before importing any of it
+    os.environ["BOT_TOKEN"] = "123456:bench"
+    os.environ["BOT_MODE"] = "polling"
+    os.environ["STATE_BACKEND"] = "memory"
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{args.telegram_port}"
+    os.environ["OLLAMA_HOSTS"] = f"http://127.0.0.1:{args.ollama_port}"
+    os.environ["OLLAMA_DEFAULT_MODEL"] = BENCH_MODEL
+
+    from bot.dispatcher import bot, dp
+    from bot.services.mode_registry import mode_registry
+    from database.bot_database import BotDatabase
+    from main import setup
+
+    logging.getLogger().setLevel(args.log_level)
+
+    fake_telegram = FakeTelegramAPI(
+        port=args.telegram_port,
+        rtt=args.rtt,
+        retry_after_rate=args.retry_after_rate,
+        retry_after=args.retry_after,
+    )
+    fake_ollama = FakeOllama(
+        port=args.ollama_port,
+        tokens_per_sec=args.tokens_per_sec,
+        reply_tokens=args.reply_tokens,
+        models=[BENCH_MODEL],
+    )
+    await fake_telegram.start()
+    await fake_ollama.start()
+
+    db = BotDatabase()
+    fake_mongo = install(db)
+    await setup(db)
+    # Only count what the users cause, not index creation at startup
+    fake_mongo.ops.clear()
+
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+    monitor = LoopLagMonitor()
+    monitor.start()
+
+    stats = {
+        "updates": 0,
+        "replies": 0,
+        "failed_replies": 0,
+        "abandoned_users": 0,
+        "command_ms": [],
+        "reply_ms": [],
+        "first_token_ms": [],
+        "edits_per_reply": [],
+    }
+    mode_keys = list(mode_registry.snapshot.modes)
+    users = [
+        SimulatedUser(fake_telegram, 100_000 + index, args, stats)
+        for index in range(args.users)
+    ]
+
+    async def start_user(index: int, user: SimulatedUser):
+        # Spread the users' arrival over the ramp-up time
+        await asyncio.sleep(args.ramp * index / max(args.users, 1))
+        await user.run(mode_keys)
+
+    started_at = time.monotonic()
+    outcomes = await asyncio.gather(
+        *(start_user(index, user) for index, user in enumerate(users)),
+        return_exceptions=True,
+    )
+    duration = time.monotonic() - started_at
+    await db.write_queue.flush()
+
+    await monitor.stop()
+    await dp.stop_polling()
+    await polling
+    await fake_ollama.close()
+    await fake_telegram.close()
+
+    errors = [repr(outcome) for outcome in outcomes if outcome is not None]
+    messages = args.users * args.messages
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "duration_seconds": round(duration, 2),
+        "updates": stats["updates"],
+        "updates_per_sec": round(stats["updates"] / duration, 2),
+        "replies": stats["replies"],
+        "failed_replies": stats["failed_replies"],
+        "abandoned_users": stats["abandoned_users"],
+        "user_errors": errors[:10],
+        "first_token_ms": percentiles(stats["first_token_ms"]),
+        "reply_ms": percentiles(stats["reply_ms"]),
+        "command_ms": percentiles(stats["command_ms"]),
+        "edits_per_reply": percentiles(stats["edits_per_reply"]),
+        "db_ops_per_message": round(fake_mongo.total_ops() / max(messages, 1), 2),
+        "db_ops": dict(sorted(fake_mongo.ops.items())),
+        "loop_lag_ms": percentiles(monitor.samples),
+        "retry_after_injected": fake_telegram.retry_after_sent,
+        "telegram_calls": fake_telegram.calls,
+        "ollama_calls": fake_ollama.calls,
+        "max_concurrent_generations": fake_ollama.max_active_streams,
+    }
+
+
+def metric(results: dict, path: str):
+    value = results
+    for key in path.split("."):
+        value = (value or {}).get(key)
+    return value
+
+
+def compare(results: dict, baseline: dict):
+    print("\nChange against baseline:")
+    for path, lower_is_better in HEADLINE_METRICS.items():
+        old, new = metric(baseline, path), metric(results, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = (change < 0) == lower_is_better or change == 0
+        print(
+            f"  {path:24} {old:>10} -> {new:<10} {change:+6.1f}% "
+            f"{'better' if better else 'WORSE'}"
+        )
+
+
+def report(results: dict):
+    print(
+        f"users={results['config']['users']} "
+        f"updates={results['updates']} "
+        f"({results['updates_per_sec']}/s over {results['duration_seconds']}s), "
+        f"replies={results['replies']} failed={results['failed_replies']} "
+        f"abandoned_users={results['abandoned_users']}"
+    )
+    for name in ("first_token_ms", "reply_ms", "command_ms", "loop_lag_ms"):
+        print(f"  {name:18} {results[name]}")
+    print(f"  {'edits_per_reply':18} {results['edits_per_reply']}")
+    print(f"  {'db_ops_per_message':18} {results['db_ops_per_message']}")
+    print(f"  {'retry_after':18} {results['retry_after_injected']} injected")
+    print(f"  {'ollama_streams':18} {results['ollama_calls'].get('chat', 0)}")
+    for error in results["user_errors"]:
+        print(f"  user error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=3, help="per user")
+    parser.add_argument(
+        "--same-prompt",
+        action="store_true",
+        help="all users pick the same mode and send the same questions",
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=2.0, help="seconds until all users started"
+    )
+    parser.add_argument(
+        "--think", type=float, default=1.0, help="mean pause between messages (s)"
+    )
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--reply-tokens", type=int, default=100)
+    parser.add_argument(
+        "--rtt", type=float, default=0.0, help="simulated Bot API round trip (s)"
+    )
+    parser.add_argument(
+        "--retry-after-rate",
+        type=float,
+        default=0.0,
+        help="share of sends and edits answered with 429",
+    )
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument(
+        "--timeout", type=float, default=30.0, help="max wait for one answer (s)"
+    )
+    parser.add_argument("--telegram-port", type=int, default=8584)
+    parser.add_argument("--ollama-port", type=int, default=8585)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare with")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
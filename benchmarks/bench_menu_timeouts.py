@@ -0,0 +1,132 @@
+# benchmarks/bench_menu_timeouts.py
+#
+# Memory and scheduling cost of keeping many menus open with a timeout:
+# one sleeping task per menu (the old handlers), one loop.call_later handle
+# per menu, and the shared TimerWheel.
+#
+#   python -m benchmarks.bench_menu_timeouts --menus 100000
+
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+
+from bot.helpers.timer_wheel import TimerWheel
+
+TIMEOUT = 15
+
+
+def on_timeout(key):
+    pass
+
+
+class TaskPerMenu:
+    def __init__(self):
+        self.tasks = {}
+
+    async def _sleep(self, key):
+        await asyncio.sleep(TIMEOUT)
+        self.tasks.pop(key, None)
+
+    def schedule(self, key):
+        previous = self.tasks.get(key)
+        if previous is not None:
+            previous.cancel()
+        self.tasks[key] = asyncio.create_task(self._sleep(key))
+
+    def cancel(self, key):
+        self.tasks.pop(key).cancel()
+
+
+class CallLaterPerMenu:
+    def __init__(self):
+        self.handles = {}
+
+    def schedule(self, key):
+        previous = self.handles.get(key)
+        if previous is not None:
+            previous.cancel()
+        self.handles[key] = asyncio.get_running_loop().call_later(
+            TIMEOUT, on_timeout, key
+        )
+
+    def cancel(self, key):
+        self.handles.pop(key).cancel()
+
+
+class Wheel:
+    def __init__(self):
+        self.wheel = TimerWheel()
+
+    def schedule(self, key):
+        self.wheel.schedule(key, TIMEOUT, on_timeout)
+
+    def cancel(self, key):
+        self.wheel.cancel(key)
+
+
+async def loop_lag(samples: int = 20) -> float:
+    """
+    Worst delay of a 10 ms sleep while the timers are pending.
+    """
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    for _ in range(samples):
+        start = loop.time()
+        await asyncio.sleep(0.01)
+        worst = max(worst, loop.time() - start - 0.01)
+    return worst
+
+
+async def measure(name: str, factory, menus: int):
+    gc.collect()
+    tracemalloc.start()
+    timers = factory()
+    keys = [f"modes:{index}:{index}" for index in range(menus)]
+
+    start = time.perf_counter()
+    for key in keys:
+        timers.schedule(key)
+    schedule_time = time.perf_counter() - start
+    # Let tasks start so their frames count towards memory
+    await asyncio.sleep(0)
+    memory, _ = tracemalloc.get_traced_memory()
+
+    lag = await loop_lag()
+
+    start = time.perf_counter()
+    for key in keys:
+        timers.schedule(key)
+    reset_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for key in keys:
+        timers.cancel(key)
+    cancel_time = time.perf_counter() - start
+    await asyncio.sleep(0)
+    tracemalloc.stop()
+
+    print(
+        f"{name:12} memory={memory / 1024 / 1024:7.1f} MiB "
+        f"schedule={schedule_time * 1e6 / menus:5.2f} us "
+        f"reset={reset_time * 1e6 / menus:5.2f} us "
+        f"cancel={cancel_time * 1e6 / menus:5.2f} us "
+        f"loop_lag={lag * 1000:6.2f} ms"
+    )
+    if isinstance(timers, Wheel):
+        await timers.wheel.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--menus", type=int, default=100_000)
+    args = parser.parse_args()
+
+    await measure("task/menu", TaskPerMenu, args.menus)
+    await measure("call_later", CallLaterPerMenu, args.menus)
+    await measure("timer wheel", Wheel, args.menus)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,222 @@
+# benchmarks/bench_ollama_stream.py
+#
+# Compares ways of reading Ollama's streamed /api/chat responses:
+#
+#   legacy     the old streaming_response.generate: a new ClientSession per
+#              request, `buffer += chunk` and `buffer.split(b"\n", 1)`
+#   ollama     ollama.AsyncClient.chat(stream=True), the previous transport
+#   streaming  StreamingClient: shared keep-alive pool, bytearray framing
+#
+# "decode" feeds pre-built NDJSON through the framing code alone; "http"
+# streams from a local server that sends chunks as fast as it can:
+#
+#   python -m benchmarks.bench_ollama_stream --chunks 2000 --requests 200
+
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+import aiohttp
+from aiohttp import web
+from ollama import AsyncClient
+
+from bot.helpers.streaming_response import (
+    JSON_DECODER,
+    NDJSONDecoder,
+    StreamingClient,
+)
+
+
+def make_lines(count: int) -> bytes:
+    chunk = {
+        "model": "llama3.1:8b",
+        "created_at": "2024-09-01T12:00:00.000000Z",
+        "message": {"role": "assistant", "content": " token"},
+        "done": False,
+    }
+    final = {**chunk, "message": {"role": "assistant", "content": ""}, "done": True}
+    body = (json.dumps(chunk).encode() + b"\n") * (count - 1)
+    return body + json.dumps(final).encode() + b"\n"
+
+
+def split_legacy(pieces):
+    count = 0
+    buffer = b""
+    for piece in pieces:
+        buffer += piece
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            line = line.strip()
+            if line:
+                json.loads(line)
+                count += 1
+    return count
+
+
+def split_decoder(pieces):
+    count = 0
+    decoder = NDJSONDecoder()
+    for piece in pieces:
+        count += len(decoder.feed(piece))
+    return count + len(decoder.flush())
+
+
+def measure(run, *args) -> dict:
+    start_time = time.perf_counter()
+    result = run(*args)
+    elapsed = time.perf_counter() - start_time
+    # Allocations are measured on a second run, as tracing slows it down
+    tracemalloc.start()
+    run(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"result": result, "seconds": elapsed, "peak_bytes": peak}
+
+
+def bench_decode(chunks: int, piece_sizes):
+    body = make_lines(chunks)
+    for piece_size in piece_sizes:
+        pieces = [
+            body[start : start + piece_size]
+            for start in range(0, len(body), piece_size)
+        ]
+        for name, run in (("legacy", split_legacy), ("streaming", split_decoder)):
+            stats = measure(run, pieces)
+            rate = stats["result"] / stats["seconds"]
+            print(
+                f"decode {name:9} pieces={piece_size:>7,}B "
+                f"{rate:>12,.0f} chunks/s  peak={stats['peak_bytes'] / 1024:8.1f} KiB"
+            )
+
+
+class BurstServer:
+    """
+    Streams a fixed NDJSON reply in 16 KiB writes and counts connections.
+    """
+
+    def __init__(self, port: int, body: bytes):
+        self.port = port
+        self.body = body
+        self.transports = set()
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/chat", self._chat)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    async def _chat(self, request: web.Request):
+        await request.read()
+        self.transports.add(id(request.transport))
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+        for start in range(0, len(self.body), 16384):
+            await response.write(self.body[start : start + 16384])
+        await response.write_eof()
+        return response
+
+
+async def stream_legacy(url: str, payload: dict) -> int:
+    count = 0
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{url}/api/chat", json=payload) as response:
+            buffer = b""
+            async for piece in response.content.iter_any():
+                buffer += piece
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    line = line.strip()
+                    if line:
+                        json.loads(line)
+                        count += 1
+    return count
+
+
+async def run_http(name: str, url: str, requests: int, concurrency: int) -> dict:
+    payload = {"model": "llama3.1:8b", "messages": [], "stream": True}
+    if name == "ollama":
+        client = AsyncClient(host=url)
+
+        async def one() -> int:
+            count = 0
+            async for _ in await client.chat(
+                model="llama3.1:8b", messages=[], stream=True
+            ):
+                count += 1
+            return count
+
+    elif name == "streaming":
+        client = StreamingClient(pool_size=64, keepalive=60, timeout=300)
+
+        async def one() -> int:
+            count = 0
+            async for _ in client.chat(url, model="llama3.1:8b", messages=[]):
+                count += 1
+            return count
+
+    else:
+
+        async def one() -> int:
+            return await stream_legacy(url, payload)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited() -> int:
+        async with semaphore:
+            return await one()
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    counts = await asyncio.gather(*(limited() for _ in range(requests)))
+    elapsed = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if name == "streaming":
+        await client.close()
+    return {"chunks": sum(counts), "seconds": elapsed, "peak_bytes": peak}
+
+
+async def bench_http(chunks: int, requests: int, concurrency: int, port: int):
+    server = BurstServer(port, make_lines(chunks))
+    await server.start()
+    url = f"http://127.0.0.1:{port}"
+    try:
+        for name in ("legacy", "ollama", "streaming"):
+            server.transports.clear()
+            # Allocation tracing slows every variant alike, so the rates
+            # stay comparable with each other
+            stats = await run_http(name, url, requests, concurrency)
+            rate = stats["chunks"] / stats["seconds"]
+            print(
+                f"http   {name:9} {rate:>12,.0f} chunks/s  "
+                f"connections={len(server.transports):4}  "
+                f"peak={stats['peak_bytes'] / 1024:8.1f} KiB"
+            )
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama stream client benchmark")
+    parser.add_argument("--chunks", type=int, default=2000, help="per response")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8586)
+    args = parser.parse_args()
+
+    print(f"JSON decoder: {JSON_DECODER}")
+    bench_decode(args.chunks, (64, 4096, 65536, 1 << 20))
+    asyncio.run(bench_http(args.chunks, args.requests, args.concurrency, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/bench_stream_renderer.py
+#
+# Compares the old "full_response += chunk, edit with the whole text" loop with
+# StreamRenderer on long generated answers:
+#
+#   python -m benchmarks.bench_stream_renderer --tokens 8000
+
+import argparse
+import random
+import time
+
+from aiogram.enums.parse_mode import ParseMode
+
+from bot.helpers.stream_renderer import TELEGRAM_PAGE_LIMIT, StreamRenderer
+
+WORDS = ["model", "token", "stream", "reply", "answer", "cache", "python", "the", "a"]
+
+
+def fake_tokens(count: int, parse_mode, seed: int = 1):
+    """
+    Yields token-sized chunks with some markup and line breaks sprinkled in.
+    """
+    rng = random.Random(seed)
+    bold = ("<b>", "</b>") if parse_mode == ParseMode.HTML else ("*", "*")
+    for index in range(count):
+        token = " " + rng.choice(WORDS)
+        if index % 50 == 10:
+            token = " " + bold[0]
+        elif index % 50 == 14:
+            token = bold[1]
+        elif index % 40 == 39:
+            token += ".\n"
+        yield token
+
+
+def run_legacy(tokens, edit_every: int):
+    full_response = ""
+    payload_chars = 0
+    max_payload = 0
+    edits = 0
+    for index, token in enumerate(tokens):
+        full_response += token
+        if index % edit_every == 0:
+            payload_chars += len(full_response)
+            max_payload = max(max_payload, len(full_response))
+            edits += 1
+    payload_chars += len(full_response)
+    max_payload = max(max_payload, len(full_response))
+    return {
+        "edits": edits + 1,
+        "payload_chars": payload_chars,
+        "max_payload": max_payload,
+        "messages": 1,
+    }
+
+
+def run_renderer(tokens, edit_every: int, parse_mode):
+    renderer = StreamRenderer(parse_mode)
+    payload_chars = 0
+    max_payload = 0
+    edits = 0
+    sealed = 0
+    for index, token in enumerate(tokens):
+        renderer.append(token)
+        # Each sealed page gets exactly one final edit
+        while sealed < len(renderer.pages):
+            payload_chars += len(renderer.pages[sealed])
+            sealed += 1
+            edits += 1
+        if index % edit_every == 0:
+            text = renderer.tail_text()
+            payload_chars += len(text)
+            max_payload = max(max_payload, len(text))
+            edits += 1
+    renderer.finish()
+    text = renderer.tail_text()
+    payload_chars += len(text)
+    max_payload = max(max_payload, len(text), *map(len, renderer.pages or [""]))
+    return {
+        "edits": edits + 1,
+        "payload_chars": payload_chars,
+        "max_payload": max_payload,
+        "messages": len(renderer.pages) + 1,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming renderer benchmark")
+    parser.add_argument("--tokens", type=int, default=8000)
+    parser.add_argument("--edit-every", type=int, default=20, help="tokens per edit")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for parse_mode in (ParseMode.HTML, ParseMode.MARKDOWN):
+        tokens = list(fake_tokens(args.tokens, parse_mode))
+        for name, run in (
+            ("legacy", lambda: run_legacy(tokens, args.edit_every)),
+            ("renderer", lambda: run_renderer(tokens, args.edit_every, parse_mode)),
+        ):
+            start_time = time.perf_counter()
+            for _ in range(args.repeat):
+                result = run()
+            elapsed = (time.perf_counter() - start_time) / args.repeat
+            over_limit = result["max_payload"] > TELEGRAM_PAGE_LIMIT
+            note = "  (over Telegram limit)" if over_limit else ""
+            print(
+                f"{parse_mode.value:8} {name:8} {elapsed * 1000:8.2f} ms  "
+                f"edits={result['edits']:5}  messages={result['messages']:3}  "
+                f"payload={result['payload_chars']:>10,} chars  "
+                f"max={result['max_payload']:6}{note}"
+            )
+
+
+if __name__ == "__main__":
+    main()
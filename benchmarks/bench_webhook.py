@@ -0,0 +1,126 @@
+# benchmarks/bench_webhook.py
+#
+# Update-to-first-reply latency with long polling versus the webhook server,
+# against the in-process fake Bot API. The handler answers right away, so the
+# numbers show delivery overhead only, not generation time:
+#
+#   python -m benchmarks.bench_webhook --updates 500 --rate 100 --rtt 0.05
+
+import argparse
+import asyncio
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import web
+
+from benchmarks.fake_telegram import FakeTelegramAPI
+from bot.webhook import UpdateWorkerPool, create_webhook_app
+from config.config_loader import (
+    WEBHOOK_PATH,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+)
+
+BENCH_TOKEN = "123456:bench"
+
+
+def make_dispatcher() -> Dispatcher:
+    dispatcher = Dispatcher()
+    router = Router()
+
+    @router.message()
+    async def echo(message: Message):
+        await message.answer("pong")
+
+    dispatcher.include_router(router)
+    return dispatcher
+
+
+def summarize(name: str, latencies: list, expected: int):
+    if not latencies:
+        print(f"{name:8} no replies")
+        return
+    ms = [latency * 1000 for latency in latencies]
+    print(
+        f"{name:8} replies={len(ms)}/{expected} "
+        f"p50={ms[len(ms) // 2]:.1f}ms "
+        f"p95={ms[int(len(ms) * 0.95) - 1]:.1f}ms "
+        f"max={ms[-1]:.1f}ms"
+    )
+
+
+async def push_updates(
+    fake: FakeTelegramAPI, count: int, rate: float, first_chat: int
+):
+    for index in range(count):
+        await fake.push_update(first_chat + index, f"ping {index}")
+        await asyncio.sleep(1 / rate)
+    # Give the last replies time to arrive
+    await asyncio.sleep(1)
+
+
+async def bench_polling(fake: FakeTelegramAPI, count: int, rate: float):
+    bot = Bot(
+        BENCH_TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(fake.base_url)),
+    )
+    dispatcher = make_dispatcher()
+    polling = asyncio.create_task(dispatcher.start_polling(bot, handle_signals=False))
+    await asyncio.sleep(0.5)
+    await push_updates(fake, count, rate, first_chat=100_000)
+    await dispatcher.stop_polling()
+    await polling
+    await bot.session.close()
+
+
+async def bench_webhook(fake: FakeTelegramAPI, count: int, rate: float, port: int):
+    bot = Bot(
+        BENCH_TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(fake.base_url)),
+    )
+    dispatcher = make_dispatcher()
+    pool = UpdateWorkerPool(dispatcher, bot, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    runner = web.AppRunner(create_webhook_app(dispatcher, bot, pool))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    await bot.set_webhook(
+        f"http://127.0.0.1:{port}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None
+    )
+    await push_updates(fake, count, rate, first_chat=200_000)
+    await bot.delete_webhook()
+    await runner.cleanup()
+    await bot.session.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=100, help="updates per second")
+    parser.add_argument("--port", type=int, default=8582, help="webhook port")
+    parser.add_argument(
+        "--rtt", type=float, default=0.0, help="simulated Bot API round trip (s)"
+    )
+    args = parser.parse_args()
+
+    fake = FakeTelegramAPI(rtt=args.rtt)
+    await fake.start()
+    try:
+        await bench_polling(fake, args.updates, args.rate)
+        polling = fake.latencies()
+        fake.replied_at.clear()
+        fake.sent_at.clear()
+
+        await bench_webhook(fake, args.updates, args.rate, args.port)
+        webhook = fake.latencies()
+    finally:
+        await fake.close()
+
+    summarize("polling", polling, args.updates)
+    summarize("webhook", webhook, args.updates)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
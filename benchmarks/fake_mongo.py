@@ -0,0 +1,304 @@
+# benchmarks/fake_mongo.py
+#
+# In-memory stand-in for the Motor collections BotDatabase uses, so load tests
+# run without a MongoDB server. It covers only the queries and update
+# operators the bot issues, and counts every call so benchmarks can report
+# database operations per message.
+#
+#   fake = install(db)  # swaps db's collections for in-memory ones
+
+import copy
+from collections import Counter
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument, UpdateMany
+from pymongo.errors import DuplicateKeyError
+from pymongo.results import UpdateResult
+
+_COMPARISONS = {
+    "$gt": lambda value, bound: value is not None and value > bound,
+    "$gte": lambda value, bound: value is not None and value >= bound,
+    "$lt": lambda value, bound: value is not None and value < bound,
+    "$lte": lambda value, bound: value is not None and value <= bound,
+    "$ne": lambda value, bound: value != bound,
+    "$in": lambda value, bound: value in bound,
+}
+
+
+def field_values(document: dict, field: str) -> list:
+    """
+    Values a dotted path reaches, descending into arrays like "messages.seq".
+    """
+    values = [document]
+    for part in field.split("."):
+        found = []
+        for value in values:
+            items = value if isinstance(value, list) else [value]
+            found += [
+                item[part] for item in items if isinstance(item, dict) and part in item
+            ]
+        values = found
+    return values
+
+
+def matches(document: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+            continue
+        if "." in field:
+            values = field_values(document, field)
+        else:
+            values = [document.get(field)]
+        if isinstance(condition, dict) and condition and all(
+            key.startswith("$") for key in condition
+        ):
+            for operator, bound in condition.items():
+                if operator == "$ne":
+                    # No reached value may equal the bound
+                    if bound in values:
+                        return False
+                elif not any(
+                    _COMPARISONS[operator](value, bound) for value in values or [None]
+                ):
+                    return False
+        elif condition not in values:
+            return False
+    return True
+
+
+def project(document: dict, projection) -> dict:
+    if not projection:
+        return copy.deepcopy(document)
+    slices = {
+        field: spec["$slice"]
+        for field, spec in projection.items()
+        if isinstance(spec, dict)
+    }
+    flags = {
+        field: spec for field, spec in projection.items() if field not in slices
+    }
+    if any(flags.values()):
+        # Inclusion projection, _id is kept unless excluded
+        fields = {field for field, spec in flags.items() if spec} | {"_id"}
+        fields |= slices.keys()
+        if not flags.get("_id", 1):
+            fields.discard("_id")
+        result = {key: value for key, value in document.items() if key in fields}
+    else:
+        result = {
+            key: value for key, value in document.items() if key not in flags
+        }
+    for field, count in slices.items():
+        if field in result:
+            items = result[field]
+            result[field] = items[count:] if count < 0 else items[:count]
+    return copy.deepcopy(result)
+
+
+def apply_update(document: dict, update: dict, inserting: bool):
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        for field, value in fields.items():
+            value = copy.deepcopy(value)
+            if operator in ("$set", "$setOnInsert"):
+                document[field] = value
+            elif operator == "$unset":
+                document.pop(field, None)
+            elif operator == "$inc":
+                document[field] = document.get(field, 0) + value
+            elif operator == "$max":
+                if field not in document or value > document[field]:
+                    document[field] = value
+            elif operator == "$push":
+                each = isinstance(value, dict) and "$each" in value
+                items = value["$each"] if each else [value]
+                document.setdefault(field, []).extend(items)
+            else:
+                raise NotImplementedError(f"Update operator {operator}")
+
+
+class FakeCursor:
+    def __init__(self, documents: list, projection):
+        self._documents = documents
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        self._documents.sort(
+            key=lambda document: document.get(key), reverse=direction < 0
+        )
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _results(self) -> list:
+        documents = self._documents[: self._limit or None]
+        return [project(document, self._projection) for document in documents]
+
+    async def to_list(self, length=None):
+        return self._results()[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._results():
+            yield document
+
+
+class FakeCollection:
+    def __init__(self, name: str, ops: Counter):
+        self.name = name
+        self.documents = {}  # _id -> document
+        self._ops = ops
+
+    def _count(self, method: str):
+        self._ops[f"{self.name}.{method}"] += 1
+
+    def _find(self, query: dict) -> list:
+        if "_id" in query and not isinstance(query["_id"], dict):
+            document = self.documents.get(query["_id"])
+            return [document] if document and matches(document, query) else []
+        return [
+            document for document in self.documents.values() if matches(document, query)
+        ]
+
+    def _upsert(self, query: dict, update: dict):
+        document = {
+            field: value
+            for field, value in query.items()
+            if not isinstance(value, (dict, list))
+        }
+        apply_update(document, update, inserting=True)
+        document.setdefault("_id", ObjectId())
+        # Like MongoDB, an upsert whose filter missed an existing _id fails
+        if document["_id"] in self.documents:
+            raise DuplicateKeyError(f"Duplicate _id {document['_id']}")
+        self.documents[document["_id"]] = document
+        return document
+
+    async def create_index(self, keys, **kwargs):
+        self._count("create_index")
+        return str(keys)
+
+    async def insert_one(self, document: dict):
+        self._count("insert_one")
+        if document.get("_id") in self.documents:
+            raise DuplicateKeyError(f"Duplicate _id {document['_id']}")
+        self.documents[document["_id"]] = copy.deepcopy(document)
+
+    async def find_one(self, query: dict = None, projection=None):
+        self._count("find_one")
+        found = self._find(query or {})
+        return project(found[0], projection) if found else None
+
+    def find(self, query: dict = None, projection=None):
+        self._count("find")
+        return FakeCursor(self._find(query or {}), projection)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        self._count("update_one")
+        return self._update_one(query, update, upsert)
+
+    def _update_one(self, query: dict, update: dict, upsert: bool) -> UpdateResult:
+        found = self._find(query)
+        if found:
+            apply_update(found[0], update, inserting=False)
+            return UpdateResult({"n": 1, "nModified": 1}, acknowledged=True)
+        if upsert:
+            document = self._upsert(query, update)
+            return UpdateResult(
+                {"n": 1, "nModified": 0, "upserted": document["_id"]},
+                acknowledged=True,
+            )
+        return UpdateResult({"n": 0, "nModified": 0}, acknowledged=True)
+
+    async def find_one_and_update(
+        self,
+        query: dict,
+        update: dict,
+        projection=None,
+        upsert: bool = False,
+        return_document=ReturnDocument.BEFORE,
+    ):
+        self._count("find_one_and_update")
+        found = self._find(query)
+        if found:
+            before = copy.deepcopy(found[0])
+            apply_update(found[0], update, inserting=False)
+            after = found[0]
+        elif upsert:
+            before, after = None, self._upsert(query, update)
+        else:
+            return None
+        result = after if return_document == ReturnDocument.AFTER else before
+        return project(result, projection) if result is not None else None
+
+    async def find_one_and_delete(self, query: dict, projection=None):
+        self._count("find_one_and_delete")
+        found = self._find(query)
+        if not found:
+            return None
+        del self.documents[found[0]["_id"]]
+        return project(found[0], projection)
+
+    async def delete_one(self, query: dict):
+        self._count("delete_one")
+        found = self._find(query)
+        if found:
+            del self.documents[found[0]["_id"]]
+
+    async def delete_many(self, query: dict):
+        self._count("delete_many")
+        for document in self._find(query):
+            del self.documents[document["_id"]]
+
+    async def bulk_write(self, requests: list, ordered: bool = True):
+        self._count("bulk_write")
+        # pymongo's UpdateOne and UpdateMany keep their arguments in private
+        # attributes
+        for request in requests:
+            if isinstance(request, UpdateMany):
+                for document in self._find(request._filter):
+                    apply_update(document, request._doc, inserting=False)
+            else:
+                self._update_one(request._filter, request._doc, bool(request._upsert))
+
+    async def index_information(self) -> dict:
+        self._count("index_information")
+        return {}
+
+    async def drop_index(self, name: str):
+        self._count("drop_index")
+
+
+class FakeMongo:
+    def __init__(self):
+        self.ops = Counter()  # "collection.method" -> calls
+        self.collections = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.ops)
+        return self.collections[name]
+
+    def total_ops(self) -> int:
+        return sum(self.ops.values())
+
+
+def install(database, fake: FakeMongo = None) -> FakeMongo:
+    """
+    Replaces every Motor collection attribute of `database` with a fake one.
+    Pass the `fake` of another database to let both share the same data.
+    """
+    fake = fake or FakeMongo()
+    for attribute, value in list(vars(database).items()):
+        if isinstance(value, AsyncIOMotorCollection):
+            setattr(database, attribute, fake[value.name])
+    return fake
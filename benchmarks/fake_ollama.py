@@ -0,0 +1,164 @@
+# benchmarks/fake_ollama.py
+#
+# In-process stand-in for the Ollama HTTP API. /api/chat streams NDJSON
+# chunks at a fixed token rate, the way a GPU-bound model would, and the
+# model list, load/unload, health and embedding endpoints answer right away.
+# Point the bot at it with OLLAMA_HOSTS=http://127.0.0.1:<port>.
+
+import asyncio
+import hashlib
+import json
+import time
+
+from aiohttp import web
+
+WORDS = ["model", "token", "stream", "reply", "answer", "cache", "python", "the", "a"]
+EMBEDDING_SIZE = 64
+
+
+class FakeOllama:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8583,
+        tokens_per_sec: float = 50.0,
+        reply_tokens: int = 100,
+        models=("llama3.1:8b",),
+    ):
+        self.host = host
+        self.port = port
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.models = list(models)
+        self.loaded = set()
+        self.calls = {}  # endpoint -> count
+        self.active_streams = 0
+        # Streamed instead of the reply when set, as Ollama does for model errors
+        self.stream_error = None
+        self.max_active_streams = 0
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/chat", self._chat)
+        app.router.add_post("/api/generate", self._generate)
+        app.router.add_post("/api/embeddings", self._embeddings)
+        app.router.add_get("/api/tags", self._tags)
+        app.router.add_get("/api/ps", self._ps)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    def _count(self, endpoint: str):
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def _model_info(self, name: str) -> dict:
+        return {
+            "name": name,
+            "model": name,
+            "size": 4_000_000_000,
+            "digest": hashlib.sha256(name.encode()).hexdigest(),
+            "details": {"family": "llama", "parameter_size": "8B"},
+        }
+
+    async def _tags(self, request: web.Request):
+        self._count("tags")
+        return web.json_response(
+            {"models": [self._model_info(name) for name in self.models]}
+        )
+
+    async def _ps(self, request: web.Request):
+        self._count("ps")
+        return web.json_response(
+            {"models": [self._model_info(name) for name in sorted(self.loaded)]}
+        )
+
+    async def _generate(self, request: web.Request):
+        # The bot only uses generate with an empty prompt, to load or unload
+        self._count("generate")
+        body = await request.json()
+        if body.get("keep_alive") == 0:
+            self.loaded.discard(body["model"])
+        else:
+            self.loaded.add(body["model"])
+        return web.json_response(
+            {"model": body["model"], "response": "", "done": True}
+        )
+
+    async def _embeddings(self, request: web.Request):
+        self._count("embeddings")
+        body = await request.json()
+        # Same prompt, same vector, so the response cache can hit
+        digest = hashlib.sha256(body.get("prompt", "").encode()).digest()
+        embedding = [
+            (digest[index % len(digest)] - 128) / 128
+            for index in range(EMBEDDING_SIZE)
+        ]
+        return web.json_response({"embedding": embedding})
+
+    async def _chat(self, request: web.Request):
+        self._count("chat")
+        body = await request.json()
+        model = body["model"]
+        if model not in self.models:
+            # What Ollama answers for a model it does not have
+            return web.json_response(
+                {"error": f"model '{model}' not found, try pulling it first"},
+                status=404,
+            )
+        load_duration = 0 if model in self.loaded else 1_000_000
+        self.loaded.add(model)
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+        self.active_streams += 1
+        self.max_active_streams = max(self.max_active_streams, self.active_streams)
+        started = time.perf_counter_ns()
+        try:
+            if self.stream_error is not None:
+                error = {"error": self.stream_error}
+                await response.write(json.dumps(error).encode() + b"\n")
+                await response.write_eof()
+                return response
+            for index in range(self.reply_tokens):
+                await asyncio.sleep(1 / self.tokens_per_sec)
+                chunk = {
+                    "model": model,
+                    "message": {
+                        "role": "assistant",
+                        "content": " " + WORDS[index % len(WORDS)],
+                    },
+                    "done": False,
+                }
+                await response.write(json.dumps(chunk).encode() + b"\n")
+            final = {
+                "model": model,
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "done_reason": "stop",
+                "total_duration": time.perf_counter_ns() - started,
+                "load_duration": load_duration,
+                "prompt_eval_count": sum(
+                    len(message.get("content", "")) // 4
+                    for message in body.get("messages", [])
+                ),
+                "eval_count": self.reply_tokens,
+                "eval_duration": int(self.reply_tokens / self.tokens_per_sec * 1e9),
+            }
+            await response.write(json.dumps(final).encode() + b"\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The bot closed the stream, e.g. after a Stop press
+            pass
+        finally:
+            self.active_streams -= 1
+        return response
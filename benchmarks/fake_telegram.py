@@ -0,0 +1,296 @@
+# benchmarks/fake_telegram.py
+#
+# Minimal in-process stand-in for the Telegram Bot API, enough for aiogram to
+# poll updates, register webhooks and send or edit messages. Point a Bot at it
+# with TelegramAPIServer.from_base(fake.base_url).
+#
+# `rtt` adds a network round trip to every API call, and half of one to each
+# webhook delivery, to approximate a bot far from api.telegram.org.
+# `retry_after_rate` answers that share of sendMessage and editMessageText
+# calls with 429 Too Many Requests, as Telegram does under flood control.
+
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import ClientSession, web
+
+
+class FakeTelegramAPI:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8581,
+        rtt: float = 0.0,
+        retry_after_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: int = 1,
+    ):
+        self.host = host
+        self.port = port
+        self.rtt = rtt
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.retry_after_sent = 0
+        self._random = random.Random(seed)
+        self.updates = []
+        self._new_update = asyncio.Condition()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self.calls = {}  # method -> count
+        # chat_id -> monotonic time of the first bot message after an update
+        self.replied_at = {}
+        self.sent_at = {}  # chat_id -> monotonic time the update was delivered
+        # chat_id -> every message the bot sent, edited or deleted, in order
+        self.outgoing = {}
+        self._outgoing_changed = asyncio.Condition()
+        self.texts = {}  # (chat_id, message_id) -> current text
+        self.chat_admins = {}  # chat_id -> ids of its admins
+        self.callback_answers = []  # texts of answered callback queries
+        self.webhook_url = None
+        self.webhook_secret = None
+        self._runner = None
+        self._client = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._client = ClientSession()
+
+    async def close(self):
+        await self._client.close()
+        await self._runner.cleanup()
+
+    def make_update(self, chat_id: int, text: str) -> dict:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(chat_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(command)}
+            ]
+        return {"update_id": update_id, "message": message}
+
+    def make_callback_update(self, chat_id: int, message_id: int, data: str) -> dict:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(chat_id),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                    "text": self.texts.get((chat_id, message_id), ""),
+                },
+            },
+        }
+
+    def _user(self, chat_id: int) -> dict:
+        return {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+
+    async def push_update(self, chat_id: int, text: str):
+        """
+        Delivers an update: over the webhook if one is registered, otherwise
+        to the next getUpdates call.
+        """
+        self.sent_at[chat_id] = time.monotonic()
+        return await self._deliver(self.make_update(chat_id, text))
+
+    async def push_callback(self, chat_id: int, message_id: int, data: str):
+        """
+        Delivers an inline button press on the bot's message `message_id`.
+        """
+        return await self._deliver(
+            self.make_callback_update(chat_id, message_id, data)
+        )
+
+    async def _deliver(self, update: dict):
+        if self.webhook_url:
+            await asyncio.sleep(self.rtt / 2)
+            headers = {}
+            if self.webhook_secret:
+                headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+            async with self._client.post(
+                self.webhook_url, json=update, headers=headers
+            ) as response:
+                return response.status
+        async with self._new_update:
+            self.updates.append(update)
+            self._new_update.notify_all()
+        return 200
+
+    async def wait_for(
+        self, chat_id: int, predicate, start: int = 0, timeout: float = 60
+    ) -> dict:
+        """
+        Waits for the first outgoing event of `chat_id`, from index `start`
+        on, that satisfies `predicate`, and returns it.
+        """
+
+        def find():
+            events = self.outgoing.get(chat_id, [])
+            return next((e for e in events[start:] if predicate(e)), None)
+
+        async with self._outgoing_changed:
+            await asyncio.wait_for(
+                self._outgoing_changed.wait_for(find), timeout=timeout
+            )
+            return find()
+
+    def latencies(self) -> list:
+        return sorted(
+            self.replied_at[chat_id] - self.sent_at[chat_id]
+            for chat_id in self.replied_at
+            if chat_id in self.sent_at
+        )
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post())
+        if (
+            method in ("sendMessage", "editMessageText")
+            and self._random.random() < self.retry_after_rate
+        ):
+            self.retry_after_sent += 1
+            await asyncio.sleep(self.rtt)
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status=429,
+            )
+        handler = getattr(self, f"_{method}", None)
+        result = await handler(params) if handler else True
+        await asyncio.sleep(self.rtt)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _getMe(self, params):
+        return {
+            "id": 1,
+            "is_bot": True,
+            "first_name": "Bench",
+            "username": "bench_bot",
+        }
+
+    async def _getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        async with self._new_update:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self._new_update.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return list(self.updates)
+
+    async def _getChatMember(self, params):
+        user_id = int(params["user_id"])
+        admins = self.chat_admins.get(int(params["chat_id"]), ())
+        return {
+            "status": "administrator" if user_id in admins else "member",
+            "user": self._user(user_id),
+            "can_be_edited": False,
+            "is_anonymous": False,
+            "can_manage_chat": True,
+            "can_delete_messages": False,
+            "can_manage_video_chats": False,
+            "can_restrict_members": False,
+            "can_promote_members": False,
+            "can_change_info": False,
+            "can_invite_users": False,
+            "can_post_stories": False,
+            "can_edit_stories": False,
+            "can_delete_stories": False,
+        }
+
+    async def _setWebhook(self, params):
+        self.webhook_url = params["url"]
+        self.webhook_secret = params.get("secret_token")
+        return True
+
+    async def _deleteWebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    async def _record(self, chat_id: int, method: str, message_id: int, params):
+        text = params.get("text", "")
+        self.texts[(chat_id, message_id)] = text
+        event = {
+            "at": time.monotonic(),
+            "method": method,
+            "message_id": message_id,
+            "text": text,
+            "reply_markup": json.loads(params.get("reply_markup") or "null"),
+        }
+        async with self._outgoing_changed:
+            self.outgoing.setdefault(chat_id, []).append(event)
+            self._outgoing_changed.notify_all()
+
+    def _message(self, params, message_id: int = None) -> dict:
+        chat_id = int(params["chat_id"])
+        self.replied_at.setdefault(chat_id, time.monotonic())
+        if message_id is None:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    async def _sendMessage(self, params):
+        message = self._message(params)
+        await self._record(
+            message["chat"]["id"], "sendMessage", message["message_id"], params
+        )
+        return message
+
+    async def _editMessageText(self, params):
+        message = self._message(params, int(params["message_id"]))
+        await self._record(
+            message["chat"]["id"], "editMessageText", message["message_id"], params
+        )
+        return message
+
+    async def _editMessageReplyMarkup(self, params):
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        return await self._editMessageText({**params, "text": self.texts.get(key, "")})
+
+    async def _deleteMessage(self, params):
+        chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+        await self._record(chat_id, "deleteMessage", message_id, params)
+        return True
+
+    async def _answerCallbackQuery(self, params):
+        self.callback_answers.append(params.get("text", ""))
+        return True
+
+    async def _sendChatAction(self, params):
+        return True
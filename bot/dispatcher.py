@@ -1,9 +1,18 @@
 from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config.config_loader import TOKEN
+from config.config_loader import TELEGRAM_API_URL, TOKEN
 
-bot = Bot(token=TOKEN)  # Initialize the bot
+# Talk to a custom Bot API server if one is configured
+session = (
+    AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    if TELEGRAM_API_URL
+    else None
+)
+bot = Bot(token=TOKEN, session=session)  # Initialize the bot
+# main.py swaps in the configured StateStore before updates are handled
 dp = Dispatcher(storage=MemoryStorage())
 # Create the router
 router = Router()
@@ -0,0 +1,76 @@
+# bot/handlers/admin.py
+
+import asyncio
+import logging
+import time
+
+from aiogram.filters import CommandObject
+from aiogram.types import BufferedInputFile, Message
+
+from bot.dispatcher import bot
+from bot.helpers.profiler import profiler
+from config.config_loader import ADMIN_IDS, PROFILE_MAX_SECONDS
+
+# Default length of a /profile run, in seconds
+DEFAULT_PROFILE_SECONDS = 30
+
+# Stops the running profile when its time is up
+_profile_task = None
+
+
+async def _send_profile(chat_id: int):
+    samples = profiler.samples
+    seconds = time.monotonic() - profiler.started_at
+    collapsed = profiler.stop()
+    logging.info(f"Profile finished: {samples} samples over {seconds:.1f}s")
+    if not samples:
+        await bot.send_message(chat_id, "The profiler collected no samples.")
+        return
+    await bot.send_document(
+        chat_id,
+        BufferedInputFile(
+            collapsed.encode("utf-8"), filename=f"profile-{int(time.time())}.folded"
+        ),
+        caption=(
+            f"{samples} samples over {seconds:.1f}s. "
+            "Open in speedscope.app or render with flamegraph.pl."
+        ),
+    )
+
+
+async def _profile_for(chat_id: int, seconds: int):
+    await asyncio.sleep(seconds)
+    global _profile_task
+    _profile_task = None
+    await _send_profile(chat_id)
+
+
+async def command_profile_handler(message: Message, command: CommandObject):
+    """
+    /profile [seconds] samples the event loop's stacks and sends a flame
+    graph file. Sent again while running, it stops early.
+    """
+    global _profile_task
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    if profiler.running:
+        if _profile_task is not None:
+            _profile_task.cancel()
+            _profile_task = None
+        await _send_profile(message.chat.id)
+        return
+
+    try:
+        seconds = int(command.args) if command.args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        await message.answer("Usage: /profile [seconds]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    # Started from a handler, so the sampled thread is the loop thread
+    profiler.start()
+    _profile_task = asyncio.create_task(_profile_for(message.chat.id, seconds))
+    await message.answer(
+        f"Profiling for {seconds}s. Send /profile again to stop early."
+    )
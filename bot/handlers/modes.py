@@ -1,138 +1,102 @@
 # bot/handlers/modes.py
 
-import asyncio  # Import asyncio for handling timeouts
-
-import yaml
 from aiogram import types
 from aiogram.enums.parse_mode import ParseMode
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+from bot.dispatcher import bot
+from bot.helpers.group_chat import dialog_owner, is_chat_admin
+from bot.services.generations import generations
+from bot.services.menu_timeouts import menu_timeouts
+from bot.services.mode_registry import mode_registry
 from database.bot_database import BotDatabase
 
-db = BotDatabase()
-
-# Load chat modes from YAML with UTF-8 encoding
-with open("config/chat_modes.yml", "r", encoding="utf-8") as file:
-    chat_modes = yaml.safe_load(file)
+# Seconds before an unused mode menu is closed
+MODE_MENU_TIMEOUT = 10
 
 
-# Helper function to get list of (key, name) tuples
-def get_modes():
-    return [(key, value["name"]) for key, value in chat_modes.items()]
+def mode_menu_key(message: types.Message) -> str:
+    return f"modes:{message.chat.id}:{message.message_id}"
 
 
-# Function to create inline keyboard for a specific page
-def create_keyboard(page: int, per_page: int = 5):
-    modes = get_modes()
-    keyboard_buttons = []
-    start = page * per_page
-    end = start + per_page
-    for key, name in modes[start:end]:
-        # Use mode key in callback_data instead of display name
-        keyboard_buttons.append(
-            [InlineKeyboardButton(text=name, callback_data=f"mode:{key}")]
-        )
-
-    # Add navigation buttons if necessary
-    navigation_buttons = []
-    if page > 0:
-        navigation_buttons.append(
-            InlineKeyboardButton(text="⬅️ Back", callback_data=f"page:{page - 1}")
-        )
-    if end < len(modes):
-        navigation_buttons.append(
-            InlineKeyboardButton(text="➡️ Next", callback_data=f"page:{page + 1}")
-        )
-
-    # Add navigation buttons as a separate row if they exist
-    if navigation_buttons:
-        keyboard_buttons.append(navigation_buttons)
-
-    # Create the InlineKeyboardMarkup object
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    return keyboard
+async def expire_mode_menu(menu: dict):
+    # Edit the message to inform about timeout and remove the keyboard
+    await bot.edit_message_text(
+        chat_id=menu["chat_id"],
+        message_id=menu["message_id"],
+        text="Mode selection timed out. Please try again.",
+        reply_markup=None,
+    )
 
 
-# Dictionary to keep track of timeout tasks per message
-# Key: message_id, Value: asyncio.Task
-timeout_tasks = {}
+menu_timeouts.register("modes", expire_mode_menu)
 
 
 async def show_modes(message: types.Message):
     page = 0  # Start at the first page
-    keyboard = create_keyboard(page)
     sent_message = await message.answer(
-        "Select chat mode (15 modes available):", reply_markup=keyboard
+        mode_registry.menu_text, reply_markup=mode_registry.page(page)
     )
 
     # Start the timeout handler
-    start_timeout(sent_message)
+    await start_timeout(sent_message)
 
 
-def start_timeout(sent_message: types.Message):
+async def start_timeout(sent_message: types.Message):
     """Starts or restarts the timeout handler for a given message."""
-    message_id = sent_message.message_id
-
-    # If there's an existing timeout task for this message, cancel it
-    if message_id in timeout_tasks:
-        timeout_tasks[message_id].cancel()
-
-    # Define a coroutine to handle timeout
-    async def timeout_handler():
-        try:
-            await asyncio.sleep(10)  # Wait for 10 seconds
-            # Edit the message to inform about timeout and remove the keyboard
-            await sent_message.edit_text(
-                "Mode selection timed out. Please try again.", reply_markup=None
-            )
-        except asyncio.CancelledError:
-            # The timeout was reset/cancelled
-            pass
-        except Exception as e:
-            # Handle other exceptions (e.g., message already deleted)
-            print(f"Timeout handler error: {e}")
-
-    # Start the timeout_handler as a background task
-    task = asyncio.create_task(timeout_handler())
-    timeout_tasks[message_id] = task
+    await menu_timeouts.open(
+        mode_menu_key(sent_message),
+        "modes",
+        MODE_MENU_TIMEOUT,
+        chat_id=sent_message.chat.id,
+        message_id=sent_message.message_id,
+    )
 
 
 async def process_pagination(callback_query: types.CallbackQuery):
     # Extract the page number from callback data
     page = int(callback_query.data.split(":")[1])
-    keyboard = create_keyboard(page)
 
     # Edit the existing message's text and keyboard
     await callback_query.message.edit_text(
-        "Select chat mode (15 modes available):", reply_markup=keyboard
+        mode_registry.menu_text, reply_markup=mode_registry.page(page)
     )
 
     # Acknowledge the callback to remove the "loading" state
     await callback_query.answer()
 
     # Restart the timeout handler
-    start_timeout(callback_query.message)
+    await start_timeout(callback_query.message)
 
 
-async def process_mode_selection(callback_query: types.CallbackQuery):
+async def process_mode_selection(
+    callback_query: types.CallbackQuery, db: BotDatabase
+):
     # Extract the mode key from callback data
     mode_key = callback_query.data.split(":")[1]
-    mode_info = chat_modes.get(mode_key, {})
+    mode = mode_registry.get(mode_key)
 
-    if not mode_info:
+    if mode is None:
         await callback_query.answer("Selected mode not found.", show_alert=True)
         return
 
-    # Create a new dialog with the selected mode
-    user_id = callback_query.from_user.id
-    chat_mode = mode_key
-    _ = await db.create_dialog(user_id, chat_mode=chat_mode)
+    # A group's mode is shared by everyone in it, so only admins change it
+    chat = callback_query.message.chat
+    if not await is_chat_admin(bot, chat, callback_query.from_user):
+        await callback_query.answer(
+            "Only chat admins can change the group's mode.", show_alert=True
+        )
+        return
 
-    # Retrieve welcome message and parse mode, with defaults
-    welcome_message = mode_info.get("welcome_message", "Welcome!")
+    # Create a new dialog with the selected mode; in groups, the group's one
+    owner_id = await dialog_owner(db, chat, callback_query.from_user)
+    # A reply still streaming belongs to the old dialog, stop it
+    await generations.request_stop(chat.id, owner_id)
+    _ = await db.create_dialog(owner_id, chat_mode=mode.key)
 
     # Send the welcome message
-    await callback_query.message.answer(welcome_message, parse_mode=ParseMode.HTML)
+    await callback_query.message.answer(
+        mode.welcome_message, parse_mode=ParseMode.HTML
+    )
 
     # Remove the inline keyboard and inform the user
     try:
@@ -143,8 +107,5 @@ async def process_mode_selection(callback_query: types.CallbackQuery):
     # Acknowledge the callback to remove the "loading" state
     await callback_query.answer()
 
-    # Cancel any existing timeout task for this message
-    message_id = callback_query.message.message_id
-    if message_id in timeout_tasks:
-        timeout_tasks[message_id].cancel()
-        del timeout_tasks[message_id]
+    # Cancel any existing timeout for this message
+    await menu_timeouts.cancel(mode_menu_key(callback_query.message))
@@ -3,10 +3,8 @@ from aiogram.types import Message
 
 from database.bot_database import BotDatabase
 
-db = BotDatabase()
 
-
-async def command_start_handler(message: Message):
+async def command_start_handler(message: Message, db: BotDatabase):
     """
     This handler receives messages with `/start` command
     """
@@ -0,0 +1,27 @@
+# bot/handlers/stop_generation.py
+
+from aiogram import types
+
+from bot.helpers.group_chat import is_chat_admin, is_group
+from bot.services.generations import generations
+
+
+async def stop_generation(callback_query: types.CallbackQuery):
+    """
+    Handles the ⏹ Stop button on a streaming reply.
+    """
+    generation_id = callback_query.data.split(":", 1)[1]
+    chat = callback_query.message.chat
+    user = callback_query.from_user
+    # A group's reply belongs to the group; its admins may stop any of them
+    group = is_group(chat)
+    admin = group and await is_chat_admin(callback_query.bot, chat, user)
+    if generations.stop(generation_id, user.id, admin):
+        await callback_query.answer("Stopping...")
+    elif (admin or not group) and await generations.request_remote_stop(
+        chat.id, chat.id if group else user.id
+    ):
+        # Running on another replica, which alone knows who it answers
+        await callback_query.answer("Stopping...")
+    else:
+        await callback_query.answer("This reply has already finished.")
@@ -1,75 +1,144 @@
 # bot/handlers/text_input.py
 
-import yaml
 from aiogram.enums.parse_mode import ParseMode
+from aiogram.filters import CommandObject
 from aiogram.types import Message
 
+from bot.helpers.group_chat import (
+    addressed_text,
+    dialog_owner,
+    is_group,
+    speaker_name,
+)
+from bot.services.compaction import compactor
+from bot.services.group_replies import group_replies
+from bot.services.mode_registry import DEFAULT_MODE, mode_registry
 from bot.services.ollama import ollama_request
+from bot.services.response_cache import response_cache
+from config.config_loader import DIALOG_HISTORY_TURNS, GROUPS_ENABLED
 from database.bot_database import BotDatabase
 
-db = BotDatabase()
 
-# Load chat modes from YAML with UTF-8 encoding
-with open("config/chat_modes.yml", "r", encoding="utf-8") as file:
-    chat_modes = yaml.safe_load(file)
+async def open_dialog(db: BotDatabase, owner_id: int):
+    """
+    Returns (dialog_id, mode, history, summary, created) for the owner's
+    current dialog, creating one with the default mode if there is none.
+    """
+    user_data = await db.get_user(owner_id)
+    dialog_id = user_data.get("current_dialog_id")
+    dialog = await db.get_dialog(dialog_id) if dialog_id else None
+    history = []
 
+    if not dialog:
+        # If no current dialog, create one with default 'assistant' mode
+        dialog_id = await db.create_dialog(user_id=owner_id)
+        mode = mode_registry.get_or_default(DEFAULT_MODE)
+    else:
+        # Modes removed from the YAML fall back to the default one
+        mode = mode_registry.get_or_default(dialog.get("chat_mode", DEFAULT_MODE))
+        history = await db.get_recent_messages(
+            owner_id, dialog_id, DIALOG_HISTORY_TURNS
+        )
+
+    # Turns already folded into the dialog's summary are replaced by it
+    summary, history = compactor.prompt_history(dialog, history)
+    return dialog_id, mode, history, summary, not dialog
 
-async def handle_text_input(message: Message):
+
+async def handle_text_input(message: Message, db: BotDatabase):
     if message.chat.type == "private":
-        # Ensure the user exists in the database
-        user = message.from_user
-        await db.create_user(
-            user_id=user.id,
-            chat_id=message.chat.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name,
-        )
+        await answer_private(db, message, message.text)
+    elif GROUPS_ENABLED and is_group(message.chat):
+        # Only mentions of the bot and replies to it are answered
+        text = await addressed_text(message, message.bot)
+        if text:
+            submit_group_message(db, message, text)
 
-        # Get user data
-        user_data = await db.get_user(user.id)
-        dialog_id = user_data.get("current_dialog_id")
-
-        if not dialog_id:
-            # If no current dialog, create one with default 'assistant' mode
-            dialog_id = await db.create_dialog(user_id=user.id)
-            chat_mode = "assistant"
-            mode_info = chat_modes.get(chat_mode, {})
-            welcome_message = mode_info.get("welcome_message", "Welcome!")
-            parse_mode = mode_info.get("parse_mode", "html")
-            await message.answer(welcome_message, parse_mode=ParseMode.HTML)
-        else:
-            # Retrieve the current dialog
-            dialog = await db.get_dialog(dialog_id)
-            if not dialog:
-                # If dialog does not exist, create a new one
-                dialog_id = await db.create_dialog(user_id=user.id)
-                chat_mode = "assistant"
-                mode_info = chat_modes.get(chat_mode, {})
-                welcome_message = mode_info.get("welcome_message", "Welcome!")
-                parse_mode = mode_info.get("parse_mode", "html")
-                await message.answer(welcome_message, parse_mode=ParseMode.HTML)
-            else:
-                chat_mode = dialog.get("chat_mode", "assistant")
-                mode_info = chat_modes.get(chat_mode, {})
-                parse_mode = mode_info.get("parse_mode", "html")
-
-        # Get the selected mode's information
-        mode_info = chat_modes.get(chat_mode, {})
-        prompt_start = mode_info.get("prompt_start", "")
-        parse_mode = mode_info.get("parse_mode", "html")
-        if parse_mode == "markdown":
-            parse_mode = ParseMode.MARKDOWN
-        else:
-            parse_mode = ParseMode.HTML
-        # Combine prompt_start with user input
-        combined_prompt = f"{prompt_start}\n\nUser: {message.text}"
-
-        # Call the ollama_request function with the combined prompt
-        await ollama_request(
-            db,
-            parse_mode,
-            dialog_id,
-            message=message,
-            prompt=combined_prompt,
-        )
+
+async def handle_ask_command(
+    message: Message, command: CommandObject, db: BotDatabase
+):
+    """
+    /ask <question>: asks the bot without mentioning it, mainly for groups.
+    """
+    if not command.args:
+        await message.reply("Ask me something: /ask <question>")
+    elif message.chat.type == "private":
+        await answer_private(db, message, command.args)
+    elif GROUPS_ENABLED and is_group(message.chat):
+        submit_group_message(db, message, command.args)
+
+
+async def answer_private(db: BotDatabase, message: Message, text: str):
+    """
+    Answers `text` in the user's own dialog.
+    """
+    # Ensure the user exists in the database
+    user = message.from_user
+    await db.create_user(
+        user_id=user.id,
+        chat_id=message.chat.id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name,
+    )
+
+    dialog_id, mode, history, summary, created = await open_dialog(db, user.id)
+    if created:
+        await message.answer(mode.welcome_message, parse_mode=ParseMode.HTML)
+
+    # Call the ollama_request function; prompt_start is sent as the system
+    # message and the dialog history is added as far as the budget allows
+    await ollama_request(
+        db,
+        mode.parse_mode,
+        dialog_id,
+        message=message,
+        prompt=text,
+        prompt_start=mode.prompt_start,
+        history=history,
+        summary=summary,
+        cache_mode=mode.key if response_cache.enabled_for(mode) else None,
+    )
+    # Summarises older turns in the background once the history is long
+    compactor.schedule(db, user.id, dialog_id)
+
+
+def submit_group_message(db: BotDatabase, message: Message, text: str):
+    """
+    Queues a group message for the group's next reply.
+    """
+    group_replies.submit(
+        message.chat.id, (message, text), lambda items: answer_group(db, items)
+    )
+
+
+async def answer_group(db: BotDatabase, items: list):
+    """
+    Answers a batch of (message, text) from one group with a single reply in
+    the group's shared dialog, sent as a reply to the newest message.
+    """
+    # Updates are handled concurrently, so restore the order they were sent in
+    items = sorted(items, key=lambda item: item[0].message_id)
+    message = items[-1][0]
+    owner_id = await dialog_owner(db, message.chat, message.from_user)
+    dialog_id, mode, history, summary, _ = await open_dialog(db, owner_id)
+
+    # Everyone talks to the bot in one dialog, so each line names its speaker
+    prompt = "\n".join(
+        f"{speaker_name(item.from_user)}: {text}" for item, text in items
+    )
+    await ollama_request(
+        db,
+        mode.parse_mode,
+        dialog_id,
+        message=message,
+        prompt=prompt,
+        prompt_start=mode.prompt_start,
+        history=history,
+        summary=summary,
+        owner_id=owner_id,
+        # Everyone answered may stop the reply and shares its usage
+        askers=tuple(dict.fromkeys(item.from_user.id for item, _ in items)),
+    )
+    compactor.schedule(db, owner_id, dialog_id)
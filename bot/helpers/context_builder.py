@@ -0,0 +1,143 @@
+# bot/helpers/context_builder.py
+
+import logging
+
+from bot.helpers.metrics import metrics
+from config.config_loader import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TRIM_STEP,
+    MODEL_CONTEXT_BUDGETS,
+)
+
+# Rough characters-per-token ratio used when we have no tokenizer at hand
+CHARS_PER_TOKEN = 4
+# Per-message overhead added by the chat template (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Older dialogs stored the user text glued behind the mode prompt
+LEGACY_PROMPT_MARKER = "\n\nUser: "
+
+# Puts the rolling summary of compacted turns after the mode's system prompt
+SUMMARY_HEADER = "\n\nSummary of the conversation so far:\n"
+
+# Buckets for prompt sizes, in tokens
+PROMPT_TOKEN_BUCKETS = (0, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+prompt_reused_tokens = metrics.histogram(
+    "ollama_prompt_reused_tokens",
+    "Prompt tokens Ollama served from its prefix cache (estimate minus evaluated)",
+    ("model",),
+    PROMPT_TOKEN_BUCKETS,
+)
+prompt_evaluated_tokens = metrics.histogram(
+    "ollama_prompt_evaluated_tokens",
+    "Prompt tokens Ollama had to evaluate (prompt_eval_count)",
+    ("model",),
+    PROMPT_TOKEN_BUCKETS,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate for budgeting. Good enough to keep us inside the
+    context window without loading a tokenizer for every model.
+    """
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def get_token_budget(model: str) -> int:
+    """
+    Returns the prompt token budget for a model, falling back to the global default.
+    """
+    return MODEL_CONTEXT_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET)
+
+
+def _message_tokens(message: dict) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_turn_tokens(turn: dict) -> int:
+    """
+    Estimated prompt tokens of one stored turn (user message and reply).
+    """
+    return sum(_message_tokens(m) for m in history_to_messages([turn]))
+
+
+def history_to_messages(history: list) -> list:
+    """
+    Converts stored dialog turns ({"user": ..., "bot": ...}) into chat messages.
+    """
+    messages = []
+    for turn in history:
+        user_text = turn.get("user", "")
+        if LEGACY_PROMPT_MARKER in user_text:
+            user_text = user_text.split(LEGACY_PROMPT_MARKER, 1)[1]
+        messages.append({"role": "user", "content": user_text})
+        messages.append({"role": "assistant", "content": turn.get("bot", "")})
+    return messages
+
+
+def build_messages(
+    prompt_start: str, history: list, user_text: str, model: str, summary: str = None
+):
+    """
+    Builds the message list sent to Ollama.
+
+    Layout is always: system prompt, past turns oldest first, new user message.
+    A summary of compacted turns is appended to the system prompt.
+    When history does not fit the budget, the oldest turns are dropped in groups
+    of CONTEXT_TRIM_STEP so the window start only moves every few turns. Between
+    trims the prompt prefix stays byte-identical and Ollama can reuse its cache.
+
+    Returns a tuple of (messages, estimated_prompt_tokens).
+    """
+    system_prompt = prompt_start.strip()
+    if summary:
+        system_prompt += SUMMARY_HEADER + summary
+    system_message = {"role": "system", "content": system_prompt}
+    user_message = {"role": "user", "content": user_text}
+
+    budget = get_token_budget(model)
+    used = _message_tokens(system_message) + _message_tokens(user_message)
+
+    turn_tokens = [estimate_turn_tokens(turn) for turn in history]
+
+    # Find the first turn we can keep, walking back from the newest
+    start = len(history)
+    total = used
+    while start > 0 and total + turn_tokens[start - 1] <= budget:
+        total += turn_tokens[start - 1]
+        start -= 1
+
+    # Snap the window start to a multiple of the trim step so it moves rarely
+    step = max(1, CONTEXT_TRIM_STEP)
+    if start % step:
+        start += step - start % step
+    start = min(start, len(history))
+
+    kept = history_to_messages(history[start:])
+    messages = [system_message, *kept, user_message]
+    estimated_tokens = used + sum(turn_tokens[start:])
+    return messages, estimated_tokens
+
+
+def record_prompt_metrics(model: str, estimated_tokens: int, final_chunk: dict):
+    """
+    Records prompt size and prefix-cache reuse from Ollama's final stream chunk.
+
+    Ollama only counts the tokens it actually had to evaluate in
+    prompt_eval_count, so anything below our estimate was served from cache.
+    """
+    evaluated = final_chunk.get("prompt_eval_count") or 0
+    eval_duration_ns = final_chunk.get("prompt_eval_duration") or 0
+    reused = max(estimated_tokens - evaluated, 0)
+
+    prompt_reused_tokens.labels(model).observe(reused)
+    prompt_evaluated_tokens.labels(model).observe(evaluated)
+
+    reuse_ratio = reused / estimated_tokens if estimated_tokens else 0.0
+    logging.debug(
+        f"Prompt for {model}: ~{estimated_tokens} tokens, {evaluated} evaluated, "
+        f"cache reuse {reuse_ratio:.0%}, prompt eval {eval_duration_ns / 1e6:.0f} ms"
+    )
@@ -0,0 +1,92 @@
+# bot/helpers/group_chat.py
+
+import re
+
+from aiogram.types import Chat, Message, User
+
+from bot.helpers.token_bucket import TokenBucket
+from config.config_loader import GROUP_MESSAGE_BURST, GROUP_MESSAGES_PER_MINUTE
+
+# Past this many groups, budgets that are full again are forgotten
+MAX_TRACKED_BUDGETS = 1000
+
+# chat_id -> TokenBucket of sends and edits
+_budgets = {}
+
+
+def is_group(chat: Chat) -> bool:
+    return chat.type in ("group", "supergroup")
+
+
+def speaker_name(user: User) -> str:
+    return user.full_name or user.username or str(user.id)
+
+
+async def dialog_owner(db, chat: Chat, user: User) -> int:
+    """
+    Id whose dialog and settings the chat uses: the user in private chats,
+    the group itself, stored like a user, in groups.
+    """
+    if not is_group(chat):
+        return user.id
+    await db.create_user(
+        user_id=chat.id,
+        chat_id=chat.id,
+        username=chat.username,
+        first_name=chat.title,
+        last_name=None,
+    )
+    return chat.id
+
+
+async def is_chat_admin(bot, chat: Chat, user: User) -> bool:
+    """
+    Whether the user may change the chat's shared settings and stop any of
+    its replies: always in private chats, only admins in groups.
+    """
+    if not is_group(chat):
+        return True
+    member = await bot.get_chat_member(chat.id, user.id)
+    return member.status in ("creator", "administrator")
+
+
+async def addressed_text(message: Message, bot) -> str:
+    """
+    The text of a group message meant for the bot, without the @mention, or
+    None when the message mentions nobody and replies to someone else.
+    """
+    text = message.text
+    if not text:
+        return None
+    me = await bot.me()
+    reply = message.reply_to_message
+    if reply is not None and reply.from_user and reply.from_user.id == me.id:
+        return text.strip()
+    mention = f"@{me.username}".casefold()
+    for entity in message.entities or ():
+        if entity.type == "mention" and entity.extract_from(text).casefold() == mention:
+            return re.sub(
+                rf"@{re.escape(me.username)}\b", "", text, flags=re.IGNORECASE
+            ).strip()
+        if entity.type == "text_mention" and entity.user and entity.user.id == me.id:
+            return text.strip()
+    return None
+
+
+def message_budget(chat_id: int) -> TokenBucket:
+    """
+    The group's budget of Telegram messages, shared by all replies there.
+    Telegram allows a bot about 20 sends and edits a minute per group and
+    answers the rest with RetryAfter.
+    """
+    budget = _budgets.get(chat_id)
+    if budget is None:
+        if len(_budgets) >= MAX_TRACKED_BUDGETS:
+            for key in [
+                key for key, bucket in _budgets.items()
+                if bucket.available() >= bucket.capacity
+            ]:
+                del _budgets[key]
+        budget = TokenBucket(GROUP_MESSAGES_PER_MINUTE / 60, GROUP_MESSAGE_BURST)
+        _budgets[chat_id] = budget
+    return budget
@@ -0,0 +1,244 @@
+# bot/helpers/metrics.py
+
+import threading
+from bisect import bisect_left
+
+# Default buckets (seconds) for latencies from milliseconds up to a few minutes
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Buckets (seconds) for fast calls such as database commands
+FAST_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. `observe` is a bisect and two additions, cheap
+    enough for every request.
+
+    Metrics are also recorded from threads (the MongoDB driver calls its
+    command listeners from its own), so updates and reads for rendering
+    hold a lock. It is uncontended almost always.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def state(self) -> tuple:
+        """
+        A consistent copy of (counts, count, sum).
+        """
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            labels = _labels(self.label_names, label_values)
+            yield f"{self.name}{labels} {_number(value)}"
+
+
+class HistogramFamily:
+    """
+    Histograms of one metric, one per combination of label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = buckets
+        self.children = {}  # label values -> Histogram
+        self._lock = threading.Lock()
+
+    def labels(self, *label_values) -> Histogram:
+        child = self.children.get(label_values)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(label_values, Histogram(self.buckets))
+        return child
+
+    def _children(self) -> list:
+        with self._lock:
+            return list(self.children.items())
+
+    def render(self):
+        for label_values, histogram in self._children():
+            counts, count, total = histogram.state()
+            cumulative = 0
+            bounds = histogram.buckets + (float("inf"),)
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = _labels(
+                    self.label_names, label_values, f'le="{_number(bound)}"'
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {_number(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class StatsHistograms(HistogramFamily):
+    """
+    Exposes the `Histogram` objects a service already keeps, read at scrape
+    time. `histograms()` maps label values (a tuple, or a single value for
+    one label) to histograms.
+    """
+
+    def __init__(self, name: str, documentation: str, histograms, labels=()):
+        super().__init__(name, documentation, labels)
+        self.histograms = histograms
+
+    def _children(self) -> list:
+        return [
+            (values if isinstance(values, tuple) else (values,), histogram)
+            for values, histogram in list(self.histograms().items())
+        ]
+
+
+class StatsGauges:
+    """
+    Exposes the numeric values of a service's `stats()` dict, read at scrape
+    time, so existing counters need no second bookkeeping.
+
+    Nested dicts are flattened into the metric name. Those named in `labels`
+    are keyed by a label value instead (a host, a model): with
+    `labels={"hosts": "host"}`, `{"hosts": {"a": {"requests": 3}}}` renders
+    as `{prefix}_hosts_requests{host="a"} 3`.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, prefix: str, documentation: str, stats, labels=None):
+        self.name = prefix
+        self.documentation = documentation
+        self.stats = stats
+        self.labels = labels or {}
+
+    def render(self):
+        # Samples of one metric must be adjacent, so group them by name
+        series = {}
+        self._collect(series, self.name, self.stats(), (), ())
+        for lines in series.values():
+            yield from lines
+
+    def _collect(self, series: dict, name: str, stats: dict, names, values):
+        for key, value in stats.items():
+            if isinstance(value, dict) and key in self.labels:
+                for label_value, child in value.items():
+                    self._collect_value(
+                        series,
+                        f"{name}_{key}",
+                        child,
+                        names + (self.labels[key],),
+                        values + (label_value,),
+                    )
+            else:
+                self._collect_value(series, f"{name}_{key}", value, names, values)
+
+    def _collect_value(self, series: dict, name: str, value, names, values):
+        if isinstance(value, dict):
+            self._collect(series, name, value, names, values)
+        # Flags such as a host's `healthy` render as 0 or 1
+        elif isinstance(value, (int, float)):
+            line = f"{name}{_labels(names, values)} {_number(value)}"
+            series.setdefault(name, []).append(line)
+
+
+class MetricsRegistry:
+    """
+    All metrics of the process, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.families = {}
+
+    def _register(self, family):
+        if family.name in self.families:
+            raise ValueError(f"Metric {family.name} is already registered")
+        self.families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(
+        self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS
+    ) -> HistogramFamily:
+        return self._register(HistogramFamily(name, documentation, labels, buckets))
+
+    def stats_histograms(
+        self, name: str, documentation: str, histograms, labels=()
+    ) -> StatsHistograms:
+        return self._register(
+            StatsHistograms(name, documentation, histograms, labels)
+        )
+
+    def stats_gauges(
+        self, prefix: str, documentation: str, stats, labels=None
+    ) -> StatsGauges:
+        return self._register(StatsGauges(prefix, documentation, stats, labels))
+
+    def render(self) -> str:
+        lines = []
+        for family in self.families.values():
+            if family.kind != "untyped":
+                lines.append(f"# HELP {family.name} {family.documentation}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+            else:
+                lines.append(f"# {family.name}: {family.documentation}")
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,88 @@
+# bot/helpers/profiler.py
+
+import sys
+import threading
+import time
+from collections import Counter
+
+from config.config_loader import PROFILE_INTERVAL_MS
+
+
+class StackSampler:
+    """
+    Statistical profiler for the event loop thread.
+
+    A background thread looks at the loop thread's current Python stack every
+    `interval` seconds and counts identical stacks. Nothing is hooked into
+    the code being profiled, so the cost is one stack walk per sample. The
+    result is in the collapsed format ("outer;inner;leaf count" per line)
+    that flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self._labels = {}  # code object -> frame label
+        self._target_thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Starts sampling the calling thread, which should be the loop thread.
+        """
+        if self.running:
+            raise RuntimeError("The profiler is already running")
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self._target_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> str:
+        """
+        Stops sampling and returns the collapsed stacks.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.collapsed()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(self._label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def _label(self, code) -> str:
+        # One label per function, so samples on different lines add up
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+profiler = StackSampler(PROFILE_INTERVAL_MS / 1000)
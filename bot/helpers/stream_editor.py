@@ -0,0 +1,297 @@
+# bot/helpers/stream_editor.py
+
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from config.config_loader import (
+    STREAM_MAX_EDIT_INTERVAL,
+    STREAM_MIN_EDIT_CHARS,
+    STREAM_MIN_EDIT_INTERVAL,
+)
+
+# Retries for final edits when Telegram keeps rate limiting us
+FINAL_EDIT_ATTEMPTS = 5
+
+# Aggregated streaming metrics across all replies
+stream_metrics = {
+    "replies": 0,
+    "edits": 0,
+    "messages": 0,
+    "retry_after": 0,
+    "final_edit_lag_seconds_total": 0.0,
+    "final_edit_lag_seconds_max": 0.0,
+}
+
+
+class StreamEditor:
+    """
+    Shows a streamed reply, rendered by a StreamRenderer, in Telegram.
+
+    The Ollama stream only calls `push()`, which never waits on Telegram. A
+    separate task edits the active message with the newest rendered text
+    when the next edit is due, so slow edits or RetryAfter waits never stall
+    token consumption. The edit cadence adapts to observed edit latency and
+    backs off after RetryAfter.
+
+    When the renderer seals a page, that message gets its final edit and a
+    new message is sent for the rest; from then on only the new message is
+    edited. Final edits drop `reply_markup`.
+
+    `min_interval` and `min_chars` set the fastest cadence. A chat-wide
+    `budget` (a TokenBucket of Telegram messages, see group_chat.py) is
+    shared with the other replies in that chat: interim edits wait for it,
+    sends and final edits always go out but are charged to it.
+    """
+
+    def __init__(
+        self,
+        bot,
+        chat_id: int,
+        message_id: int,
+        renderer,
+        reply_markup=None,
+        min_interval: float = STREAM_MIN_EDIT_INTERVAL,
+        min_chars: int = STREAM_MIN_EDIT_CHARS,
+        budget=None,
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.renderer = renderer
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.budget = budget
+        self.parse_mode = renderer.parse_mode
+        # Keyboard kept on the active message while streaming (e.g. a Stop button)
+        self.reply_markup = reply_markup
+        self.message_ids = [message_id]
+
+        self._shown = {}  # message_id -> (text, reply_markup) currently displayed
+        self._sealed = 0  # Pages that already have their final text
+        self._sent_length = 0  # Renderer length at the last edit
+        self._done = False
+        self._changed = asyncio.Event()
+        self._task = None
+
+        self._next_edit_at = 0.0
+        self._avg_edit_latency = 0.0
+        self._penalty = 1.0
+        self._generation_end = None
+        self.edits = 0
+        self.retry_after_count = 0
+
+    @property
+    def interval(self) -> float:
+        """
+        Current minimum gap between interim edits.
+        """
+        interval = max(self.min_interval, 2 * self._avg_edit_latency)
+        return min(interval * self._penalty, max(STREAM_MAX_EDIT_INTERVAL, interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def push(self):
+        """
+        Signals that the renderer has new text. Never blocks.
+        """
+        self._changed.set()
+
+    async def finish(self, suffix: str = ""):
+        """
+        Marks generation as done and waits until the final text is shown.
+        `suffix` is appended as plain text (e.g. a "stopped" note).
+        """
+        self.renderer.finish()
+        if suffix:
+            self.renderer.append(suffix)
+            self.renderer.finish()
+        self._done = True
+        self._generation_end = time.monotonic()
+        self._changed.set()
+        await self._task
+
+    async def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while not self._done:
+                await self._changed.wait()
+                self._changed.clear()
+                if self._done:
+                    break
+
+                # Wait for the cadence, but wake up right away if generation ends
+                delay = self._next_edit_at - loop.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wait_done(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                if self._done:
+                    break
+
+                await self._seal_pages()
+                if self.renderer.length - self._sent_length < self.min_chars:
+                    continue
+                await self._interim_edit()
+
+            await self._seal_pages()
+            # Always edit once more so the Stop button goes away
+            await self._final_edit(
+                self.message_ids[-1], self.renderer.tail_text() or "..."
+            )
+        finally:
+            self._record_metrics()
+
+    async def _wait_done(self):
+        while not self._done:
+            await self._changed.wait()
+            self._changed.clear()
+
+    async def _edit(self, message_id: int, text: str, parse_mode, reply_markup=None):
+        if self._shown.get(message_id) == (text, reply_markup):
+            return
+        start_time = time.monotonic()
+        await self.bot.edit_message_text(
+            chat_id=self.chat_id,
+            message_id=message_id,
+            text=text,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup,
+        )
+        latency = time.monotonic() - start_time
+        self._avg_edit_latency = 0.8 * self._avg_edit_latency + 0.2 * latency
+        self._shown[message_id] = (text, reply_markup)
+        self.edits += 1
+
+    async def _interim_edit(self):
+        loop = asyncio.get_running_loop()
+        length = self.renderer.length
+        if self.budget is not None and not self.budget.take():
+            # The chat's message budget is spent, retry once it has refilled
+            self._next_edit_at = loop.time() + self.budget.wait_time()
+            self._changed.set()
+            return
+        try:
+            await self._edit(
+                self.message_ids[-1],
+                self.renderer.tail_text(),
+                self.parse_mode,
+                self.reply_markup,
+            )
+            self._sent_length = length
+            # Ease off the RetryAfter penalty after each successful edit
+            self._penalty = max(1.0, self._penalty * 0.9)
+        except TelegramRetryAfter as e:
+            self.retry_after_count += 1
+            self._penalty = min(self._penalty * 2, 8.0)
+            logging.warning(
+                f"Rate limited on EditMessageText. Next edit in {e.retry_after} seconds."
+            )
+            self._next_edit_at = loop.time() + max(e.retry_after, self.interval)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                # The final edit decides, with a plain text fallback
+                logging.warning(f"Skipping interim edit: {e}")
+        self._next_edit_at = loop.time() + self.interval
+
+    async def _seal_pages(self):
+        """
+        Gives full pages their final text and opens a new message for the rest.
+        """
+        pages = self.renderer.pages
+        while self._sealed < len(pages):
+            index = self._sealed
+            await self._final_edit(self.message_ids[index], pages[index])
+            if len(self.message_ids) == index + 1:
+                if index + 1 < len(pages):
+                    next_text = pages[index + 1]
+                else:
+                    next_text = self.renderer.tail_text() or "..."
+                self.message_ids.append(await self._send(next_text))
+            self._sealed += 1
+
+    async def _send(self, text: str) -> int:
+        for attempt in range(FINAL_EDIT_ATTEMPTS):
+            try:
+                reply_markup = None if self._done else self.reply_markup
+                if self.budget is not None:
+                    self.budget.debit(1)
+                try:
+                    sent_message = await self.bot.send_message(
+                        chat_id=self.chat_id,
+                        text=text,
+                        parse_mode=self.parse_mode,
+                        reply_markup=reply_markup,
+                    )
+                except TelegramBadRequest:
+                    sent_message = await self.bot.send_message(
+                        chat_id=self.chat_id,
+                        text=text,
+                        parse_mode=None,
+                        reply_markup=reply_markup,
+                    )
+                self._shown[sent_message.message_id] = (text, reply_markup)
+                return sent_message.message_id
+            except TelegramRetryAfter as e:
+                self.retry_after_count += 1
+                if attempt == FINAL_EDIT_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    async def _final_edit(self, message_id: int, text: str):
+        if not text:
+            return
+        parse_mode = self.parse_mode
+        for attempt in range(FINAL_EDIT_ATTEMPTS):
+            if self.budget is not None and self._shown.get(message_id) != (text, None):
+                self.budget.debit(1)
+            try:
+                await self._edit(message_id, text, parse_mode)
+                return
+            except TelegramRetryAfter as e:
+                self.retry_after_count += 1
+                logging.warning(
+                    f"Rate limited on final EditMessageText. Waiting for {e.retry_after} seconds."
+                )
+                if attempt == FINAL_EDIT_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    return
+                if parse_mode is None:
+                    logging.error(f"TelegramBadRequest Error on final edit: {e}")
+                    raise
+                # Markup Telegram cannot parse, show the text as is instead
+                logging.warning(f"Final edit failed to parse, sending plain text: {e}")
+                parse_mode = None
+
+    def _record_metrics(self):
+        lag = 0.0
+        if self._generation_end is not None:
+            lag = time.monotonic() - self._generation_end
+        stream_metrics["replies"] += 1
+        stream_metrics["edits"] += self.edits
+        stream_metrics["messages"] += len(self.message_ids)
+        stream_metrics["retry_after"] += self.retry_after_count
+        stream_metrics["final_edit_lag_seconds_total"] += lag
+        stream_metrics["final_edit_lag_seconds_max"] = max(
+            stream_metrics["final_edit_lag_seconds_max"], lag
+        )
+        logging.debug(
+            f"Reply in chat {self.chat_id}: {self.edits} edits over "
+            f"{len(self.message_ids)} messages, {self.retry_after_count} RetryAfter, "
+            f"final edit {lag:.2f}s after generation"
+        )
@@ -0,0 +1,431 @@
+# bot/helpers/stream_renderer.py
+
+import re
+
+from aiogram.enums.parse_mode import ParseMode
+
+# Telegram rejects messages over 4096 characters; keep a margin for the
+# closing tags we append and for characters Telegram counts twice
+TELEGRAM_PAGE_LIMIT = 4000
+
+# Give up on a tag, entity or link that has not closed after this many characters
+MAX_PENDING = 256
+
+# Tags Telegram understands in HTML parse mode
+HTML_TAGS = {
+    "a",
+    "b",
+    "blockquote",
+    "code",
+    "del",
+    "em",
+    "i",
+    "ins",
+    "pre",
+    "s",
+    "span",
+    "strike",
+    "strong",
+    "tg-spoiler",
+    "u",
+}
+HTML_ENTITIES = {"&lt;", "&gt;", "&amp;", "&quot;"}
+HTML_TAG_RE = re.compile(
+    r"^<(/?)([a-zA-Z][a-zA-Z0-9-]*)"
+    r"((?:\s+[a-zA-Z-]+=(?:\"[^\"<>&]*\"|'[^'<>&]*'))*)\s*/?>$"
+)
+HTML_ENTITY_RE = re.compile(r"^&(#[0-9]{1,7}|#x[0-9a-fA-F]{1,6}|[a-zA-Z]{2,8});$")
+
+
+def escape_html(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+class PlainState:
+    """
+    No parse mode: text passes through unchanged.
+    """
+
+    balanced = True
+    idle = True
+    special = re.compile(r"\n")
+
+    def feed_char(self, ch: str) -> str:
+        return ch
+
+    def feed_text(self, text: str) -> str:
+        return text
+
+    def flush(self) -> str:
+        return ""
+
+    def closing(self) -> str:
+        return ""
+
+    def reopening(self) -> str:
+        return ""
+
+
+class HtmlState:
+    """
+    Incremental sanitiser for Telegram HTML.
+
+    Keeps a stack of open tags so interim text can be closed off, escapes
+    anything that is not a supported tag or entity, and holds back a tag or
+    entity until it is complete.
+    """
+
+    # Characters that need a closer look; anything else is copied as is
+    special = re.compile(r"[<>&\n]")
+
+    def __init__(self):
+        self.stack = []  # (name, opening tag)
+        self.pending = ""
+
+    @property
+    def balanced(self) -> bool:
+        return not self.stack and not self.pending
+
+    @property
+    def idle(self) -> bool:
+        return not self.pending
+
+    def feed_text(self, text: str) -> str:
+        return text
+
+    def feed_char(self, ch: str) -> str:
+        if self.pending.startswith("<"):
+            if ch == ">":
+                tag, self.pending = self.pending + ch, ""
+                return self._tag(tag)
+            if ch in "<\n" or len(self.pending) > MAX_PENDING:
+                literal, self.pending = escape_html(self.pending), ""
+                return literal + self.feed_char(ch)
+            self.pending += ch
+            return ""
+
+        if self.pending.startswith("&"):
+            if ch == ";":
+                entity, self.pending = self.pending + ch, ""
+                if entity in HTML_ENTITIES or HTML_ENTITY_RE.match(entity):
+                    return entity
+                return escape_html(entity)
+            if ch.isalnum() or ch == "#":
+                if len(self.pending) < 10:
+                    self.pending += ch
+                    return ""
+            literal, self.pending = escape_html(self.pending), ""
+            return literal + self.feed_char(ch)
+
+        if ch in "<&":
+            self.pending = ch
+            return ""
+        if ch == ">":
+            return "&gt;"
+        return ch
+
+    def _tag(self, tag: str) -> str:
+        match = HTML_TAG_RE.match(tag)
+        if not match:
+            return escape_html(tag)
+        closing, name = match.group(1), match.group(2).lower()
+        if name == "br":
+            return "\n"
+        if name not in HTML_TAGS:
+            return escape_html(tag)
+        if not closing:
+            self.stack.append((name, tag))
+            return tag
+        if not any(open_name == name for open_name, _ in self.stack):
+            # Stray closing tag, Telegram would reject it
+            return ""
+        output = ""
+        while self.stack:
+            open_name, _ = self.stack.pop()
+            output += f"</{open_name}>"
+            if open_name == name:
+                break
+        return output
+
+    def flush(self) -> str:
+        literal, self.pending = escape_html(self.pending), ""
+        return literal
+
+    def closing(self) -> str:
+        return "".join(f"</{name}>" for name, _ in reversed(self.stack))
+
+    def reopening(self) -> str:
+        return "".join(tag for _, tag in self.stack)
+
+
+class MarkdownState:
+    """
+    Incremental tracker for Telegram's legacy Markdown.
+
+    Legacy Markdown entities cannot nest, so the state is a single open
+    marker. Runs of `*` and backticks are held until they end so that `**`
+    (common in model output) becomes one bold marker and ``` is told apart
+    from `. Links are held back until complete.
+    """
+
+    # Characters that need a closer look; anything else is copied as is
+    special = re.compile(r"[*`_\[\n]")
+
+    def __init__(self):
+        self.open = None  # "*", "_", "`" or "```"
+        self.run = ""  # pending run of "*" or "`"
+        self.link = ""  # pending "[text](url"
+        self.previous = ""
+
+    @property
+    def balanced(self) -> bool:
+        return self.open is None and not self.run and not self.link
+
+    @property
+    def idle(self) -> bool:
+        return not self.run and not self.link
+
+    def feed_text(self, text: str) -> str:
+        self.previous = text[-1]
+        return text
+
+    def feed_char(self, ch: str) -> str:
+        output = ""
+        if self.run:
+            if ch == self.run[0]:
+                self.run += ch
+                return ""
+            output = self._resolve_run()
+
+        if self.link:
+            output += self._feed_link(ch)
+        else:
+            output += self._feed_plain(ch)
+        return output
+
+    def _feed_plain(self, ch: str) -> str:
+        output = ""
+        if ch in "*`":
+            # Resolved once the run ends, see _resolve_run
+            self.run = ch
+            return ""
+        if self.open in ("`", "```"):
+            output = ch
+        elif ch == "_":
+            if self.open == "_":
+                self.open = None
+                output = ch
+            elif self.open is None and not self.previous.isalnum():
+                self.open = "_"
+                output = ch
+            elif self.open is None:
+                # snake_case and friends
+                output = "\\_"
+            else:
+                output = ch
+        elif ch == "[" and self.open is None:
+            self.link = ch
+        else:
+            output = ch
+        self.previous = ch
+        return output
+
+    def _resolve_run(self) -> str:
+        run, self.run = self.run, ""
+        output = self._run_output(run)
+        self.previous = run[-1]
+        return output
+
+    def _run_output(self, run: str) -> str:
+        if run[0] == "`":
+            if self.open == "```":
+                if len(run) >= 3:
+                    self.open = None
+                    return "`" * (len(run) - 3) + "```"
+                return run
+            if self.open == "`":
+                self.open = None
+                return "`" + "\\`" * (len(run) - 1)
+            if self.open is None:
+                if len(run) >= 3:
+                    self.open = "```"
+                    return "```"
+                self.open = "`"
+                return "`"
+            # Inside bold or italic a backtick is plain text
+            return run
+
+        # Runs of "*"
+        if self.open in ("`", "```"):
+            return run
+        if len(run) <= 2:
+            if self.open == "*":
+                self.open = None
+                return "*"
+            if self.open is None and not self.previous.isalnum():
+                self.open = "*"
+                return "*"
+            if self.open is None:
+                return "\\*" * len(run)
+            return run
+        return "\\*" * len(run) if self.open is None else run
+
+    def _feed_link(self, ch: str) -> str:
+        self.link += ch
+        if "](" in self.link:
+            # Inside the URL part
+            if ch == ")":
+                link, self.link = self.link, ""
+                self.previous = ch
+                return link
+            if ch == "\n" or len(self.link) > MAX_PENDING:
+                return self._abandon_link()
+            return ""
+        # Inside the link text, "]" must be followed by "("
+        if self.link[-2] == "]" and ch != "(":
+            return self._abandon_link()
+        if ch in "\n[" or len(self.link) > MAX_PENDING:
+            return self._abandon_link()
+        return ""
+
+    def _abandon_link(self) -> str:
+        # Not a link after all, emit it as escaped text
+        link, self.link = self.link, ""
+        self.previous = "["
+        output = "\\["
+        for ch in link[1:]:
+            output += self.feed_char(ch)
+        return output
+
+    def flush(self) -> str:
+        output = ""
+        if self.run:
+            output += self._resolve_run()
+        if self.link:
+            output += self._abandon_link()
+        return output
+
+    def closing(self) -> str:
+        return self.open or ""
+
+    def reopening(self) -> str:
+        if self.open == "```":
+            return "```\n"
+        return self.open or ""
+
+
+def make_state(parse_mode):
+    if parse_mode == ParseMode.HTML:
+        return HtmlState()
+    if parse_mode == ParseMode.MARKDOWN:
+        return MarkdownState()
+    return PlainState()
+
+
+class StreamRenderer:
+    """
+    Turns a stream of model chunks into Telegram-sized pages.
+
+    Chunks go into an append-only buffer and are scanned once. Entity state is
+    tracked incrementally so that `tail_text()` is always valid markup: open
+    entities are closed and incomplete tags are held back. When the active
+    page would pass the Telegram limit it is sealed (preferably at the last
+    newline outside any entity) and a new page starts; only the active tail
+    page changes after that.
+    """
+
+    def __init__(self, parse_mode, page_limit: int = TELEGRAM_PAGE_LIMIT):
+        self.parse_mode = parse_mode
+        self.page_limit = page_limit
+        self.pages = []  # Sealed pages, never change again
+        self.length = 0  # Raw characters received so far
+        self._chunks = []
+        self._state = make_state(parse_mode)
+        self._parts = []
+        self._page_length = 0
+        self._safe_split = 0  # Offset of the last newline outside any entity
+        self.finished = False
+
+    def append(self, chunk: str):
+        self._chunks.append(chunk)
+        self.length += len(chunk)
+        state = self._state
+        position = 0
+        while position < len(chunk):
+            if state.idle:
+                # Copy plain stretches in one go, only markup goes char by char
+                match = state.special.search(chunk, position)
+                end = match.start() if match else len(chunk)
+                if end > position:
+                    self._emit_plain(state.feed_text(chunk[position:end]))
+                    position = end
+                    continue
+            ch = chunk[position]
+            closing, reopening = state.closing(), state.reopening()
+            output = state.feed_char(ch)
+            if output:
+                self._emit(output, closing, reopening, ch == "\n")
+            position += 1
+
+    def _emit_plain(self, text: str):
+        # Plain text does not change entity state, so it can be cut anywhere
+        closing, reopening = self._state.closing(), self._state.reopening()
+        while text:
+            room = self.page_limit - self._page_length - len(closing)
+            if room <= 0:
+                self._rollover(closing, reopening)
+                continue
+            self._parts.append(text[:room])
+            self._page_length += min(room, len(text))
+            text = text[room:]
+
+    def _emit(self, output: str, closing: str, reopening: str, newline: bool):
+        # `closing` and `reopening` describe the state before `output`, which is
+        # what the page has to be sealed with if `output` does not fit
+        new_length = self._page_length + len(output) + len(self._state.closing())
+        if new_length > self.page_limit:
+            self._rollover(closing, reopening)
+        self._parts.append(output)
+        self._page_length += len(output)
+        if newline and self._state.balanced:
+            self._safe_split = self._page_length
+
+    def _rollover(self, closing: str, reopening: str):
+        page = "".join(self._parts)
+        if self._safe_split > self.page_limit // 2:
+            # Split at the last newline where no entity was open
+            self.pages.append(page[: self._safe_split])
+            rest = page[self._safe_split :]
+        else:
+            # Close what is open here and reopen it on the next page
+            self.pages.append(page + closing)
+            rest = reopening
+        self._parts = [rest] if rest else []
+        self._page_length = len(rest)
+        self._safe_split = 0
+
+    def finish(self):
+        """
+        Flushes anything held back once the stream has ended.
+        """
+        if not self.finished:
+            closing, reopening = self._state.closing(), self._state.reopening()
+            output = self._state.flush()
+            if output:
+                self._emit(output, closing, reopening, False)
+            self.finished = True
+
+    def tail_text(self) -> str:
+        """
+        Current text of the active page with open entities closed.
+        """
+        page = "".join(self._parts)
+        # Keep the joined text so the next call only joins what came after it
+        self._parts = [page] if page else []
+        return page + self._state.closing()
+
+    def raw_text(self) -> str:
+        """
+        The model output exactly as received.
+        """
+        return "".join(self._chunks)
@@ -1,35 +1,183 @@
+# bot/helpers/streaming_response.py
+
 import json
 import logging
 
 import aiohttp
 from aiohttp import ClientTimeout
+from ollama import ResponseError
+
+from config.config_loader import (
+    OLLAMA_HTTP_KEEPALIVE,
+    OLLAMA_HTTP_POOL_SIZE,
+    TIMEOUT,
+)
+
+try:
+    # orjson parses straight from a memoryview; `pip install orjson` to use it
+    import orjson
+
+    def _loads(line: memoryview):
+        return orjson.loads(line)
+
+    JSON_DECODER = "orjson"
+except ImportError:
+
+    def _loads(line: memoryview):
+        return json.loads(bytes(line))
+
+    JSON_DECODER = "json"
+
+# An error object inside a 200 stream comes from the model (e.g. the prompt is
+# too long), so it is raised with a 4xx status: the request's fault, which
+# OllamaPool never ejects a host for
+STREAM_ERROR_STATUS = 422
+
+
+class NDJSONDecoder:
+    """
+    Splits a byte stream into newline-delimited JSON objects.
+
+    Network chunks are appended to one bytearray. Each complete line is
+    handed to the JSON decoder as a memoryview, so it is never copied, and
+    the consumed part is dropped once per chunk rather than once per line.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
 
-from config.config_loader import OLLAMA_BASE_URL
+    def feed(self, data: bytes) -> list:
+        buffer = self._buffer
+        buffer += data
+        objects = []
+        start = 0
+        with memoryview(buffer) as view:
+            while True:
+                end = buffer.find(b"\n", start)
+                if end == -1:
+                    break
+                if end > start:
+                    with view[start:end] as line:
+                        objects.append(_loads(line))
+                start = end + 1
+        if start:
+            del buffer[:start]
+        return objects
 
+    def flush(self) -> list:
+        """
+        Decodes a last line that has no trailing newline.
+        """
+        if not self._buffer.strip():
+            return []
+        with memoryview(self._buffer) as line:
+            objects = [_loads(line)]
+        self._buffer.clear()
+        return objects
 
-# This function sends the request and yields each line of the streamed response.
-async def generate(payload: dict, prompt: str, timeout: int = 60):
-    client_timeout = ClientTimeout(
-        total=int(timeout)
-    )  # Optional timeout for the request
-    url = f"http://{OLLAMA_BASE_URL}:11434/api/chat"  # Ollama API URL
 
-    async with aiohttp.ClientSession(timeout=client_timeout) as session:
+class StreamingClient:
+    """
+    Streams NDJSON responses from Ollama over one shared aiohttp session.
+
+    Connections to every host are kept alive in a single pool, so a new
+    generation skips the TCP handshake. Errors are raised as
+    `ollama.ResponseError`, like the ollama client does.
+    """
+
+    def __init__(self, pool_size: int, keepalive: float, timeout: float):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._session = None
+        self.requests = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created lazily, as the session must be made inside the running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=ClientTimeout(total=self.timeout),
+                # Nothing in the Ollama API needs cookies
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+        return self._session
+
+    async def generate(self, host: str, path: str, payload: dict):
+        """
+        POSTs `payload` to `host` + `path` and yields each streamed object.
+        """
+        if "://" not in host:
+            host = f"http://{host}"
+        url = f"{host.rstrip('/')}{path}"
+        self.requests += 1
+        decoder = NDJSONDecoder()
         try:
-            async with session.post(url, json=payload) as response:
+            async with self._get_session().post(url, json=payload) as response:
                 if response.status != 200:
-                    raise aiohttp.ClientResponseError(
-                        status=response.status, message=response.reason
+                    raise ResponseError(
+                        await self._error_text(response), response.status
                     )
-                buffer = b""
-
-                # Stream the response chunk by chunk
-                async for chunk in response.content.iter_any():
-                    buffer += chunk
-                    while b"\n" in buffer:
-                        line, buffer = buffer.split(b"\n", 1)
-                        line = line.strip()
-                        if line:
-                            yield json.loads(line)
-        except aiohttp.ClientError as e:
-            logging.error(f"Error during request: {e}")
+                async for data in response.content.iter_any():
+                    self.bytes += len(data)
+                    for chunk in decoder.feed(data):
+                        yield self._checked(chunk)
+                for chunk in decoder.flush():
+                    yield self._checked(chunk)
+        except (aiohttp.ClientError, ResponseError, ValueError) as e:
+            self.errors += 1
+            logging.debug(f"Ollama stream from {url} failed: {e!r}")
+            raise
+
+    def _checked(self, chunk: dict) -> dict:
+        self.chunks += 1
+        if "error" in chunk:
+            raise ResponseError(chunk["error"], STREAM_ERROR_STATUS)
+        return chunk
+
+    @staticmethod
+    async def _error_text(response: aiohttp.ClientResponse) -> str:
+        text = await response.text()
+        try:
+            return json.loads(text)["error"]
+        except (ValueError, KeyError, TypeError):
+            return text or str(response.reason)
+
+    def chat(self, host: str, model: str, messages: list, **options):
+        """
+        Streams /api/chat, yielding the same chunks as `AsyncClient.chat`.
+        The generator is returned as is, so `aclose()` closes the connection.
+        """
+        payload = {"model": model, "messages": messages, "stream": True}
+        payload.update(
+            (key, value) for key, value in options.items() if value is not None
+        )
+        return self.generate(host, "/api/chat", payload)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "pool_size": self.pool_size,
+        }
+
+
+streaming_client = StreamingClient(
+    OLLAMA_HTTP_POOL_SIZE, OLLAMA_HTTP_KEEPALIVE, float(TIMEOUT)
+)
@@ -0,0 +1,123 @@
+# bot/helpers/timer_wheel.py
+
+import asyncio
+import logging
+import math
+
+
+class _Timer:
+    __slots__ = ("key", "callback", "rounds", "slot")
+
+    def __init__(self, key, callback, rounds: int, slot: int):
+        self.key = key
+        self.callback = callback
+        self.rounds = rounds
+        self.slot = slot
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel driven by a single task.
+
+    Timers are keyed; `schedule`, `reset` and `cancel` are O(1) dict
+    operations, so thousands of open menus cost a small object each instead
+    of a sleeping task. Every `tick` seconds the task advances one slot and
+    fires the timers due there. Timers never fire early and at most two
+    ticks late. Expired timers are removed before their callback runs.
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 512):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self.timers = {}  # key -> _Timer
+        self.cursor = 0
+        self.fired = 0
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def __contains__(self, key) -> bool:
+        return key in self.timers
+
+    def schedule(self, key, delay: float, callback):
+        """
+        Calls `callback(key)` after `delay` seconds, replacing any timer with
+        the same key.
+        """
+        self.cancel(key)
+        # One extra tick because the current one is already partly over
+        ticks = max(math.ceil(delay / self.tick), 0) + 1
+        slot = (self.cursor + ticks) % len(self.slots)
+        timer = _Timer(key, callback, (ticks - 1) // len(self.slots), slot)
+        self.slots[slot][key] = timer
+        self.timers[key] = timer
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wake.set()
+
+    def reset(self, key, delay: float) -> bool:
+        """
+        Moves an existing timer to fire `delay` seconds from now.
+        """
+        timer = self.timers.get(key)
+        if timer is None:
+            return False
+        self.schedule(key, delay, timer.callback)
+        return True
+
+    def cancel(self, key) -> bool:
+        timer = self.timers.pop(key, None)
+        if timer is None:
+            return False
+        del self.slots[timer.slot][key]
+        return True
+
+    async def close(self):
+        self.timers.clear()
+        for slot in self.slots:
+            slot.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick_at = loop.time() + self.tick
+        while True:
+            if not self.timers:
+                # Nothing to do until the next schedule()
+                self._wake.clear()
+                await self._wake.wait()
+                next_tick_at = loop.time() + self.tick
+            await asyncio.sleep(max(next_tick_at - loop.time(), 0))
+            # Catch up on every tick that passed, e.g. after a slow callback
+            while next_tick_at <= loop.time():
+                self._advance()
+                next_tick_at += self.tick
+
+    def _advance(self):
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        bucket = self.slots[self.cursor]
+        due = []
+        for timer in bucket.values():
+            if timer.rounds:
+                timer.rounds -= 1
+            else:
+                due.append(timer)
+        for timer in due:
+            del bucket[timer.key]
+            del self.timers[timer.key]
+            self.fired += 1
+            try:
+                timer.callback(timer.key)
+            except Exception as e:
+                logging.error(f"Timer {timer.key} callback failed: {e}")
+
+    def stats(self) -> dict:
+        return {"scheduled": len(self.timers), "fired": self.fired}
@@ -0,0 +1,44 @@
+# bot/helpers/token_bucket.py
+
+import time
+
+
+class TokenBucket:
+    """
+    Refills at `rate` per second up to `capacity`. Some costs are only known
+    afterwards (e.g. generated tokens), so `debit` may take the balance below
+    zero and the caller waits until it is refilled.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float = 1) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def debit(self, amount: float):
+        self._refill(time.monotonic())
+        self.tokens -= amount
+
+    def available(self) -> float:
+        self._refill(time.monotonic())
+        return self.tokens
+
+    def wait_time(self, amount: float = 1) -> float:
+        """
+        Seconds until `amount` can be taken.
+        """
+        return max(0.0, (amount - self.available()) / self.rate)
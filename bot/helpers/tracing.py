@@ -0,0 +1,208 @@
+# bot/helpers/tracing.py
+
+import functools
+import json
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config.config_loader import (
+    TRACE_FILE,
+    TRACE_MAX_SPANS,
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_SECONDS,
+)
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("id", "parent_id", "name", "start", "end", "attrs", "events")
+
+    def __init__(self, span_id: int, parent_id, name: str, attrs: dict):
+        self.id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.attrs = attrs
+        self.events = []  # (name, perf_counter time)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def event(self, name: str):
+        """
+        Marks a point in time inside the span, e.g. the first token.
+        """
+        self.events.append((name, time.perf_counter()))
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "id": self.id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "attrs": self.attrs,
+            "events": [
+                {"name": name, "at_ms": round((at - origin) * 1000, 3)}
+                for name, at in self.events
+            ],
+        }
+
+
+class _NoopSpan:
+    """
+    Stands in for a span outside a trace, so callers need no None checks.
+    """
+
+    def set(self, **attrs):
+        pass
+
+    def event(self, name: str):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, name: str, attrs: dict):
+        self.id = uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.root = Span(0, None, name, attrs)
+        self.spans = [self.root]
+        self.dropped = 0
+        # Background tasks started during the update inherit its context;
+        # their later calls must not land in a finished trace
+        self.closed = False
+
+    def add_span(self, parent_id, name: str, attrs: dict):
+        if self.closed:
+            return None
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return None
+        span = Span(len(self.spans), parent_id, name, attrs)
+        self.spans.append(span)
+        return span
+
+    def to_dict(self) -> dict:
+        origin = self.root.start
+        return {
+            "trace_id": self.id,
+            "started_at": self.started_at,
+            "name": self.root.name,
+            "duration_ms": round((self.root.end - origin) * 1000, 3),
+            "dropped_spans": self.dropped,
+            "spans": [span.to_dict(origin) for span in self.spans],
+        }
+
+
+class Tracer:
+    """
+    Collects one trace per update with child spans for database, Ollama and
+    Bot API calls.
+
+    Spans are only a few attributes each, so every update is recorded and
+    the keep decision is made at the end: updates slower than `slow_seconds`
+    are always written, the rest with probability `sample_rate`. Kept traces
+    go to a JSONL file, one trace per line.
+    """
+
+    def __init__(self, path: str, sample_rate: float, slow_seconds: float):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self._file = None
+        self.traces = 0
+        self.kept = 0
+        self.kept_slow = 0
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        trace = Trace(name, attrs)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(trace.root)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.root.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            trace.root.end = time.perf_counter()
+            trace.closed = True
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._finish(trace)
+
+    def _finish(self, trace: Trace):
+        self.traces += 1
+        slow = trace.root.end - trace.root.start >= self.slow_seconds
+        if not slow and random.random() >= self.sample_rate:
+            return
+        self.kept += 1
+        self.kept_slow += slow
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(trace.to_dict(), default=str) + "\n")
+            self._file.flush()
+        except OSError as e:
+            logging.error(f"Failed to write trace {trace.id}: {e}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> dict:
+        return {"traces": self.traces, "kept": self.kept, "kept_slow": self.kept_slow}
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Opens a child span of the current one. Outside a trace, or once the
+    trace is full, it records nothing.
+    """
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    child = trace.add_span(parent.id, name, attrs) if trace is not None else None
+    if child is None:
+        yield _NOOP_SPAN
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced(name: str):
+    """
+    Runs the decorated coroutine function inside a span called `name`.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+tracer = Tracer(TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_SLOW_SECONDS)
@@ -0,0 +1,87 @@
+# bot/middlewares/metrics.py
+
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.helpers.metrics import metrics
+
+update_latency = metrics.histogram(
+    "bot_update_seconds", "Time to process one update, by type", ("type",)
+)
+update_errors = metrics.counter(
+    "bot_update_errors_total", "Updates whose processing raised, by type", ("type",)
+)
+handler_latency = metrics.histogram(
+    "bot_handler_seconds", "Time spent in each handler", ("handler",)
+)
+handler_errors = metrics.counter(
+    "bot_handler_errors_total", "Handler calls that raised", ("handler",)
+)
+telegram_latency = metrics.histogram(
+    "telegram_request_seconds", "Bot API call latency, by method", ("method",)
+)
+telegram_retry_after = metrics.counter(
+    "telegram_retry_after_total", "Bot API calls refused with RetryAfter", ("method",)
+)
+telegram_errors = metrics.counter(
+    "telegram_errors_total", "Bot API calls that failed otherwise", ("method",)
+)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Outer middleware on dp.update: latency and errors of whole updates.
+    """
+
+    async def __call__(self, handler, event, data):
+        update_type = event.event_type
+        start_time = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            update_errors.inc(update_type)
+            raise
+        finally:
+            update_latency.labels(update_type).observe(time.perf_counter() - start_time)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner middleware on message and callback observers: by then the handler
+    is resolved, so latency and errors are recorded per handler function.
+    """
+
+    async def __call__(self, handler, event, data):
+        name = getattr(data["handler"].callback, "__name__", "unknown")
+        start_time = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.labels(name).observe(time.perf_counter() - start_time)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Session middleware timing every Bot API call, including the message
+    sends and edits of streamed replies.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start_time = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            telegram_retry_after.inc(name)
+            raise
+        except Exception:
+            telegram_errors.inc(name)
+            raise
+        finally:
+            telegram_latency.labels(name).observe(time.perf_counter() - start_time)
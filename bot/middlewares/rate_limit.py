@@ -0,0 +1,86 @@
+# bot/middlewares/rate_limit.py
+
+import logging
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Update
+
+from bot.helpers.group_chat import addressed_text, is_group, message_budget
+from bot.services.usage_limiter import rate_limited, usage_limiter
+from config.config_loader import ADMIN_IDS
+
+
+def starts_generation(event: Update) -> bool:
+    """
+    Plain text messages and /ask are the updates that end in an Ollama
+    generation.
+    """
+    message = event.message
+    if message is None or message.text is None:
+        return False
+    if not message.text.startswith("/"):
+        return True
+    return message.text.split(maxsplit=1)[0].split("@")[0] == "/ask"
+
+
+async def ignored_group_message(event: Update, bot) -> bool:
+    """
+    Group messages that neither address the bot nor are commands.
+    """
+    message = event.message
+    if message is None or not is_group(message.chat):
+        return False
+    if message.text and message.text.startswith("/"):
+        return False
+    return await addressed_text(message, bot) is None
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Outer middleware on dp.update: drops updates of users over their update
+    rate, and text messages of users over their generated-token rate or
+    daily quota. A dropped user gets one notice per notice interval; a
+    dropped button press is always answered with the notice.
+    Group chatter not meant for the bot is neither limited nor noticed.
+    """
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+        if await ignored_group_message(event, data["bot"]):
+            return await handler(event, data)
+
+        reason = usage_limiter.check_update(user.id)
+        if reason is None and starts_generation(event):
+            reason = await usage_limiter.check_generation(data["db"], user.id)
+        if reason is None:
+            return await handler(event, data)
+
+        rate_limited.inc(reason)
+        if event.callback_query is not None:
+            # A button press must be answered or its spinner keeps turning;
+            # the notice shows as a toast, not as a chat message
+            try:
+                await data["bot"].answer_callback_query(
+                    event.callback_query.id, usage_limiter.notice(reason, user.id)
+                )
+            except TelegramAPIError as e:
+                logging.warning(f"Failed to answer dropped button of {user.id}: {e}")
+            return None
+
+        chat = data.get("event_chat")
+        if (
+            chat is not None
+            and usage_limiter.should_notify(user.id)
+            # In groups, only when the chat's message budget has room
+            and (not is_group(chat) or message_budget(chat.id).take())
+        ):
+            try:
+                await data["bot"].send_message(
+                    chat.id, usage_limiter.notice(reason, user.id)
+                )
+            except TelegramAPIError as e:
+                logging.warning(f"Failed to send rate limit notice to {user.id}: {e}")
+        return None
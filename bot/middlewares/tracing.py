@@ -0,0 +1,31 @@
+# bot/middlewares/tracing.py
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from bot.helpers.tracing import span, tracer
+
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """
+    Outer middleware on dp.update: every update runs inside its own trace.
+    """
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        with tracer.trace(
+            f"update.{event.event_type}",
+            update_id=event.update_id,
+            user_id=user.id if user else None,
+        ):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """
+    Session middleware adding a span per Bot API call to the current trace.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{type(method).__name__}"):
+            return await make_request(bot, method)
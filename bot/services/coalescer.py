@@ -0,0 +1,129 @@
+# bot/services/coalescer.py
+
+import asyncio
+
+from bot.helpers.metrics import metrics
+from config.config_loader import COALESCE_GENERATIONS
+
+coalesced_requests = metrics.counter(
+    "coalesced_requests_total",
+    "Generations served from another chat's identical in-flight stream",
+    ("model",),
+)
+coalesced_gpu_seconds = metrics.counter(
+    "coalesced_gpu_seconds_saved_total",
+    "Ollama time (total_duration) not spent thanks to coalescing",
+    ("model",),
+)
+
+
+class SharedStream:
+    """
+    One upstream Ollama stream read by any number of subscribers.
+
+    Chunks are kept, so a subscriber that joins late first catches up on
+    what was already generated. The upstream is cancelled once the last
+    subscriber has left.
+    """
+
+    def __init__(self, source):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self._updated = asyncio.Event()
+        self._task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._wake()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self._wake()
+            await source.aclose()
+
+    def _wake(self):
+        # Waiters hold the old event; the next chunk gets a fresh one
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def add_done_callback(self, callback):
+        self._task.add_done_callback(lambda _: callback())
+
+    def subscribe(self):
+        """
+        Returns an async iterator over the chunks. Counted right away, so the
+        stream is not cancelled between this call and the first read.
+        """
+        self.subscribers += 1
+        return self._read()
+
+    async def _read(self):
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                elif self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await self._updated.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.finished:
+                self._task.cancel()
+
+
+class GenerationCoalescer:
+    """
+    Serves identical concurrent first turns from one Ollama stream.
+
+    Requests are keyed by model, system prompt (the chat mode) and the
+    normalised user text. Only turns without history or summary qualify,
+    as their prompt is the same for everyone. Every chat still renders,
+    stores and can stop its own reply.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.streams = {}  # key -> SharedStream
+
+    @staticmethod
+    def key(model: str, prompt_start: str, prompt: str) -> tuple:
+        return (model, prompt_start, " ".join(prompt.split()).casefold())
+
+    def subscribe(self, key: tuple, source_factory):
+        """
+        Returns (chunk iterator, leader). The leader's `source_factory()`
+        starts the upstream stream; later requests with the same key join it.
+        """
+        shared = self.streams.get(key)
+        if shared is not None and not shared.finished:
+            coalesced_requests.inc(key[0])
+            return shared.subscribe(), False
+
+        shared = SharedStream(source_factory())
+        self.streams[key] = shared
+
+        def forget():
+            if self.streams.get(key) is shared:
+                del self.streams[key]
+
+        shared.add_done_callback(forget)
+        return shared.subscribe(), True
+
+    def stats(self) -> dict:
+        return {
+            "shared_streams": len(self.streams),
+            "subscribers": sum(s.subscribers for s in self.streams.values()),
+        }
+
+
+coalescer = GenerationCoalescer(COALESCE_GENERATIONS)
@@ -0,0 +1,196 @@
+# bot/services/compaction.py
+
+import asyncio
+import logging
+import time
+
+from bot.helpers.context_builder import (
+    estimate_tokens,
+    estimate_turn_tokens,
+    history_to_messages,
+)
+from bot.helpers.metrics import metrics
+from bot.services.ollama_pool import ollama_pool
+from bot.services.residency import residency
+from bot.services.scheduler import QueueFullError, scheduler
+from config.config_loader import (
+    COMPACTION_KEEP_TURNS,
+    COMPACTION_MODEL,
+    COMPACTION_SUMMARY_TOKENS,
+    COMPACTION_THRESHOLD_TOKENS,
+    DIALOG_HISTORY_TURNS,
+)
+
+# Queue identity of summary jobs in the inference scheduler, so they take
+# their round-robin turn alongside users instead of ahead of them
+COMPACTION_QUEUE_USER = 0
+
+# A run folds at least this share of the threshold, so the summary, and with it
+# the cached prompt prefix, changes every few turns rather than every turn
+MIN_FOLD_SHARE = 0.5
+
+SUMMARY_INSTRUCTIONS = (
+    "You keep a running summary of a conversation between a user and an "
+    "assistant. Merge the previous summary and the new turns into one concise "
+    "summary, written in the language of the conversation. Keep facts about "
+    "the user, their goals, decisions made and open questions. Reply with "
+    "the summary only."
+)
+
+compaction_runs = metrics.counter(
+    "compaction_runs_total",
+    "Conversation compaction jobs by outcome: completed, rejected or failed",
+    ("outcome",),
+)
+compaction_latency = metrics.histogram(
+    "compaction_seconds", "Time to summarise and store one compaction"
+).labels()
+compaction_turns = metrics.counter(
+    "compaction_turns_total", "Dialog turns folded into summaries"
+)
+prompt_tokens_saved = metrics.counter(
+    "compaction_prompt_tokens_saved_total",
+    "Estimated prompt tokens saved by sending summaries instead of turns",
+)
+
+
+def _summary_request(previous_summary: str, turns: list) -> list:
+    lines = []
+    if previous_summary:
+        lines.append(f"Previous summary:\n{previous_summary}\n")
+    lines.append("New turns:")
+    for message in history_to_messages(turns):
+        role = "User" if message["role"] == "user" else "Assistant"
+        lines.append(f"{role}: {message['content']}")
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+
+
+class ConversationCompactor:
+    """
+    Folds the older turns of long dialogs into a rolling summary.
+
+    After each turn, a dialog whose turns not yet covered by its summary
+    pass `threshold` tokens gets a background job. The job has the
+    summariser model merge the previous summary with all but the newest
+    `keep_turns` of those turns, and stores the result on the dialog with the
+    seq of the last turn it covers. Prompts then carry the summary plus the
+    turns after that watermark. A turn never waits for its compaction.
+    """
+
+    def __init__(self, model: str, threshold: int, keep_turns: int):
+        self.model = model
+        self.threshold = threshold
+        self.keep_turns = max(1, keep_turns)
+        self._jobs = {}  # dialog_id -> task
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and bool(self.model)
+
+    @staticmethod
+    def _split(summary: dict, history: list):
+        covered, recent = [], []
+        for turn in history:
+            # Turns without a seq are not written yet, so never covered
+            if turn.get("seq", summary["through_seq"] + 1) <= summary["through_seq"]:
+                covered.append(turn)
+            else:
+                recent.append(turn)
+        return covered, recent
+
+    def prompt_history(self, dialog: dict, history: list):
+        """
+        Splits a dialog's history into (summary text, turns after it).
+        """
+        summary = (dialog or {}).get("summary")
+        if not summary:
+            return None, history
+        covered, recent = self._split(summary, history)
+        if covered:
+            saved = sum(map(estimate_turn_tokens, covered)) - estimate_tokens(
+                summary["text"]
+            )
+            if saved > 0:
+                prompt_tokens_saved.inc(amount=saved)
+        return summary["text"], recent
+
+    def schedule(self, db, user_id: int, dialog_id: str):
+        """
+        Starts a compaction check for the dialog unless one is running.
+        """
+        if not self.enabled or dialog_id in self._jobs:
+            return
+        task = asyncio.create_task(self._run(db, user_id, dialog_id))
+        self._jobs[dialog_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(dialog_id, None))
+
+    async def _run(self, db, user_id: int, dialog_id: str):
+        try:
+            await self.compact(db, user_id, dialog_id)
+        except QueueFullError:
+            compaction_runs.inc("rejected")
+        except Exception as e:
+            compaction_runs.inc("failed")
+            logging.warning(f"Compaction of dialog {dialog_id} failed: {e}")
+
+    async def compact(self, db, user_id: int, dialog_id: str):
+        dialog = await db.get_dialog(dialog_id)
+        if dialog is None:
+            return
+        history = await db.get_recent_messages(
+            user_id, dialog_id, DIALOG_HISTORY_TURNS
+        )
+        summary = dialog.get("summary")
+        recent = self._split(summary, history)[1] if summary else history
+        if sum(map(estimate_turn_tokens, recent)) < self.threshold:
+            return
+        # Turns still in the write-behind queue have no seq yet; they are the
+        # newest ones and are left for a later run
+        turns = [turn for turn in recent[: -self.keep_turns] if "seq" in turn]
+        if sum(map(estimate_turn_tokens, turns)) < self.threshold * MIN_FOLD_SHARE:
+            return
+
+        start_time = time.perf_counter()
+        async with scheduler.slot(self.model, COMPACTION_QUEUE_USER):
+            residency.record_request(self.model)
+            stream = ollama_pool.chat(
+                model=self.model,
+                messages=_summary_request(summary and summary["text"], turns),
+                keep_alive=residency.keep_alive(self.model),
+                options={"num_predict": COMPACTION_SUMMARY_TOKENS},
+            )
+            parts = []
+            try:
+                async for chunk in stream:
+                    parts.append(chunk["message"]["content"])
+            finally:
+                await stream.aclose()
+        text = "".join(parts).strip()
+        if not text:
+            raise ValueError("the summariser returned an empty summary")
+
+        await db.save_dialog_summary(dialog_id, text, turns[-1]["seq"])
+        compaction_latency.observe(time.perf_counter() - start_time)
+        compaction_runs.inc("completed")
+        compaction_turns.inc(amount=len(turns))
+        logging.info(
+            f"Compacted {len(turns)} turns of dialog {dialog_id} into "
+            f"~{estimate_tokens(text)} tokens"
+        )
+
+    async def close(self):
+        jobs = list(self._jobs.values())
+        for task in jobs:
+            task.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"running": len(self._jobs)}
+
+
+compactor = ConversationCompactor(
+    COMPACTION_MODEL, COMPACTION_THRESHOLD_TOKENS, COMPACTION_KEEP_TURNS
+)
@@ -0,0 +1,229 @@
+# bot/services/generations.py
+
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config.config_loader import GENERATION_LOCK_TTL, GENERATION_LOCK_WAIT
+
+
+class Generation:
+    """
+    One in-flight reply that can be stopped from outside.
+
+    `owner_id` is whose dialog it answers: the user, or the group in groups.
+    `askers` are the users it answers, who may press its Stop button.
+    """
+
+    def __init__(self, chat_id: int, owner_id: int, askers: tuple = ()):
+        self.id = uuid.uuid4().hex[:16]
+        self.chat_id = chat_id
+        self.owner_id = owner_id
+        self.askers = tuple(askers) or (owner_id,)
+        self.tokens = 0
+        self._stop = asyncio.Event()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+
+    def stop_markup(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    InlineKeyboardButton(
+                        text="⏹ Stop", callback_data=f"stop_generation:{self.id}"
+                    )
+                ]
+            ]
+        )
+
+    async def run(self, coro) -> bool:
+        """
+        Runs `coro` until it finishes or the generation is stopped.
+
+        Returns True if it was stopped. Stopping cancels the coroutine, which
+        closes the Ollama HTTP stream so the server stops decoding.
+        """
+        task = asyncio.create_task(coro)
+        stop_waiter = asyncio.create_task(self._stop.wait())
+        try:
+            await asyncio.wait({task, stop_waiter}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            stop_waiter.cancel()
+
+        if task.done():
+            task.result()  # Re-raise errors from the generation
+            return False
+
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+
+class GenerationRegistry:
+    """
+    Tracks the running generation per (chat, dialog owner) so a newer
+    prompt, a mode or model switch or the Stop button can cancel it. In
+    groups the owner is the group, so the group has one generation.
+
+    With a StateStore attached, a generation also holds a per-chat lock in
+    the store while it streams, so two replicas never answer the same chat
+    at once. A replica that needs the lock asks the holder to stop.
+    """
+
+    def __init__(self):
+        self.store = None
+        self.by_key = {}
+        self.by_id = {}
+        # Average completion length per model, to estimate what a stop saved
+        self.avg_eval_count = {}
+        self.cancelled = 0
+        self.superseded = 0
+        self.tokens_saved = 0
+
+    def start(self, chat_id: int, owner_id: int, askers: tuple = ()) -> Generation:
+        """
+        Registers a new generation, stopping the previous one for this chat and owner.
+        """
+        previous = self.by_key.get((chat_id, owner_id))
+        if previous is not None:
+            self.superseded += 1
+            previous.stop()
+            logging.info(f"Superseding generation {previous.id} in chat {chat_id}")
+
+        generation = Generation(chat_id, owner_id, askers)
+        self.by_key[(chat_id, owner_id)] = generation
+        self.by_id[generation.id] = generation
+        return generation
+
+    def finish(self, generation: Generation):
+        self.by_id.pop(generation.id, None)
+        if self.by_key.get((generation.chat_id, generation.owner_id)) is generation:
+            del self.by_key[(generation.chat_id, generation.owner_id)]
+
+    def stop(self, generation_id: str, user_id: int, admin: bool = False) -> bool:
+        """
+        Stops a generation by id (Stop button). Only the users it answers, or
+        a chat admin, may stop it.
+        """
+        generation = self.by_id.get(generation_id)
+        if generation is None or not (admin or user_id in generation.askers):
+            return False
+        generation.stop()
+        return True
+
+    def stop_chat(self, chat_id: int, owner_id: int) -> bool:
+        generation = self.by_key.get((chat_id, owner_id))
+        if generation is None:
+            return False
+        generation.stop()
+        return True
+
+    def attach(self, store):
+        self.store = store
+
+    @staticmethod
+    def lock_name(chat_id: int, owner_id: int) -> str:
+        return f"generation:{chat_id}:{owner_id}"
+
+    async def request_stop(self, chat_id: int, owner_id: int) -> bool:
+        """
+        Stops the chat's generation on whichever replica runs it.
+        """
+        if self.stop_chat(chat_id, owner_id):
+            return True
+        return await self.request_remote_stop(chat_id, owner_id)
+
+    async def request_remote_stop(self, chat_id: int, owner_id: int) -> bool:
+        """
+        Stops the chat's generation if it runs on another replica.
+        """
+        if self.store is None or (chat_id, owner_id) in self.by_key:
+            return False
+        return await self.store.request_release(self.lock_name(chat_id, owner_id))
+
+    @asynccontextmanager
+    async def exclusive(self, generation: Generation):
+        """
+        Holds the chat's lock in the shared store for the duration of the block.
+        """
+        if self.store is None:
+            yield
+            return
+
+        name = self.lock_name(generation.chat_id, generation.owner_id)
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + GENERATION_LOCK_WAIT
+        requested = False
+        while not await self.store.acquire_lock(
+            name, generation.id, GENERATION_LOCK_TTL
+        ):
+            if not requested:
+                # An older generation, maybe on another replica, still streams
+                await self.store.request_release(name)
+                requested = True
+            if loop.time() > give_up_at:
+                raise TimeoutError(f"Chat {generation.chat_id} is still busy")
+            await asyncio.sleep(0.1)
+
+        heartbeat = asyncio.create_task(self._heartbeat(name, generation))
+        try:
+            yield
+        finally:
+            heartbeat.cancel()
+            await self.store.release_lock(name, generation.id)
+
+    async def _heartbeat(self, name: str, generation: Generation):
+        while True:
+            await asyncio.sleep(GENERATION_LOCK_TTL / 3)
+            try:
+                release_requested = await self.store.refresh_lock(
+                    name, generation.id, GENERATION_LOCK_TTL
+                )
+            except Exception as e:
+                logging.warning(f"Refreshing generation lock {name} failed: {e}")
+                continue
+            if release_requested is None or release_requested:
+                logging.info(f"Generation {generation.id} asked to stop via {name}")
+                generation.stop()
+                return
+
+    def record_completion(self, model: str, eval_count: int):
+        if not eval_count:
+            return
+        average = self.avg_eval_count.get(model)
+        self.avg_eval_count[model] = (
+            eval_count if average is None else 0.9 * average + 0.1 * eval_count
+        )
+
+    def record_cancel(self, model: str, generated_tokens: int):
+        """
+        Counts a stopped generation and estimates the tokens it did not decode.
+        """
+        self.cancelled += 1
+        average = self.avg_eval_count.get(model, 0)
+        self.tokens_saved += int(max(average - generated_tokens, 0))
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self.by_id),
+            "cancelled": self.cancelled,
+            "superseded": self.superseded,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+generations = GenerationRegistry()
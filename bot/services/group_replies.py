@@ -0,0 +1,79 @@
+# bot/services/group_replies.py
+
+import asyncio
+import logging
+
+from bot.helpers.metrics import metrics
+from config.config_loader import GROUP_DEBOUNCE_SECONDS, GROUP_MAX_BATCH
+
+group_batches = metrics.counter(
+    "group_reply_batches_total", "Replies generated for group chats"
+)
+group_batched_messages = metrics.counter(
+    "group_batched_messages_total", "Group messages answered by those replies"
+)
+
+
+class GroupReplyQueue:
+    """
+    Answers each group with one reply at a time.
+
+    Messages addressed to the bot wait `debounce` seconds, so a burst of
+    mentions becomes a single generation. Messages arriving while a reply
+    streams are answered together by the next one, up to `max_batch` per
+    reply. A group never has more than one generation queued or running.
+    """
+
+    def __init__(self, debounce: float, max_batch: int):
+        self.debounce = debounce
+        self.max_batch = max(1, max_batch)
+        self.pending = {}  # chat_id -> [item, ...]
+        self._workers = {}  # chat_id -> task
+
+    def submit(self, chat_id: int, item, answer):
+        """
+        Queues `item` for the group; `await answer(items)` generates one reply
+        to a batch of them.
+        """
+        self.pending.setdefault(chat_id, []).append(item)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(
+                self._work(chat_id, answer)
+            )
+
+    async def _work(self, chat_id: int, answer):
+        while True:
+            await asyncio.sleep(self.debounce)
+            items = self.pending.pop(chat_id, None)
+            if not items:
+                # Forgotten in the same step, so a later submit starts a worker
+                del self._workers[chat_id]
+                return
+            if len(items) > self.max_batch:
+                self.pending[chat_id] = items[self.max_batch :]
+                items = items[: self.max_batch]
+            group_batches.inc()
+            group_batched_messages.inc(amount=len(items))
+            try:
+                await answer(items)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Reply to group {chat_id} failed: {e}")
+
+    async def close(self):
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers.clear()
+        self.pending.clear()
+
+    def stats(self) -> dict:
+        return {
+            "active_groups": len(self._workers),
+            "pending_messages": sum(map(len, self.pending.values())),
+        }
+
+
+group_replies = GroupReplyQueue(GROUP_DEBOUNCE_SECONDS, GROUP_MAX_BATCH)
@@ -0,0 +1,122 @@
+# bot/services/menu_timeouts.py
+
+import asyncio
+import logging
+import time
+
+from bot.helpers.timer_wheel import TimerWheel
+from config.config_loader import MENU_SWEEP_INTERVAL
+
+
+class MenuTimeouts:
+    """
+    Closes inline menus nobody used in time.
+
+    Each open menu is saved in the StateStore with its deadline, so it
+    survives a restart and any replica can close it. The local timer is only
+    a reminder: when it fires, the menu is claimed from the store, which
+    fails if another replica already closed it or the deadline was moved.
+    Menus whose replica went away are picked up by a periodic sweep.
+
+    All local timers share one TimerWheel, so an open menu costs a dict
+    entry rather than a task or a loop timer handle.
+    """
+
+    def __init__(self):
+        self.store = None
+        self.actions = {}  # menu kind -> async fn(menu) run on timeout
+        self.timers = TimerWheel()
+        self._sweep_task = None
+        self._expiring = set()  # tasks claiming menus whose timer fired
+        self.expired = 0
+
+    def register(self, kind: str, action):
+        self.actions[kind] = action
+
+    async def start(self, store):
+        """
+        Re-arms timers for menus left open by a previous run, then sweeps
+        abandoned ones in the background.
+        """
+        self.store = store
+        for menu in await store.pending_menus():
+            self._schedule(menu["key"], menu["deadline"])
+        self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        await self.timers.close()
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+        expiring = list(self._expiring)
+        for task in expiring:
+            task.cancel()
+        await asyncio.gather(*expiring, return_exceptions=True)
+
+    async def open(self, key: str, kind: str, timeout: float, **menu):
+        """
+        Starts or restarts the timeout of the menu stored under `key`.
+        """
+        deadline = time.time() + timeout
+        await self.store.save_menu(key, {"kind": kind, **menu}, deadline)
+        self._schedule(key, deadline)
+
+    async def cancel(self, key: str):
+        self.timers.cancel(key)
+        await self.store.delete_menu(key)
+
+    def _schedule(self, key: str, deadline: float):
+        self.timers.schedule(key, deadline - time.time(), self._on_timer)
+
+    def _on_timer(self, key: str):
+        # The loop keeps only weak references, so hold on to the task
+        task = asyncio.create_task(self._expire(key))
+        self._expiring.add(task)
+        task.add_done_callback(self._expiring.discard)
+
+    async def _expire(self, key: str):
+        try:
+            menu = await self.store.claim_menu(key, time.time())
+            if menu is None:
+                # Closed already, or reopened (possibly on another replica)
+                pending = await self.store.get_menu(key)
+                if pending is not None:
+                    self._schedule(key, pending["deadline"])
+                return
+            await self._run_action(menu)
+        except Exception as e:
+            logging.error(f"Menu timeout for {key} failed: {e}")
+
+    async def _run_action(self, menu: dict):
+        action = self.actions.get(menu["kind"])
+        if action is None:
+            logging.warning(f"No timeout action for menu kind {menu['kind']}")
+            return
+        self.expired += 1
+        await action(menu)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(MENU_SWEEP_INTERVAL)
+            try:
+                # The grace period leaves each menu to its own replica first
+                before = time.time() - MENU_SWEEP_INTERVAL
+                menus = await self.store.claim_expired_menus(before)
+            except Exception as e:
+                logging.error(f"Menu timeout sweep failed: {e}")
+                continue
+            for menu in menus:
+                try:
+                    await self._run_action(menu)
+                except Exception as e:
+                    logging.error(f"Menu timeout for {menu['key']} failed: {e}")
+
+    def stats(self) -> dict:
+        return {"scheduled": len(self.timers), "expired": self.expired}
+
+
+menu_timeouts = MenuTimeouts()
@@ -0,0 +1,45 @@
+# bot/services/metrics_server.py
+
+import logging
+
+from aiohttp import web
+
+from bot.helpers.metrics import metrics
+from config.config_loader import METRICS_HOST, METRICS_PORT
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        text=metrics.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+class MetricsServer:
+    """
+    Small aiohttp server of its own for Prometheus to scrape /metrics, so
+    metrics are available in polling mode too and never share a port with
+    the public webhook.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        if self.port <= 0 or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", metrics_handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
@@ -0,0 +1,170 @@
+# bot/services/mode_registry.py
+
+import asyncio
+import logging
+import os
+from types import MappingProxyType
+
+import yaml
+from aiogram.enums.parse_mode import ParseMode
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config.config_loader import MODE_RELOAD_INTERVAL
+
+DEFAULT_MODE = "assistant"
+MODES_PER_PAGE = 5
+
+
+class ChatMode:
+    """
+    One chat mode from chat_modes.yml, with everything handlers need per
+    message already resolved.
+    """
+
+    __slots__ = (
+        "key",
+        "name",
+        "welcome_message",
+        "prompt_start",
+        "parse_mode",
+        "response_cache",
+    )
+
+    def __init__(self, key: str, info: dict):
+        self.key = key
+        self.name = info.get("name", key)
+        self.welcome_message = info.get("welcome_message", "Welcome!")
+        self.prompt_start = info.get("prompt_start", "")
+        self.parse_mode = (
+            ParseMode.MARKDOWN
+            if info.get("parse_mode", "html") == "markdown"
+            else ParseMode.HTML
+        )
+        self.response_cache = bool(info.get("response_cache", False))
+
+
+class ModeSnapshot:
+    """
+    Immutable view of one version of chat_modes.yml and its keyboards.
+    """
+
+    def __init__(self, raw: dict, mtime: float):
+        self.mtime = mtime
+        self.modes = MappingProxyType(
+            {key: ChatMode(key, info) for key, info in raw.items()}
+        )
+        self.menu_text = f"Select chat mode ({len(self.modes)} modes available):"
+        self.pages = tuple(self._build_pages())
+
+    def _build_pages(self):
+        modes = list(self.modes.values())
+        page_count = max(1, -(-len(modes) // MODES_PER_PAGE))
+        for page in range(page_count):
+            start = page * MODES_PER_PAGE
+            rows = [
+                # Use mode key in callback_data instead of display name
+                [
+                    InlineKeyboardButton(
+                        text=mode.name, callback_data=f"mode:{mode.key}"
+                    )
+                ]
+                for mode in modes[start : start + MODES_PER_PAGE]
+            ]
+            navigation_buttons = []
+            if page > 0:
+                navigation_buttons.append(
+                    InlineKeyboardButton(
+                        text="⬅️ Back", callback_data=f"page:{page - 1}"
+                    )
+                )
+            if page < page_count - 1:
+                navigation_buttons.append(
+                    InlineKeyboardButton(
+                        text="➡️ Next", callback_data=f"page:{page + 1}"
+                    )
+                )
+            if navigation_buttons:
+                rows.append(navigation_buttons)
+            yield InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+class ModeRegistry:
+    """
+    Chat modes loaded once from YAML and swapped as a whole when the file
+    changes, so a handler always sees one consistent version.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.snapshot = None
+        self.reloads = 0
+        self._rejected_mtime = None
+        self._task = None
+        self.reload()
+
+    def get(self, key: str):
+        return self.snapshot.modes.get(key)
+
+    def get_or_default(self, key: str) -> ChatMode:
+        return self.snapshot.modes.get(key) or self.snapshot.modes[DEFAULT_MODE]
+
+    def page(self, page: int) -> InlineKeyboardMarkup:
+        pages = self.snapshot.pages
+        return pages[min(max(page, 0), len(pages) - 1)]
+
+    @property
+    def menu_text(self) -> str:
+        return self.snapshot.menu_text
+
+    def reload(self) -> bool:
+        """
+        Re-reads the YAML file if it changed. A broken file keeps the
+        current modes in place.
+        """
+        mtime = None
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if self.snapshot is not None and mtime in (
+                self.snapshot.mtime,
+                self._rejected_mtime,
+            ):
+                return False
+            # Load chat modes from YAML with UTF-8 encoding
+            with open(self.path, "r", encoding="utf-8") as file:
+                snapshot = ModeSnapshot(yaml.safe_load(file), mtime)
+            if DEFAULT_MODE not in snapshot.modes:
+                raise ValueError(f"no '{DEFAULT_MODE}' mode")
+        except Exception as e:
+            if self.snapshot is None:
+                raise
+            # Log a broken file once, not on every check
+            self._rejected_mtime = mtime
+            logging.error(f"Keeping current chat modes, reloading failed: {e}")
+            return False
+
+        # A single assignment, so readers never see a half-built registry
+        self.snapshot = snapshot
+        self.reloads += 1
+        logging.info(f"Loaded {len(snapshot.modes)} chat modes from {self.path}")
+        return True
+
+    def start(self):
+        if self._task is None and MODE_RELOAD_INTERVAL > 0:
+            self._task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(MODE_RELOAD_INTERVAL)
+            self.reload()
+
+
+mode_registry = ModeRegistry("config/chat_modes.yml")
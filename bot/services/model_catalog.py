@@ -0,0 +1,159 @@
+# bot/services/model_catalog.py
+
+import asyncio
+import logging
+import time
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.services.ollama_pool import ollama_pool
+from config.config_loader import MODEL_CATALOG_TTL
+
+
+class ModelCatalog:
+    """
+    In-memory list of the models the Ollama hosts serve, with the model menu
+    keyboards prebuilt. A model on any host is listed; the pool routes
+    generations to a host that has it.
+
+    The list is refreshed in the background every MODEL_CATALOG_TTL seconds
+    and when a generation finds its model gone, so opening the menu never
+    waits on Ollama. Keyboards are rebuilt only when the list actually
+    changes.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.models = ()
+        self.fetched_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self._markups = {}  # selected model -> keyboard with its check mark
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task = None
+        self._background = set()  # refreshes started by invalidate and markup
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self.fetched_at >= self.ttl
+
+    def start(self):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        background = list(self._background)
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.warning(f"Model catalog refresh failed: {e}")
+            await asyncio.sleep(self.ttl)
+
+    async def refresh(self):
+        """
+        Fetches the model lists of all hosts and rebuilds the keyboards if
+        their union changed. Hosts that do not answer are left out.
+        """
+        async with self._refresh_lock:
+            responses = await asyncio.gather(
+                *(backend.client.list() for backend in ollama_pool.backends),
+                return_exceptions=True,
+            )
+            errors = [r for r in responses if isinstance(r, Exception)]
+            if len(errors) == len(responses):
+                self.failures += 1
+                raise errors[0]
+            models = tuple(
+                dict.fromkeys(
+                    model["name"]
+                    for response in responses
+                    if not isinstance(response, Exception)
+                    for model in response["models"]
+                )
+            )
+            self.fetched_at = time.monotonic()
+            self.refreshes += 1
+            if models != self.models or not self._markups:
+                self.models = models
+                self._markups = {
+                    selected: self._build_markup(selected)
+                    for selected in models + (None,)
+                }
+                logging.info(f"Model catalog updated: {len(models)} models")
+
+    def invalidate(self):
+        """
+        Marks the list stale and refreshes it in the background.
+        """
+        self.fetched_at = 0.0
+        self._spawn(self._refresh_quietly())
+
+    def _spawn(self, coro):
+        # The loop keeps only weak references, so hold on to the task
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _refresh_quietly(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logging.warning(f"Model catalog refresh failed: {e}")
+
+    async def markup(self, selected_model: str = None) -> InlineKeyboardMarkup:
+        """
+        Model menu with `selected_model` checked. Only waits on Ollama when the
+        list has never been fetched.
+        """
+        if not self._markups:
+            await self.refresh()
+        elif self.stale and not self._refresh_lock.locked():
+            self._spawn(self._refresh_quietly())
+        return self._markups.get(selected_model, self._markups[None])
+
+    def _build_markup(self, selected_model: str = None) -> InlineKeyboardMarkup:
+        rows = [
+            [
+                InlineKeyboardButton(
+                    text=f"✅ {model_name}"
+                    if model_name == selected_model
+                    else model_name,
+                    callback_data=f"select_model:{model_name}",
+                )
+            ]
+            for model_name in self.models
+        ]
+        # Add the back and exit buttons
+        rows.append(
+            [
+                InlineKeyboardButton(text="🔙 Back", callback_data="back_to_settings"),
+                InlineKeyboardButton(text="🚪 Exit", callback_data="exit_settings"),
+            ]
+        )
+        return InlineKeyboardMarkup(inline_keyboard=rows)
+
+    def stats(self) -> dict:
+        return {
+            "models": len(self.models),
+            "age_seconds": time.monotonic() - self.fetched_at
+            if self.fetched_at
+            else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+
+model_catalog = ModelCatalog(MODEL_CATALOG_TTL)
@@ -7,110 +7,298 @@ import time
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import Message
+from ollama import ResponseError
 
 from bot.dispatcher import bot
-from config.config_loader import client
+from bot.helpers.context_builder import build_messages, record_prompt_metrics
+from bot.helpers.group_chat import is_group, message_budget
+from bot.helpers.metrics import metrics
+from bot.helpers.stream_editor import StreamEditor
+from bot.helpers.stream_renderer import StreamRenderer
+from bot.helpers.tracing import span
+from bot.services.coalescer import coalesced_gpu_seconds, coalescer
+from bot.services.generations import generations
+from bot.services.model_catalog import model_catalog
+from bot.services.ollama_pool import ollama_pool
+from bot.services.residency import residency
+from bot.services.response_cache import response_cache
+from bot.services.scheduler import QueueFullError, scheduler
+from bot.services.usage_limiter import usage_limiter
+from config.config_loader import GROUP_MIN_EDIT_CHARS, GROUP_MIN_EDIT_INTERVAL
+
+# Characters per step when replaying a cached answer
+CACHED_REPLAY_CHUNK = 200
+
+# Buckets for generation speed, in tokens per second
+TOKEN_RATE_BUCKETS = (1, 2.5, 5, 10, 15, 20, 30, 50, 75, 100, 150, 250)
+
+first_token_latency = metrics.histogram(
+    "ollama_time_to_first_token_seconds",
+    "From the user's message to the first generated token, queueing included",
+    ("model",),
+)
+generation_speed = metrics.histogram(
+    "ollama_tokens_per_second",
+    "Decoding speed reported by Ollama (eval_count / eval_duration)",
+    ("model",),
+    TOKEN_RATE_BUCKETS,
+)
+replies_total = metrics.counter(
+    "bot_replies_total",
+    "Replies by outcome: completed, stopped, cached, rejected or failed",
+    ("model", "outcome"),
+)
+
+
+def record_generation_speed(model: str, final_chunk: dict):
+    eval_count = final_chunk.get("eval_count") or 0
+    eval_duration_ns = final_chunk.get("eval_duration") or 0
+    if eval_count and eval_duration_ns:
+        generation_speed.labels(model).observe(eval_count / (eval_duration_ns / 1e9))
+
+
+def ollama_timings(final_chunk: dict) -> dict:
+    """
+    Ollama's own timings of a finished generation, in milliseconds.
+    """
+    return {
+        f"{stage}_ms": round((final_chunk.get(f"{stage}_duration") or 0) / 1e6, 1)
+        for stage in ("load", "prompt_eval", "eval")
+    }
 
 
 # Function to send a request to Ollama's API and stream the response to the user
 async def ollama_request(
-    db, parse_mode, dialog_id, message: Message, prompt: str = None
+    db,
+    parse_mode,
+    dialog_id,
+    message: Message,
+    prompt: str = None,
+    prompt_start: str = "",
+    history: list = None,
+    summary: str = None,
+    cache_mode: str = None,
+    owner_id: int = None,
+    askers: tuple = None,
 ):
+    request_started = time.perf_counter()
+    # Whose dialog and settings these are: the user, or the group in groups.
+    # Usage is charged to the users who asked, split evenly in group batches.
+    if owner_id is None:
+        owner_id = message.from_user.id
+    askers = askers or (message.from_user.id,)
+    # Groups share a small message budget, see group_chat.message_budget
+    budget = message_budget(message.chat.id) if is_group(message.chat) else None
+    # Register this reply; an older one still running in this dialog is stopped
+    generation = generations.start(message.chat.id, owner_id, askers)
+    stop_markup = generation.stop_markup()
+    # Known once the user's settings are read; used as a metrics label
+    selected_model = "unknown"
     try:
         # Start streaming the response from Ollama API
         # Fetch the selected model from the database
-        selected_model = await db.get_selected_model(message.from_user.id)
-        stream = await client.chat(
-            model=selected_model,
-            messages=[{"role": "user", "content": prompt}],
-            stream=True,
+        selected_model = await db.get_selected_model(owner_id)
+        messages, estimated_tokens = build_messages(
+            prompt_start, history or [], prompt, selected_model, summary
         )
 
-        # Send an initial message to edit later
+        # Only stateless first turns have the same answer for everyone: they
+        # can share a stream with identical requests and use the response cache.
+        # Answers built on a dialog's history never leave that dialog.
+        stateless = bool(prompt) and not history and not summary
+        coalesce_key = None
+        if coalescer.enabled and stateless:
+            coalesce_key = coalescer.key(selected_model, prompt_start, prompt)
+        if not stateless:
+            cache_mode = None
+
+        # Send an initial message to edit later; in groups it answers the
+        # message it was asked in
+        if budget is not None:
+            budget.debit(1)
         sent_message = await bot.send_message(
             chat_id=message.chat.id,
             text="Processing...",
             parse_mode=ParseMode.HTML,  # Ensure parse_mode is uppercase as required by Aiogram
+            reply_markup=stop_markup,
+            reply_to_message_id=message.message_id if budget is not None else None,
         )
 
-        full_response = ""  # To accumulate the streamed content
-        last_edit_time = 0  # Timestamp of the last edit
-        min_edit_interval = 1  # Minimum interval between edits in seconds
-        buffer_threshold = 50  # Minimum number of new characters before editing
-
-        buffer_count = 0  # Number of new characters since last edit
+        # Modes that opt into the response cache may reuse an earlier answer;
+        # looked up after "Processing..." so the embedding never delays it
+        cached_answer, prompt_embedding = None, None
+        if cache_mode:
+            with span("response_cache.lookup", mode=cache_mode):
+                cached_answer, prompt_embedding = await response_cache.lookup(
+                    cache_mode, selected_model, prompt
+                )
 
-        async for chunk in stream:
-            chunk_content = chunk["message"]["content"]
-            full_response += chunk_content
-            buffer_count += len(chunk_content)
+        async def show_queue_position(position: int):
+            if generation.stopped:
+                # A coalesced stream can outlive the reply that started it
+                return
+            if budget is not None and not budget.take():
+                # Groups keep their budget for the reply itself
+                return
+            await bot.edit_message_text(
+                chat_id=message.chat.id,
+                message_id=sent_message.message_id,
+                text=f"⏳ You are #{position} in the queue...",
+                reply_markup=stop_markup,
+            )
 
-            current_time = time.time()
-            time_since_last_edit = current_time - last_edit_time
+        # The renderer splits the reply into Telegram-sized, well-formed pages;
+        # the editor task shows the newest text at its own pace, so the stream
+        # keeps draining even while Telegram rate limits us
+        renderer = StreamRenderer(parse_mode)
+        if budget is None:
+            editor = StreamEditor(
+                bot, message.chat.id, sent_message.message_id, renderer, stop_markup
+            )
+        else:
+            editor = StreamEditor(
+                bot,
+                message.chat.id,
+                sent_message.message_id,
+                renderer,
+                stop_markup,
+                min_interval=GROUP_MIN_EDIT_INTERVAL,
+                min_chars=GROUP_MIN_EDIT_CHARS,
+                budget=budget,
+            )
+        editor.start()
 
-            if (
-                buffer_count >= buffer_threshold
-                and time_since_last_edit >= min_edit_interval
-            ):
+        async def model_stream(generate_span):
+            # Waits for a free generation slot on this model, then streams from
+            # the best Ollama host, retried elsewhere if it fails before the
+            # first token. Model metrics are recorded once per upstream stream.
+            async with scheduler.slot(selected_model, owner_id, show_queue_position):
+                generate_span.event("slot_acquired")
+                residency.record_request(selected_model)
+                stream = ollama_pool.chat(
+                    model=selected_model,
+                    messages=messages,
+                    keep_alive=residency.keep_alive(selected_model),
+                )
                 try:
-                    await bot.edit_message_text(
-                        chat_id=message.chat.id,
-                        message_id=sent_message.message_id,
-                        text=full_response,
-                        parse_mode=ParseMode.HTML,
-                    )
-                    last_edit_time = current_time
-                    buffer_count = 0  # Reset buffer count after successful edit
-                except TelegramRetryAfter as e:
-                    wait_time = e.retry_after
-                    logging.warning(
-                        f"Rate limited on EditMessageText. Waiting for {wait_time} seconds."
-                    )
-                    await asyncio.sleep(wait_time)
-                except TelegramBadRequest as e:
-                    if "message is not modified" in str(e):
-                        pass  # Ignore if message hasn't changed
+                    async for chunk in stream:
+                        if chunk.get("done"):
+                            record_generation_speed(selected_model, chunk)
+                            record_prompt_metrics(
+                                selected_model, estimated_tokens, chunk
+                            )
+                            generations.record_completion(
+                                selected_model, chunk.get("eval_count")
+                            )
+                            residency.record_load(selected_model, chunk)
+                        yield chunk
+                finally:
+                    # Closing the HTTP stream makes Ollama stop decoding
+                    await stream.aclose()
+
+        coalesced = False
+
+        async def generate():
+            nonlocal coalesced
+            with span("ollama.generate", model=selected_model) as generate_span:
+                # Only one replica streams to a chat at a time
+                async with generations.exclusive(generation):
+                    if coalesce_key is None:
+                        stream, leader = model_stream(generate_span), True
                     else:
-                        logging.error(f"TelegramBadRequest Error: {e}")
-                        raise e
-
-        # After streaming completes, ensure the final response is updated
-        if buffer_count > 0:
-            try:
-                await bot.edit_message_text(
-                    chat_id=message.chat.id,
-                    message_id=sent_message.message_id,
-                    text=full_response,
-                    parse_mode=parse_mode,
-                )
-            except TelegramRetryAfter as e:
-                wait_time = e.retry_after
-                logging.warning(
-                    f"Rate limited on final EditMessageText. Waiting for {wait_time} seconds."
-                )
-                await asyncio.sleep(wait_time)
-                await bot.edit_message_text(
-                    chat_id=message.chat.id,
-                    message_id=sent_message.message_id,
-                    text=full_response,
-                    parse_mode=parse_mode,
-                )
-            except TelegramBadRequest as e:
-                if "message is not modified" in str(e):
-                    pass
-                else:
-                    logging.error(f"TelegramBadRequest Error on final edit: {e}")
-                    raise e
-
-        # Store bot's response in the dialog
+                        # Identical first turns share one upstream stream
+                        stream, leader = coalescer.subscribe(
+                            coalesce_key, lambda: model_stream(generate_span)
+                        )
+                    coalesced = not leader
+                    generate_span.set(coalesced=coalesced)
+                    try:
+                        async for chunk in stream:
+                            if not generation.tokens:
+                                generate_span.event("first_token")
+                                first_token_latency.labels(selected_model).observe(
+                                    time.perf_counter() - request_started
+                                )
+                            generation.tokens += 1
+                            if chunk.get("done"):
+                                generate_span.event("last_token")
+                                generate_span.set(
+                                    tokens=chunk.get("eval_count"),
+                                    **ollama_timings(chunk),
+                                )
+                                usage_limiter.record_shared_generation(
+                                    db, askers, chunk.get("eval_count")
+                                )
+                                if coalesced:
+                                    coalesced_gpu_seconds.inc(
+                                        selected_model,
+                                        amount=(chunk.get("total_duration") or 0)
+                                        / 1e9,
+                                    )
+                            renderer.append(chunk["message"]["content"])
+                            editor.push()
+                    finally:
+                        await stream.aclose()
+
+        async def replay_cached():
+            # Cached answers go through the same renderer and editor as live ones
+            for start in range(0, len(cached_answer), CACHED_REPLAY_CHUNK):
+                renderer.append(cached_answer[start : start + CACHED_REPLAY_CHUNK])
+                editor.push()
+                await asyncio.sleep(0)
+
+        try:
+            stopped = await generation.run(
+                generate() if cached_answer is None else replay_cached()
+            )
+        except QueueFullError as e:
+            await editor.cancel()
+            replies_total.inc(selected_model, "rejected")
+            logging.warning(f"Rejected request from {message.from_user.id}: {e}")
+            await bot.edit_message_text(
+                chat_id=message.chat.id,
+                message_id=sent_message.message_id,
+                text="🚦 Too many requests right now, please try again in a minute.",
+            )
+            return
+        except BaseException:
+            await editor.cancel()
+            raise
+
+        full_response = renderer.raw_text()
+        if cached_answer is not None:
+            outcome = "cached"
+        else:
+            outcome = "stopped" if stopped else "completed"
+        replies_total.inc(selected_model, outcome)
+        if stopped:
+            generations.record_cancel(selected_model, generation.tokens)
+            # No final chunk, so the streamed chunks stand in for eval_count
+            usage_limiter.record_shared_generation(db, askers, generation.tokens)
+            logging.info(
+                f"Generation {generation.id} stopped after {generation.tokens} tokens"
+            )
+
+        # Wait for the final response to be shown
+        await editor.finish("\n\n⏹ Stopped." if stopped else "")
+
+        # A coalesced answer is stored once, by the reply that started it
+        if cache_mode and cached_answer is None and not stopped and not coalesced:
+            response_cache.store(
+                cache_mode, selected_model, prompt, prompt_embedding, full_response
+            )
+
+        # Store bot's response in the dialog, marking answers that were cut short
         await db.add_message_to_dialog(
-            user_id=message.from_user.id,
+            user_id=owner_id,
             dialog_id=dialog_id,
             user_message=prompt,
             bot_message=full_response,
+            truncated=stopped,
         )
 
     except TelegramRetryAfter as e:
+        replies_total.inc(selected_model, "failed")
         wait_time = e.retry_after
         logging.warning(
             f"Rate limited on SendMessage. Waiting for {wait_time} seconds."
@@ -127,7 +315,11 @@ async def ollama_request(
             logging.error(f"Failed to send error message after rate limit: {inner_e}")
 
     except Exception as e:
+        replies_total.inc(selected_model, "failed")
         logging.error(f"-----\n[OllamaAPI-ERR] CAUGHT FAULT!\n{e}\n-----")
+        if isinstance(e, ResponseError) and e.status_code == 404:
+            # The model was removed from Ollama; drop it from the menu
+            model_catalog.invalidate()
         try:
             await bot.send_message(
                 chat_id=message.chat.id,
@@ -147,3 +339,6 @@ async def ollama_request(
             )
         except TelegramBadRequest as e:
             logging.error(f"TelegramBadRequest Error while sending error message: {e}")
+
+    finally:
+        generations.finish(generation)
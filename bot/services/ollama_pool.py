@@ -0,0 +1,226 @@
+# bot/services/ollama_pool.py
+
+import asyncio
+import logging
+
+from ollama import AsyncClient, ResponseError
+
+from bot.helpers.streaming_response import streaming_client
+from config.config_loader import (
+    OLLAMA_EJECT_AFTER,
+    OLLAMA_HEALTH_INTERVAL,
+    OLLAMA_HEALTH_TIMEOUT,
+    OLLAMA_HOSTS,
+)
+
+
+class NoBackendAvailable(Exception):
+    """
+    Raised when every Ollama host failed before producing a token.
+    """
+
+
+class OllamaBackend:
+    """
+    One Ollama host with its load, health and loaded models.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = AsyncClient(host=url)
+        self.health_client = AsyncClient(host=url, timeout=OLLAMA_HEALTH_TIMEOUT)
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.resident_models = set()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+
+    def mark_up(self):
+        if not self.healthy:
+            logging.info(f"Ollama host {self.url} is back, re-admitting it")
+        self.healthy = True
+        self.consecutive_failures = 0
+
+    def mark_down(self, reason):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.healthy and self.consecutive_failures >= OLLAMA_EJECT_AFTER:
+            self.healthy = False
+            logging.warning(f"Ejecting Ollama host {self.url}: {reason}")
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "resident_models": sorted(self.resident_models),
+        }
+
+
+class OllamaPool:
+    """
+    Routes chat requests over several Ollama hosts.
+
+    A host that already has the model loaded (as reported by /api/ps) is
+    preferred, then the one with the fewest requests in flight. Hosts are
+    health-checked in the background, ejected after repeated failures and
+    re-admitted once they answer again. A stream that fails before its first
+    token is retried on another host.
+
+    Only connection errors, timeouts and 5xx answers count against a host.
+    A 4xx is the request's fault and is raised to the caller; a 404 (model
+    not found) is first tried on the other hosts, which may have the model.
+    """
+
+    def __init__(self, hosts):
+        self.backends = [OllamaBackend(url) for url in hosts]
+        self.routing = {"resident": 0, "least_loaded": 0, "unhealthy_fallback": 0}
+        self.retries = 0
+        self._health_task = None
+
+    @property
+    def client(self) -> AsyncClient:
+        """
+        Client for non-generation calls (model list, pulls), on a healthy host.
+        """
+        for backend in self.backends:
+            if backend.healthy:
+                return backend.client
+        return self.backends[0].client
+
+    def start(self):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self.check(backend) for backend in self.backends))
+            await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+
+    async def check(self, backend: OllamaBackend):
+        try:
+            response = await backend.health_client.ps()
+        except Exception as e:
+            backend.mark_down(e)
+            return
+        backend.resident_models = {
+            model["name"] for model in response.get("models", [])
+        }
+        backend.mark_up()
+
+    def pick(self, model: str, exclude=()) -> OllamaBackend:
+        candidates = [
+            backend
+            for backend in self.backends
+            if backend.healthy and backend not in exclude
+        ]
+        if not candidates:
+            # Everything is ejected; trying a host beats failing outright
+            candidates = [b for b in self.backends if b not in exclude]
+            if not candidates:
+                return None
+            self.routing["unhealthy_fallback"] += 1
+            return min(candidates, key=lambda backend: backend.in_flight)
+
+        resident = [b for b in candidates if model in b.resident_models]
+        if resident:
+            self.routing["resident"] += 1
+            return min(resident, key=lambda backend: backend.in_flight)
+        self.routing["least_loaded"] += 1
+        return min(candidates, key=lambda backend: backend.in_flight)
+
+    async def chat(self, model: str, messages: list, **kwargs):
+        """
+        Streams a chat completion, like `AsyncClient.chat(stream=True)`, over
+        the shared keep-alive connections of `streaming_client`.
+        """
+        tried = []
+        not_found = None
+        while True:
+            backend = self.pick(model, exclude=tried)
+            if backend is None:
+                if not_found is not None:
+                    raise not_found
+                raise NoBackendAvailable(f"No Ollama host could serve {model}")
+            tried.append(backend)
+
+            backend.in_flight += 1
+            backend.requests += 1
+            stream = None
+            try:
+                try:
+                    stream = streaming_client.chat(
+                        backend.url, model=model, messages=messages, **kwargs
+                    )
+                    first_chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except ResponseError as e:
+                    if 400 <= e.status_code < 500:
+                        # The request's fault, not the host's: never eject for it
+                        if e.status_code != 404:
+                            raise
+                        # Another host may have the model; raised if none has
+                        not_found = e
+                        continue
+                    self._host_failed(backend, model, e)
+                    continue
+                except Exception as e:
+                    self._host_failed(backend, model, e)
+                    continue
+
+                backend.consecutive_failures = 0
+                backend.resident_models.add(model)
+                yield first_chunk
+                async for chunk in stream:
+                    yield chunk
+                return
+            finally:
+                backend.in_flight -= 1
+                if stream is not None:
+                    await stream.aclose()
+
+    def _host_failed(self, backend: OllamaBackend, model: str, error: Exception):
+        # Nothing was shown to the user yet, so another host can take it
+        backend.mark_down(error)
+        logging.warning(f"Ollama host {backend.url} failed for {model}: {error}")
+        self.retries += 1
+
+    async def load(self, model: str, keep_alive) -> OllamaBackend:
+        """
+        Loads `model` on the host generations for it would be routed to.
+        """
+        backend = self.pick(model)
+        if backend is None:
+            raise NoBackendAvailable(f"No Ollama host could load {model}")
+        # An empty prompt only loads the model into memory
+        await backend.client.generate(model=model, prompt="", keep_alive=keep_alive)
+        backend.resident_models.add(model)
+        return backend
+
+    async def unload(self, backend: OllamaBackend, model: str):
+        await backend.client.generate(model=model, prompt="", keep_alive=0)
+        backend.resident_models.discard(model)
+
+    def stats(self) -> dict:
+        return {
+            "hosts": {backend.url: backend.stats() for backend in self.backends},
+            "routing": dict(self.routing),
+            "retries": self.retries,
+        }
+
+
+ollama_pool = OllamaPool(OLLAMA_HOSTS)
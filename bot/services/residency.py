@@ -0,0 +1,174 @@
+# bot/services/residency.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from bot.helpers.metrics import Histogram
+from bot.services.ollama_pool import ollama_pool
+from config.config_loader import (
+    COLD_START_THRESHOLD,
+    OLLAMA_DEFAULT_MODEL,
+    OLLAMA_KEEP_ALIVE_MAX,
+    OLLAMA_KEEP_ALIVE_MIN,
+    RESIDENCY_IDLE_UNLOAD,
+    RESIDENCY_INTERVAL,
+    RESIDENCY_WINDOW,
+)
+
+
+class ResidencyManager:
+    """
+    Keeps the models people use loaded in Ollama.
+
+    The default model, and any model a user just selected, is preloaded so
+    the next message does not pay the load time. Each request carries a
+    `keep_alive` sized to the model's recent request rate: long enough to
+    bridge the usual gap between requests, within OLLAMA_KEEP_ALIVE_MIN/MAX.
+    Models nobody asked for in RESIDENCY_IDLE_UNLOAD seconds are unloaded to
+    leave memory for the busy ones. Cold starts are detected from the
+    `load_duration` Ollama reports.
+    """
+
+    def __init__(self, default_model: str = None):
+        self.default_model = default_model
+        self.requests = {}  # model -> deque of request times within the window
+        # model -> last request or preload; models first seen resident count
+        # from when we noticed them
+        self.last_used = {}
+        self.cold_starts = {}
+        self.load_latency = {}  # model -> Histogram of load seconds
+        self.warmups = 0
+        self.unloads = 0
+        self._warming = set()
+        self._task = None
+        self._background = set()  # preloads started by warm_in_background
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        background = list(self._background)
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            if self.default_model:
+                await self.warm(self.default_model)
+            await self.unload_idle()
+            await asyncio.sleep(RESIDENCY_INTERVAL)
+
+    def _recent(self, model: str) -> deque:
+        times = self.requests.setdefault(model, deque())
+        cutoff = time.monotonic() - RESIDENCY_WINDOW
+        while times and times[0] < cutoff:
+            times.popleft()
+        return times
+
+    def record_request(self, model: str):
+        now = time.monotonic()
+        self._recent(model).append(now)
+        self.last_used[model] = now
+
+    def keep_alive(self, model: str) -> int:
+        """
+        Seconds Ollama should keep `model` loaded after this request.
+        """
+        count = len(self._recent(model))
+        if count < 2:
+            return OLLAMA_KEEP_ALIVE_MIN
+        # Twice the average gap between requests covers most pauses
+        average_gap = RESIDENCY_WINDOW / count
+        keep_alive = max(2 * average_gap, OLLAMA_KEEP_ALIVE_MIN)
+        return int(min(keep_alive, OLLAMA_KEEP_ALIVE_MAX))
+
+    def record_load(self, model: str, final_chunk: dict):
+        """
+        Counts a cold start when the final chunk shows the model had to be loaded.
+        """
+        load_seconds = (final_chunk.get("load_duration") or 0) / 1e9
+        if load_seconds < COLD_START_THRESHOLD:
+            return
+        self.cold_starts[model] = self.cold_starts.get(model, 0) + 1
+        self.load_latency.setdefault(model, Histogram()).observe(load_seconds)
+        logging.info(f"Cold start of {model}: loaded in {load_seconds:.1f}s")
+
+    def is_resident(self, model: str) -> bool:
+        return any(
+            backend.healthy and model in backend.resident_models
+            for backend in ollama_pool.backends
+        )
+
+    async def warm(self, model: str):
+        """
+        Preloads `model` unless it is already loaded or being loaded.
+        """
+        if not model or model in self._warming or self.is_resident(model):
+            return
+        self._warming.add(model)
+        start_time = time.monotonic()
+        self.last_used[model] = start_time
+        try:
+            backend = await ollama_pool.load(model, self.keep_alive(model))
+            load_seconds = time.monotonic() - start_time
+            self.warmups += 1
+            self.load_latency.setdefault(model, Histogram()).observe(load_seconds)
+            logging.info(f"Preloaded {model} on {backend.url} in {load_seconds:.1f}s")
+        except Exception as e:
+            logging.warning(f"Preloading {model} failed: {e}")
+        finally:
+            self._warming.discard(model)
+
+    def warm_in_background(self, model: str):
+        # The loop keeps only weak references, so hold on to the task
+        task = asyncio.create_task(self.warm(model))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def unload_idle(self):
+        now = time.monotonic()
+        cutoff = now - RESIDENCY_IDLE_UNLOAD
+        for backend in ollama_pool.backends:
+            if not backend.healthy:
+                continue
+            for model in list(backend.resident_models):
+                if model == self.default_model or model in self._warming:
+                    continue
+                if self.last_used.setdefault(model, now) >= cutoff:
+                    continue
+                try:
+                    await ollama_pool.unload(backend, model)
+                    self.unloads += 1
+                    logging.info(f"Unloaded idle model {model} from {backend.url}")
+                except Exception as e:
+                    logging.warning(
+                        f"Unloading {model} from {backend.url} failed: {e}"
+                    )
+
+    def stats(self) -> dict:
+        return {
+            "warmups": self.warmups,
+            "unloads": self.unloads,
+            "models": {
+                model: {
+                    "requests_in_window": len(self._recent(model)),
+                    "keep_alive": self.keep_alive(model),
+                    "cold_starts": self.cold_starts.get(model, 0),
+                }
+                for model in set(self.requests) | set(self.cold_starts)
+            },
+        }
+
+
+residency = ResidencyManager(OLLAMA_DEFAULT_MODEL)
@@ -0,0 +1,240 @@
+# bot/services/response_cache.py
+
+import asyncio
+import logging
+import re
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from bot.services.ollama_pool import ollama_pool
+from config.config_loader import (
+    EMBEDDING_MODEL,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_EXCLUDE_MODES,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_THRESHOLD,
+    RESPONSE_CACHE_TTL,
+)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercases, collapses whitespace and drops trailing punctuation, so
+    "What is a JOIN?" and "what is a join" embed the same.
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+
+class _VectorIndex:
+    """
+    Unit-length embeddings of one (mode, model) in a growable matrix, so a
+    lookup is one matrix-vector product.
+    """
+
+    def __init__(self, dimensions: int):
+        self.vectors = np.empty((64, dimensions), dtype=np.float32)
+        self.ids = []
+        self.rows = {}  # entry id -> row in vectors
+
+    def add(self, entry_id: str, vector: np.ndarray):
+        if len(self.ids) == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.empty_like(self.vectors)])
+        self.rows[entry_id] = len(self.ids)
+        self.vectors[len(self.ids)] = vector
+        self.ids.append(entry_id)
+
+    def remove(self, entry_id: str):
+        # Move the last row into the freed slot to keep the matrix dense
+        row = self.rows.pop(entry_id)
+        last_id = self.ids.pop()
+        if last_id != entry_id:
+            self.vectors[row] = self.vectors[len(self.ids)]
+            self.ids[row] = last_id
+            self.rows[last_id] = row
+
+    def nearest(self, vector: np.ndarray):
+        """
+        Returns (entry id, cosine similarity) of the closest entry.
+        """
+        if not self.ids:
+            return None, 0.0
+        similarities = self.vectors[: len(self.ids)] @ vector
+        row = int(np.argmax(similarities))
+        return self.ids[row], float(similarities[row])
+
+
+class ResponseCache:
+    """
+    Reuses answers to near-duplicate prompts in modes that opt in with
+    `response_cache: true` in chat_modes.yml. Only first turns, without
+    history or summary, are looked up or stored (see ollama_request).
+
+    Prompts are normalised and embedded with EMBEDDING_MODEL. An answer is
+    served when a cached prompt of the same mode and model is at least
+    RESPONSE_CACHE_THRESHOLD cosine-similar. Entries expire after
+    RESPONSE_CACHE_TTL seconds and the least recently hit ones are evicted
+    past RESPONSE_CACHE_SIZE. Entries are persisted to MongoDB and loaded
+    back at startup.
+    """
+
+    def __init__(self, max_size: int, ttl: float, threshold: float, excluded_modes):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.excluded_modes = set(excluded_modes)
+        self.entries = OrderedDict()  # entry id -> entry dict, least recent first
+        self.indexes = {}  # (mode, model) -> _VectorIndex
+        self.mode_stats = {}
+        self.embedding_failures = 0
+        self.db = None
+        self._writes = set()  # persist tasks still running
+
+    def enabled_for(self, mode) -> bool:
+        return (
+            RESPONSE_CACHE_ENABLED
+            and mode.response_cache
+            and mode.key not in self.excluded_modes
+        )
+
+    def _count(self, chat_mode: str, key: str):
+        counters = self.mode_stats.setdefault(
+            chat_mode, {"hits": 0, "misses": 0, "stores": 0}
+        )
+        counters[key] += 1
+
+    async def embed(self, text: str):
+        """
+        Unit-length embedding of the normalised text, or None if Ollama failed.
+        """
+        try:
+            response = await ollama_pool.client.embeddings(
+                model=EMBEDDING_MODEL, prompt=normalize_text(text)
+            )
+        except Exception as e:
+            self.embedding_failures += 1
+            logging.warning(f"Embedding for the response cache failed: {e}")
+            return None
+        vector = np.asarray(response["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    async def lookup(self, chat_mode: str, model: str, text: str):
+        """
+        Returns (cached answer or None, embedding). Pass the embedding to
+        `store` on a miss so the prompt is not embedded twice.
+        """
+        vector = await self.embed(text)
+        if vector is None:
+            return None, None
+        index = self.indexes.get((chat_mode, model))
+        if index is None or index.vectors.shape[1] != len(vector):
+            self._count(chat_mode, "misses")
+            return None, vector
+
+        entry_id, similarity = index.nearest(vector)
+        entry = self.entries.get(entry_id)
+        if entry is not None and time.time() - entry["created_at"] > self.ttl:
+            self._remove(entry_id)
+            entry = None
+        if entry is None or similarity < self.threshold:
+            self._count(chat_mode, "misses")
+            return None, vector
+
+        self.entries.move_to_end(entry_id)
+        entry["hits"] += 1
+        self._count(chat_mode, "hits")
+        logging.debug(
+            f"Response cache hit in {chat_mode} (similarity {similarity:.3f})"
+        )
+        return entry["answer"], vector
+
+    def store(self, chat_mode: str, model: str, text: str, vector, answer: str):
+        if vector is None or not answer:
+            return
+        entry = {
+            "_id": uuid.uuid4().hex,
+            "chat_mode": chat_mode,
+            "model": model,
+            "prompt": normalize_text(text),
+            "answer": answer,
+            "embedding": vector,
+            "created_at": time.time(),
+            "hits": 0,
+        }
+        self._add(entry)
+        self._count(chat_mode, "stores")
+        if self.db is not None:
+            # The loop keeps only weak references, so hold on to the task
+            task = asyncio.create_task(self._persist(entry))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    def _add(self, entry: dict):
+        key = (entry["chat_mode"], entry["model"])
+        index = self.indexes.get(key)
+        if index is None or index.vectors.shape[1] != len(entry["embedding"]):
+            # New mode/model, or the embedding model changed its dimensions
+            index = self.indexes[key] = _VectorIndex(len(entry["embedding"]))
+        index.add(entry["_id"], entry["embedding"])
+        self.entries[entry["_id"]] = entry
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, entry_id: str):
+        entry = self.entries.pop(entry_id)
+        index = self.indexes.get((entry["chat_mode"], entry["model"]))
+        if index is not None and entry_id in index.rows:
+            index.remove(entry_id)
+
+    async def _persist(self, entry: dict):
+        try:
+            await self.db.save_cached_response(
+                {**entry, "embedding": entry["embedding"].tolist()}
+            )
+        except Exception as e:
+            logging.warning(f"Persisting a response cache entry failed: {e}")
+
+    async def load(self, db):
+        """
+        Loads the most recent persisted entries and persists new ones to `db`.
+        """
+        self.db = db
+        if not RESPONSE_CACHE_ENABLED:
+            return
+        cutoff = time.time() - self.ttl
+        await db.delete_expired_cached_responses(cutoff)
+        loaded = 0
+        for document in reversed(await db.load_cached_responses(self.max_size)):
+            document["embedding"] = np.asarray(
+                document["embedding"], dtype=np.float32
+            )
+            document.setdefault("hits", 0)
+            self._add(document)
+            loaded += 1
+        logging.info(f"Loaded {loaded} response cache entries")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "embedding_failures": self.embedding_failures,
+            "modes": {
+                chat_mode: {
+                    **counters,
+                    "hit_rate": counters["hits"]
+                    / max(counters["hits"] + counters["misses"], 1),
+                }
+                for chat_mode, counters in self.mode_stats.items()
+            },
+        }
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_THRESHOLD,
+    RESPONSE_CACHE_EXCLUDE_MODES,
+)
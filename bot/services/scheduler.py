@@ -0,0 +1,204 @@
+# bot/services/scheduler.py
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from bot.helpers.metrics import Histogram
+from config.config_loader import (
+    MODEL_CONCURRENCY,
+    OLLAMA_MAX_CONCURRENCY,
+    SCHEDULER_MAX_QUEUE,
+    SCHEDULER_MAX_QUEUED_PER_USER,
+    SCHEDULER_UPDATE_INTERVAL,
+)
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a generation cannot be queued.
+    """
+
+
+class _Waiter:
+    __slots__ = ("user_id", "future")
+
+    def __init__(self, user_id, future):
+        self.user_id = user_id
+        self.future = future
+
+
+class _ModelQueue:
+    """
+    Running count and round-robin waiting lists for one model.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # user_id -> deque of waiters; the first user is served next and then
+        # moves to the back, so one busy user cannot starve everyone else
+        self.users = OrderedDict()
+
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self.users.values())
+
+    def push(self, waiter: _Waiter):
+        self.users.setdefault(waiter.user_id, deque()).append(waiter)
+
+    def pop_next(self) -> _Waiter:
+        user_id, waiters = next(iter(self.users.items()))
+        waiter = waiters.popleft()
+        if waiters:
+            self.users.move_to_end(user_id)
+        else:
+            del self.users[user_id]
+        return waiter
+
+    def remove(self, waiter: _Waiter) -> bool:
+        waiters = self.users.get(waiter.user_id)
+        if not waiters or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        if not waiters:
+            del self.users[waiter.user_id]
+        return True
+
+    def position(self, waiter: _Waiter) -> int:
+        """
+        1-based place in line, following the round-robin service order.
+        """
+        user_ids = list(self.users)
+        user_index = user_ids.index(waiter.user_id)
+        rank = self.users[waiter.user_id].index(waiter)
+        position = rank + 1
+        for index, user_id in enumerate(user_ids):
+            if index < user_index:
+                position += min(len(self.users[user_id]), rank + 1)
+            elif index > user_index:
+                position += min(len(self.users[user_id]), rank)
+        return position
+
+
+class InferenceScheduler:
+    """
+    Limits concurrent generations per model and queues the rest fairly.
+
+    Each model has its own concurrency cap. Waiting requests are grouped per
+    user and served round-robin across users. The queue is bounded both in
+    total and per user; requests past the bound are rejected with
+    QueueFullError instead of piling up.
+    """
+
+    def __init__(
+        self,
+        default_limit: int,
+        model_limits: dict,
+        max_queue: int,
+        max_queued_per_user: int,
+    ):
+        self.default_limit = default_limit
+        self.model_limits = model_limits
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.queues = {}
+        self.waiting = 0
+        self.rejected = 0
+        self.queue_wait = Histogram()
+        self.service_time = Histogram()
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self.queues.get(model)
+        if queue is None:
+            limit = self.model_limits.get(model, self.default_limit)
+            queue = self.queues[model] = _ModelQueue(max(1, limit))
+        return queue
+
+    @asynccontextmanager
+    async def slot(self, model: str, user_id: int, on_position=None):
+        """
+        Holds one of the model's generation slots for the duration of the block.
+
+        `on_position(n)` is awaited while queued whenever the place in line
+        changes (checked every SCHEDULER_UPDATE_INTERVAL seconds).
+        """
+        queue = self._queue(model)
+        enqueued_at = time.monotonic()
+        if queue.active < queue.limit and not queue.users:
+            queue.active += 1
+        else:
+            await self._wait(queue, user_id, on_position)
+
+        started_at = time.monotonic()
+        self.queue_wait.observe(started_at - enqueued_at)
+        try:
+            yield
+        finally:
+            self.service_time.observe(time.monotonic() - started_at)
+            self._release(queue)
+
+    async def _wait(self, queue: _ModelQueue, user_id: int, on_position):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError("Inference queue is full")
+        if len(queue.users.get(user_id, ())) >= self.max_queued_per_user:
+            self.rejected += 1
+            raise QueueFullError(f"User {user_id} already has requests queued")
+
+        waiter = _Waiter(user_id, asyncio.get_running_loop().create_future())
+        queue.push(waiter)
+        self.waiting += 1
+        try:
+            last_position = None
+            while not waiter.future.done():
+                position = queue.position(waiter)
+                if on_position is not None and position != last_position:
+                    last_position = position
+                    try:
+                        await on_position(position)
+                    except Exception as e:
+                        logging.warning(f"Queue position update failed: {e}")
+                if not waiter.future.done():
+                    await asyncio.wait(
+                        {waiter.future}, timeout=SCHEDULER_UPDATE_INTERVAL
+                    )
+        except asyncio.CancelledError:
+            if queue.remove(waiter):
+                self.waiting -= 1
+            elif waiter.future.done():
+                # The slot was handed to us just as we were cancelled
+                self._release(queue)
+            raise
+
+    def _release(self, queue: _ModelQueue):
+        if queue.users:
+            # Hand the slot straight to the next waiter
+            waiter = queue.pop_next()
+            self.waiting -= 1
+            waiter.future.set_result(None)
+        else:
+            queue.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "models": {
+                model: {
+                    "active": queue.active,
+                    "limit": queue.limit,
+                    "waiting": queue.waiting(),
+                }
+                for model, queue in self.queues.items()
+            },
+        }
+
+
+scheduler = InferenceScheduler(
+    OLLAMA_MAX_CONCURRENCY,
+    MODEL_CONCURRENCY,
+    SCHEDULER_MAX_QUEUE,
+    SCHEDULER_MAX_QUEUED_PER_USER,
+)
@@ -0,0 +1,205 @@
+# bot/services/usage_limiter.py
+
+import asyncio
+import time
+from datetime import date
+
+from bot.helpers.metrics import metrics
+from bot.helpers.token_bucket import TokenBucket
+from config.config_loader import (
+    RATE_LIMIT_NOTICE_INTERVAL,
+    RATE_LIMIT_TOKEN_BURST,
+    RATE_LIMIT_TOKENS_PER_MINUTE,
+    RATE_LIMIT_UPDATE_BURST,
+    RATE_LIMIT_UPDATES_PER_MINUTE,
+    USAGE_DEFAULT_TIER,
+    USAGE_TIERS,
+)
+
+# Seconds between sweeps for buckets of users who went quiet
+SWEEP_INTERVAL = 300
+
+NOTICES = {
+    "updates": "🚦 You are sending messages too fast. Please slow down a little.",
+    "tokens": "🚦 You have generated a lot in the last minutes. Please wait a bit.",
+    "quota": "📊 You have reached today's limit of {quota:,} generated tokens.",
+}
+
+rate_limited = metrics.counter(
+    "rate_limited_total",
+    "Updates dropped by the rate limiter, by reason: updates, tokens or quota",
+    ("reason",),
+)
+generated_tokens = metrics.counter(
+    "usage_generated_tokens_total", "Generated tokens charged to users"
+)
+
+
+class UsageLimiter:
+    """
+    Per-user token buckets on updates and on generated tokens, plus daily
+    generated-token quotas by user tier.
+
+    Buckets and today's usage live in memory. Usage increments also go to
+    the write-behind queue, which persists them to the users collection in
+    batches; a user's count is read back from there the first time they
+    generate on a given day.
+    """
+
+    def __init__(
+        self,
+        updates_per_minute: float,
+        update_burst: int,
+        tokens_per_minute: float,
+        token_burst: int,
+        tiers: dict,
+        default_tier: str,
+        notice_interval: float,
+    ):
+        self.update_rate = updates_per_minute / 60
+        self.update_burst = update_burst
+        self.token_rate = tokens_per_minute / 60
+        self.token_burst = token_burst
+        self.tiers = tiers
+        self.default_tier = default_tier
+        self.notice_interval = notice_interval
+        self.update_buckets = {}  # user_id -> TokenBucket
+        self.token_buckets = {}  # user_id -> TokenBucket
+        self.daily = {}  # user_id -> [day, tokens used, quota]
+        self.last_notice = {}  # user_id -> monotonic time
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.sweep()
+
+    def sweep(self):
+        """
+        Forgets users whose buckets are full again and whose day is over.
+        """
+        for buckets in (self.update_buckets, self.token_buckets):
+            for user_id in [
+                user_id
+                for user_id, bucket in buckets.items()
+                if bucket.available() >= bucket.capacity
+            ]:
+                del buckets[user_id]
+        today = date.today().isoformat()
+        for user_id in [u for u, used in self.daily.items() if used[0] != today]:
+            del self.daily[user_id]
+        cutoff = time.monotonic() - self.notice_interval
+        for user_id in [u for u, at in self.last_notice.items() if at < cutoff]:
+            del self.last_notice[user_id]
+
+    def check_update(self, user_id: int):
+        """
+        Takes one update from the user's bucket. Returns the reason to drop
+        the update, or None.
+        """
+        if self.update_rate <= 0:
+            return None
+        bucket = self.update_buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.update_rate, self.update_burst)
+            self.update_buckets[user_id] = bucket
+        return None if bucket.take() else "updates"
+
+    async def check_generation(self, db, user_id: int):
+        """
+        Returns why the user may not start a generation now, or None.
+        """
+        bucket = self.token_buckets.get(user_id)
+        if bucket is not None and bucket.available() <= 0:
+            return "tokens"
+        day, used, quota = await self._daily(db, user_id)
+        if quota and used >= quota:
+            return "quota"
+        return None
+
+    async def _daily(self, db, user_id: int) -> list:
+        today = date.today().isoformat()
+        usage = self.daily.get(user_id)
+        if usage is None or usage[0] != today:
+            user = await db.get_user(user_id) or {}
+            used = user.get("usage_tokens", 0) if user.get("usage_day") == today else 0
+            tier = user.get("tier", self.default_tier)
+            quota = self.tiers.get(tier, self.tiers.get(self.default_tier, 0))
+            usage = self.daily[user_id] = [today, used, quota]
+        return usage
+
+    def record_generation(self, db, user_id: int, tokens: int):
+        """
+        Charges a finished reply's generated tokens (Ollama's eval_count).
+        """
+        if not tokens:
+            return
+        generated_tokens.inc(amount=tokens)
+        if self.token_rate > 0:
+            bucket = self.token_buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.token_rate, self.token_burst)
+                self.token_buckets[user_id] = bucket
+            bucket.debit(tokens)
+        today = date.today().isoformat()
+        usage = self.daily.get(user_id)
+        if usage is not None and usage[0] == today:
+            usage[1] += tokens
+        db.write_queue.add_usage(user_id, today, tokens)
+
+    def record_shared_generation(self, db, user_ids: tuple, tokens: int):
+        """
+        Splits a reply's tokens evenly across the users it answered, as a
+        batched group reply answers several at once.
+        """
+        if not tokens:
+            return
+        share, rest = divmod(tokens, len(user_ids))
+        for index, user_id in enumerate(user_ids):
+            self.record_generation(db, user_id, share + (index < rest))
+
+    def should_notify(self, user_id: int) -> bool:
+        """
+        True at most once per notice interval for each user.
+        """
+        now = time.monotonic()
+        last = self.last_notice.get(user_id)
+        if last is not None and now - last < self.notice_interval:
+            return False
+        self.last_notice[user_id] = now
+        return True
+
+    def notice(self, reason: str, user_id: int) -> str:
+        usage = self.daily.get(user_id)
+        return NOTICES[reason].format(quota=usage[2] if usage else 0)
+
+    def stats(self) -> dict:
+        return {
+            "tracked_users": len(self.update_buckets),
+            "generating_users": len(self.token_buckets),
+            "daily_users": len(self.daily),
+        }
+
+
+usage_limiter = UsageLimiter(
+    RATE_LIMIT_UPDATES_PER_MINUTE,
+    RATE_LIMIT_UPDATE_BURST,
+    RATE_LIMIT_TOKENS_PER_MINUTE,
+    RATE_LIMIT_TOKEN_BURST,
+    USAGE_TIERS,
+    USAGE_DEFAULT_TIER,
+    RATE_LIMIT_NOTICE_INTERVAL,
+)
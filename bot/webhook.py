@@ -0,0 +1,208 @@
+# bot/webhook.py
+
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config.config_loader import (
+    WEBHOOK_CONTROL_WORKERS,
+    WEBHOOK_DELETE_ON_SHUTDOWN,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WEBHOOK_WORKERS,
+)
+
+
+# Commands that start a generation, so they take the message lane
+GENERATING_COMMANDS = ("/ask",)
+
+
+def is_control_update(update: dict) -> bool:
+    """
+    Button presses and commands, which finish quickly and must not wait
+    behind generations (the Stop button above all).
+    """
+    if "callback_query" in update:
+        return True
+    text = (update.get("message") or {}).get("text") or ""
+    command = text.split(maxsplit=1)[0].split("@")[0] if text else ""
+    return command.startswith("/") and command not in GENERATING_COMMANDS
+
+
+class UpdateWorkerPool:
+    """
+    A fixed number of workers feeding queued updates to the dispatcher.
+
+    The webhook answers Telegram as soon as an update is queued. When the
+    queue is full the update is refused with 503 so Telegram retries it later,
+    instead of the bot spawning unbounded tasks.
+
+    A text message holds its worker for the whole generation, queueing
+    included, so button presses and commands have their own queue and
+    `control_workers`. Stop, /mode and /settings stay responsive while
+    every message worker is busy streaming.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        workers: int,
+        max_queued: int,
+        control_workers: int = WEBHOOK_CONTROL_WORKERS,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.control_workers = control_workers
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.control_queue = asyncio.Queue(maxsize=max_queued)
+        self._tasks = []
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(self.queue))
+                for _ in range(self.workers)
+            ] + [
+                asyncio.create_task(self._worker(self.control_queue))
+                for _ in range(self.control_workers)
+            ]
+
+    async def close(self, timeout: float = 30):
+        """
+        Lets the workers finish queued updates, then stops them.
+        """
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(self.queue.join(), self.control_queue.join()),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            logging.warning(
+                f"Dropping {self.queue.qsize() + self.control_queue.qsize()} "
+                f"queued updates on shutdown"
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, update: dict) -> bool:
+        queue = self.control_queue if is_control_update(update) else self.queue
+        try:
+            queue.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dispatcher.feed_raw_update(bot=self.bot, update=update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Failed to process update: {e}")
+            finally:
+                queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "control_workers": self.control_workers,
+            "queued": self.queue.qsize(),
+            "control_queued": self.control_queue.qsize(),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+class PooledRequestHandler(SimpleRequestHandler):
+    """
+    aiogram's webhook handler (secret token check included), with background
+    processing going through an UpdateWorkerPool instead of one task per update.
+    """
+
+    def __init__(
+        self, dispatcher: Dispatcher, bot: Bot, pool: UpdateWorkerPool, **kwargs
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self.pool = pool
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request):
+        update = await request.json(loads=bot.session.json_loads)
+        if not self.pool.submit(update):
+            return web.Response(status=503, text="Update queue is full")
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+def create_webhook_app(dispatcher: Dispatcher, bot: Bot, pool: UpdateWorkerPool):
+    """
+    aiohttp application serving the webhook at WEBHOOK_PATH.
+    """
+    app = web.Application()
+
+    async def start_pool(app):
+        pool.start()
+
+    async def close_pool(app):
+        # Before the dispatcher's shutdown hooks close the database
+        await pool.close()
+
+    app.on_startup.append(start_pool)
+    app.on_shutdown.append(close_pool)
+
+    PooledRequestHandler(
+        dispatcher, bot, pool, secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot):
+    """
+    Serves updates over a webhook until cancelled, registering it with Telegram
+    at startup. The webhook is shared by all replicas, so it is only deleted
+    at shutdown with WEBHOOK_DELETE_ON_SHUTDOWN.
+    """
+    pool = UpdateWorkerPool(dispatcher, bot, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+
+    async def register_webhook():
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            max_connections=min(WEBHOOK_WORKERS, 100),
+        )
+        logging.info(f"Webhook registered at {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+    async def remove_webhook():
+        await bot.delete_webhook()
+        logging.info("Webhook removed")
+
+    dispatcher.startup.register(register_webhook)
+    if WEBHOOK_DELETE_ON_SHUTDOWN:
+        dispatcher.shutdown.register(remove_webhook)
+
+    runner = web.AppRunner(create_webhook_app(dispatcher, bot, pool))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logging.info(f"Listening for webhook updates on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -1,10 +1,22 @@
 import os
 
 from dotenv import load_dotenv
-from ollama import AsyncClient
 
 load_dotenv(dotenv_path="config/.env")
 
+
+def parse_model_map(value: str) -> dict:
+    """
+    Parses per-model settings written as "model=number,model=number".
+    """
+    return {
+        name.strip(): int(number)
+        for name, number in (
+            item.rsplit("=", 1) for item in value.split(",") if "=" in item
+        )
+    }
+
+
 TOKEN = os.getenv("BOT_TOKEN", None)
 MONGO_URI = os.getenv("MONGO_URI", None)
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", None)
@@ -12,4 +24,168 @@ OLLAMA_DEFAULT_MODEL = os.getenv("OLLAMA_DEFAULT_MODEL", None)
 OLLAMA_CUSTOM_PORT = os.getenv("OLLAMA_CUSTOM_PORT", 11434)
 TIMEOUT = os.getenv("TIMEOUT", "3000")
 
-client = AsyncClient(host=f"http://{OLLAMA_BASE_URL}:{OLLAMA_CUSTOM_PORT}")
+# MongoDB connection pool, shared by the whole process
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+)
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+
+# Context window settings (token counts are estimates, see bot/helpers/context_builder.py)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+CONTEXT_TRIM_STEP = int(os.getenv("CONTEXT_TRIM_STEP", "4"))
+# Per-model overrides, e.g. "llama3.1:8b=8192,dolphin-mistral=4096"
+MODEL_CONTEXT_BUDGETS = parse_model_map(os.getenv("MODEL_CONTEXT_BUDGETS", ""))
+
+# Dialog storage settings
+MESSAGE_BUCKET_SIZE = int(os.getenv("MESSAGE_BUCKET_SIZE", "50"))
+DIALOG_HISTORY_TURNS = int(os.getenv("DIALOG_HISTORY_TURNS", "20"))
+DIALOG_TTL_DAYS = int(os.getenv("DIALOG_TTL_DAYS", "0"))  # 0 keeps dialogs forever
+
+# Conversation compaction: once a dialog's turns not covered by its summary
+# pass this many tokens, older turns are summarised in the background
+COMPACTION_THRESHOLD_TOKENS = int(os.getenv("COMPACTION_THRESHOLD_TOKENS", "1500"))
+COMPACTION_KEEP_TURNS = int(os.getenv("COMPACTION_KEEP_TURNS", "4"))
+COMPACTION_SUMMARY_TOKENS = int(os.getenv("COMPACTION_SUMMARY_TOKENS", "300"))
+# Summariser model, defaults to OLLAMA_DEFAULT_MODEL
+COMPACTION_MODEL = os.getenv("COMPACTION_MODEL", "") or OLLAMA_DEFAULT_MODEL
+
+# In-process session cache for users, dialogs and recent history
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "300"))
+
+# Write-behind batching for dialog appends and last_interaction updates
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "1.0"))
+WRITE_QUEUE_MAX_PENDING = int(os.getenv("WRITE_QUEUE_MAX_PENDING", "5000"))
+
+# Streamed reply edit cadence; the actual interval adapts to edit latency and RetryAfter
+STREAM_MIN_EDIT_INTERVAL = float(os.getenv("STREAM_MIN_EDIT_INTERVAL", "1.0"))
+STREAM_MAX_EDIT_INTERVAL = float(os.getenv("STREAM_MAX_EDIT_INTERVAL", "10.0"))
+STREAM_MIN_EDIT_CHARS = int(os.getenv("STREAM_MIN_EDIT_CHARS", "50"))
+
+# Group chats: Telegram allows a bot about 20 messages a minute per group,
+# shared by every reply there, so group replies edit less often
+GROUPS_ENABLED = os.getenv("GROUPS_ENABLED", "true").lower() == "true"
+GROUP_DEBOUNCE_SECONDS = float(os.getenv("GROUP_DEBOUNCE_SECONDS", "2.0"))
+GROUP_MAX_BATCH = int(os.getenv("GROUP_MAX_BATCH", "10"))
+GROUP_MESSAGES_PER_MINUTE = float(os.getenv("GROUP_MESSAGES_PER_MINUTE", "18"))
+GROUP_MESSAGE_BURST = int(os.getenv("GROUP_MESSAGE_BURST", "3"))
+GROUP_MIN_EDIT_INTERVAL = float(os.getenv("GROUP_MIN_EDIT_INTERVAL", "4.0"))
+GROUP_MIN_EDIT_CHARS = int(os.getenv("GROUP_MIN_EDIT_CHARS", "200"))
+
+# Inference scheduling in front of Ollama
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+# Per-model overrides, e.g. "llama3.1:70b=1,phi3=4"
+MODEL_CONCURRENCY = parse_model_map(os.getenv("MODEL_CONCURRENCY", ""))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "100"))
+SCHEDULER_MAX_QUEUED_PER_USER = int(os.getenv("SCHEDULER_MAX_QUEUED_PER_USER", "2"))
+SCHEDULER_UPDATE_INTERVAL = float(os.getenv("SCHEDULER_UPDATE_INTERVAL", "3.0"))
+
+# Ollama hosts to spread generations over, e.g. "http://gpu1:11434,http://gpu2:11434".
+# Defaults to the single OLLAMA_BASE_URL host.
+OLLAMA_HOSTS = [
+    host.strip()
+    for host in os.getenv(
+        "OLLAMA_HOSTS", f"http://{OLLAMA_BASE_URL}:{OLLAMA_CUSTOM_PORT}"
+    ).split(",")
+    if host.strip()
+]
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "3"))
+OLLAMA_EJECT_AFTER = int(os.getenv("OLLAMA_EJECT_AFTER", "3"))
+# Keep-alive HTTP connections shared by all streamed generations
+OLLAMA_HTTP_POOL_SIZE = int(os.getenv("OLLAMA_HTTP_POOL_SIZE", "64"))
+OLLAMA_HTTP_KEEPALIVE = float(os.getenv("OLLAMA_HTTP_KEEPALIVE", "60"))
+
+# Seconds the cached Ollama model list is served before a background refresh
+MODEL_CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", "60"))
+
+# Model residency: keep_alive bounds (seconds) sized from each model's request rate
+OLLAMA_KEEP_ALIVE_MIN = int(os.getenv("OLLAMA_KEEP_ALIVE_MIN", "300"))
+OLLAMA_KEEP_ALIVE_MAX = int(os.getenv("OLLAMA_KEEP_ALIVE_MAX", "3600"))
+RESIDENCY_WINDOW = float(os.getenv("RESIDENCY_WINDOW", "3600"))
+RESIDENCY_INTERVAL = float(os.getenv("RESIDENCY_INTERVAL", "60"))
+RESIDENCY_IDLE_UNLOAD = float(os.getenv("RESIDENCY_IDLE_UNLOAD", "1800"))
+# Load times above this (seconds) count as a cold start
+COLD_START_THRESHOLD = float(os.getenv("COLD_START_THRESHOLD", "1.0"))
+
+# Semantic response cache for chat modes with `response_cache: true`
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+# Modes never cached, even if chat_modes.yml opts them in
+RESPONSE_CACHE_EXCLUDE_MODES = [
+    mode.strip()
+    for mode in os.getenv("RESPONSE_CACHE_EXCLUDE_MODES", "psychologist").split(",")
+    if mode.strip()
+]
+
+# How updates arrive: "polling" (getUpdates) or "webhook" (aiohttp server)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Public HTTPS base URL Telegram posts updates to, e.g. "https://bot.example.com"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))
+# Extra workers for button presses and commands, so they never wait behind
+# generations
+WEBHOOK_CONTROL_WORKERS = int(os.getenv("WEBHOOK_CONTROL_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Delete the webhook when the bot stops. Replicas share one webhook, so this
+# is only for a single instance that owns it
+WEBHOOK_DELETE_ON_SHUTDOWN = (
+    os.getenv("WEBHOOK_DELETE_ON_SHUTDOWN", "false").lower() == "true"
+)
+# Alternative Bot API server, e.g. a local one or a fake one for benchmarks
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Where FSM state, open menus and chat locks live: "memory" (single instance)
+# or "mongo" (shared by all replicas)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+GENERATION_LOCK_TTL = float(os.getenv("GENERATION_LOCK_TTL", "30"))
+GENERATION_LOCK_WAIT = float(os.getenv("GENERATION_LOCK_WAIT", "60"))
+MENU_SWEEP_INTERVAL = float(os.getenv("MENU_SWEEP_INTERVAL", "30"))
+
+# Chat modes: seconds between checks of chat_modes.yml for changes, 0 disables
+MODE_RELOAD_INTERVAL = float(os.getenv("MODE_RELOAD_INTERVAL", "5"))
+
+# Identical first-turn prompts in flight at once share one Ollama stream
+COALESCE_GENERATIONS = os.getenv("COALESCE_GENERATIONS", "true").lower() == "true"
+
+# Prometheus metrics endpoint (/metrics), 0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Per-update tracing: slow updates are always kept, the rest are sampled
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "10"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+
+# Telegram user ids allowed to run admin commands such as /profile
+ADMIN_IDS = [
+    int(user_id)
+    for user_id in os.getenv("ADMIN_IDS", "").split(",")
+    if user_id.strip()
+]
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+
+# Per-user rate limits (0 disables each one) and daily generated-token quotas
+RATE_LIMIT_UPDATES_PER_MINUTE = float(os.getenv("RATE_LIMIT_UPDATES_PER_MINUTE", "30"))
+RATE_LIMIT_UPDATE_BURST = int(os.getenv("RATE_LIMIT_UPDATE_BURST", "10"))
+RATE_LIMIT_TOKENS_PER_MINUTE = float(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", "4000"))
+RATE_LIMIT_TOKEN_BURST = int(os.getenv("RATE_LIMIT_TOKEN_BURST", "8000"))
+RATE_LIMIT_NOTICE_INTERVAL = float(os.getenv("RATE_LIMIT_NOTICE_INTERVAL", "60"))
+# Daily token quota per tier, "tier=tokens"; users carry their tier in the
+# `tier` field of their document, 0 means unlimited
+USAGE_TIERS = parse_model_map(os.getenv("USAGE_TIERS", "default=200000"))
+USAGE_DEFAULT_TIER = os.getenv("USAGE_DEFAULT_TIER", "default")
@@ -1,44 +1,230 @@
 # database/bot_database.py
 
+import time
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
 
-from config.config_loader import MONGO_URI, OLLAMA_DEFAULT_MODEL
+from bot.helpers.tracing import traced
+from config.config_loader import (
+    DIALOG_HISTORY_TURNS,
+    DIALOG_TTL_DAYS,
+    MESSAGE_BUCKET_SIZE,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_URI,
+    OLLAMA_DEFAULT_MODEL,
+    SESSION_CACHE_SIZE,
+    SESSION_CACHE_TTL,
+    STATE_BACKEND,
+    WRITE_BATCH_SIZE,
+    WRITE_FLUSH_INTERVAL,
+    WRITE_QUEUE_MAX_PENDING,
+)
+from database.pool_monitor import CommandMetricsListener, PoolStatsListener
+from database.write_behind import WriteBehindQueue
+
+
+class SessionCache:
+    """
+    Small in-process cache with per-entry TTL and LRU eviction.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key):
+        """
+        Returns a live entry without touching LRU order or hit statistics.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
 
 
 class BotDatabase:
-    def __init__(self):
-        self.client = AsyncIOMotorClient(MONGO_URI)
+    """
+    Application-wide database service. One instance is created at startup in
+    main.py and handed to handlers through the dispatcher's workflow data.
+
+    With `shared_sessions` (STATE_BACKEND=mongo, several replicas), every
+    write that changes a user's session (new dialog, model, appended turns)
+    sets a new `session_stamp` on the user document. A cached user is checked
+    against it on each `get_user`; on a mismatch the user, their dialog and
+    its history are dropped from the session caches and read again.
+    """
+
+    def __init__(self, shared_sessions: bool = STATE_BACKEND == "mongo"):
+        self.shared_sessions = shared_sessions
+        self.pool_listener = PoolStatsListener(MONGO_MAX_POOL_SIZE)
+        self.client = AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            event_listeners=[self.pool_listener, CommandMetricsListener()],
+        )
         self.db = self.client[
             "ollama_telegram_bot_db"
         ]  # Define your database name here
         self.users_collection = self.db["users"]
         self.dialogs_collection = self.db["dialogs"]
+        # Dialog turns live here, MESSAGE_BUCKET_SIZE turns per bucket document
+        self.messages_collection = self.db["dialog_messages"]
+        # Semantic response cache entries, reloaded at startup
+        self.response_cache_collection = self.db["response_cache"]
 
-    async def create_user(self, user_id, chat_id, username, first_name, last_name):
-        user_data = {
-            "_id": user_id,
-            "chat_id": chat_id,
-            "username": username,
-            "first_name": first_name,
-            "last_name": last_name,
-            "last_interaction": datetime.now(),
-            "first_seen": datetime.now(),
-            "current_dialog_id": None,
-            # Removed 'selected_mode' field
-        }
-        existing_user = await self.users_collection.find_one({"_id": user_id})
-        if existing_user:
-            # If the user exists, update the `last_interaction`
-            await self.users_collection.update_one(
-                {"_id": user_id}, {"$set": {"last_interaction": datetime.now()}}
+        # Session caches for the per-message hot path
+        self.user_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+        self.dialog_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+        # dialog_id -> (limit, recent turns) as last loaded by get_recent_messages
+        self.history_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+        # Dialog appends and last_interaction touches are written in batches
+        self.write_queue = WriteBehindQueue(
+            self, WRITE_QUEUE_MAX_PENDING, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL
+        )
+
+    async def close(self):
+        """
+        Flushes pending writes and closes the MongoDB client.
+        """
+        await self.write_queue.close()
+        self.client.close()
+
+    async def ensure_indexes(self):
+        """
+        Creates the indexes the handlers rely on. Called once at startup.
+        """
+        await self.users_collection.create_index("chat_id")
+        await self.messages_collection.create_index(
+            [("user_id", ASCENDING), ("dialog_id", ASCENDING), ("bucket", ASCENDING)]
+        )
+        await self.dialogs_collection.create_index(
+            [("user_id", ASCENDING), ("start_time", DESCENDING)]
+        )
+        # Buckets used to expire on their own updated_at, leaving gaps in
+        # dialogs that were still active
+        if "updated_at_1" in await self.messages_collection.index_information():
+            await self.messages_collection.drop_index("updated_at_1")
+        if DIALOG_TTL_DAYS > 0:
+            ttl_seconds = DIALOG_TTL_DAYS * 24 * 60 * 60
+            # Buckets carry their dialog's last_activity, so a dialog's turns
+            # expire together with it
+            await self.messages_collection.create_index(
+                "last_activity", expireAfterSeconds=ttl_seconds
+            )
+            await self.dialogs_collection.create_index(
+                "last_activity", expireAfterSeconds=ttl_seconds
             )
-        else:
-            # If the user does not exist, insert the new user document
-            await self.users_collection.insert_one(user_data)
+        # created_at is a Unix timestamp, so expiry is done by the cache itself;
+        # this index serves the newest-first load at startup
+        await self.response_cache_collection.create_index(
+            [("created_at", DESCENDING)]
+        )
+
+    def cache_stats(self):
+        """
+        Returns hit-rate statistics for the session caches.
+        """
+        return {
+            "users": self.user_cache.stats(),
+            "dialogs": self.dialog_cache.stats(),
+            "history": self.history_cache.stats(),
+        }
 
+    def pool_stats(self):
+        """
+        Returns connection pool utilisation for sizing MONGO_MAX_POOL_SIZE.
+        """
+        return self.pool_listener.stats()
+
+    def write_queue_stats(self):
+        """
+        Returns queue depth, batch size and flush latency of the write-behind queue.
+        """
+        return self.write_queue.stats()
+
+    @traced("db.create_user")
+    async def create_user(self, user_id, chat_id, username, first_name, last_name):
+        now = datetime.now()
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            # Known user: just record the interaction, it is written in the background
+            user["last_interaction"] = now
+            self.write_queue.touch(user_id, now)
+            return
+
+        # Create the user or touch `last_interaction` in a single upsert, and
+        # keep the resulting document so the rest of the turn reads from cache
+        user = await self.users_collection.find_one_and_update(
+            {"_id": user_id},
+            {
+                "$set": {
+                    "chat_id": chat_id,
+                    "username": username,
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    "last_interaction": now,
+                },
+                "$setOnInsert": {"first_seen": now, "current_dialog_id": None},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self.user_cache.set(user_id, user)
+
+    @traced("db.create_dialog")
     async def create_dialog(self, user_id, chat_mode="assistant", model="test"):
         dialog_id = str(uuid.uuid4())  # Use UUID for unique dialog_id
         dialog_data = {
@@ -47,51 +233,218 @@ class BotDatabase:
             "chat_mode": chat_mode,  # Set chat_mode
             "start_time": datetime.now(),
             "model": model,
-            "messages": [],
+            "message_count": 0,
+            "last_activity": datetime.now(),
         }
         # Insert the dialog into the dialogs collection
         await self.dialogs_collection.insert_one(dialog_data)
 
         # Update the current dialog ID in the user's document
+        stamp = self._new_stamp()
         await self.users_collection.update_one(
-            {"_id": user_id}, {"$set": {"current_dialog_id": dialog_id}}
+            {"_id": user_id},
+            {"$set": {"current_dialog_id": dialog_id, "session_stamp": stamp}},
         )
+
+        self.dialog_cache.set(dialog_id, dialog_data)
+        self.history_cache.set(dialog_id, (DIALOG_HISTORY_TURNS, []))
+        user = self.user_cache.peek(user_id)
+        if user is not None:
+            user["current_dialog_id"] = dialog_id
+            user["session_stamp"] = stamp
         return dialog_id
 
+    @traced("db.add_message_to_dialog")
     async def add_message_to_dialog(
-        self, user_id, dialog_id, user_message, bot_message
+        self, user_id, dialog_id, user_message, bot_message, truncated=False
     ):
         message_data = {
             "user": user_message,  # User's message
             "bot": bot_message,  # Bot's message
             "date": datetime.now(),  # Current timestamp
         }
+        if truncated:
+            # The reply was stopped before the model finished
+            message_data["truncated"] = True
+
+        # Queue the append; sequence numbers are assigned when the batch is written
+        await self.write_queue.add_message(user_id, dialog_id, message_data)
+
+        # Keep the cached history window in step so the next turn sees this one
+        cached = self.history_cache.peek(dialog_id)
+        if cached is not None:
+            cached_limit, messages = cached
+            messages.append(message_data)
+            if len(messages) > cached_limit:
+                del messages[:-cached_limit]
+
+    @traced("db.get_recent_messages")
+    async def get_recent_messages(self, user_id, dialog_id, limit):
+        """
+        Returns the last `limit` turns of a dialog, oldest first.
+        """
+        if limit <= 0:
+            return []
+
+        cached = self.history_cache.get(dialog_id)
+        if cached is not None:
+            cached_limit, messages = cached
+            if cached_limit >= limit:
+                return messages[-limit:]
+
+        # Dialogs that were not migrated yet still carry a legacy messages array
+        dialog = await self.dialogs_collection.find_one(
+            {"_id": dialog_id}, {"messages": {"$slice": -limit}}
+        )
+        legacy_messages = (dialog or {}).get("messages")
+        query = {"user_id": user_id, "dialog_id": dialog_id}
+        if legacy_messages is not None:
+            # Buckets below zero are a migration in progress, the array wins
+            query["bucket"] = {"$gte": 0}
+
+        bucket_count = limit // MESSAGE_BUCKET_SIZE + 2
+        cursor = (
+            self.messages_collection.find(query, {"messages": 1})
+            .sort("bucket", DESCENDING)
+            .limit(bucket_count)
+        )
+        messages = []
+        async for bucket in cursor:
+            messages.extend(bucket.get("messages", []))
+        messages.sort(key=lambda m: m["seq"])
+
+        if legacy_messages:
+            messages = legacy_messages + messages
+        messages = messages[-limit:]
+        self.history_cache.set(dialog_id, (limit, messages))
+        return list(messages)
 
-        # Append the message to the dialog's messages array
+    @traced("db.save_dialog_summary")
+    async def save_dialog_summary(self, dialog_id, text, through_seq):
+        """
+        Stores the rolling summary of a dialog's turns up to `through_seq`.
+        """
+        summary = {
+            "text": text,
+            "through_seq": through_seq,
+            "updated_at": datetime.now(),
+        }
         await self.dialogs_collection.update_one(
-            {"_id": dialog_id, "user_id": user_id},
-            {"$push": {"messages": message_data}},  # Use $push to append to the array
+            {"_id": dialog_id}, {"$set": {"summary": summary}}
+        )
+        dialog = self.dialog_cache.peek(dialog_id)
+        if dialog is not None:
+            dialog["summary"] = summary
+
+    def _new_stamp(self):
+        return uuid.uuid4().hex if self.shared_sessions else None
+
+    async def stamp_sessions(self, user_ids):
+        """
+        Marks the users' sessions as changed for the other replicas. Our own
+        cached copies take the same stamp, so they stay valid here.
+        """
+        if not self.shared_sessions or not user_ids:
+            return
+        stamps = {user_id: self._new_stamp() for user_id in user_ids}
+        await self.users_collection.bulk_write(
+            [
+                UpdateOne({"_id": user_id}, {"$set": {"session_stamp": stamp}})
+                for user_id, stamp in stamps.items()
+            ],
+            ordered=False,
         )
+        for user_id, stamp in stamps.items():
+            user = self.user_cache.peek(user_id)
+            if user is not None:
+                user["session_stamp"] = stamp
 
+    async def _still_current(self, user_id, user) -> bool:
+        """
+        Whether no other replica changed the cached user's session. If one
+        did, the user and their dialog are dropped from the session caches.
+        """
+        current = await self.users_collection.find_one(
+            {"_id": user_id}, {"session_stamp": 1}
+        )
+        if current is not None and current.get("session_stamp") == user.get(
+            "session_stamp"
+        ):
+            return True
+        self.user_cache.invalidate(user_id)
+        dialog_id = user.get("current_dialog_id")
+        if dialog_id is not None:
+            self.dialog_cache.invalidate(dialog_id)
+            self.history_cache.invalidate(dialog_id)
+        return False
+
+    @traced("db.get_user")
     async def get_user(self, user_id):
-        # Fetch user from the database
-        return await self.users_collection.find_one({"_id": user_id})
+        user = self.user_cache.get(user_id)
+        if (
+            user is not None
+            and self.shared_sessions
+            and not await self._still_current(user_id, user)
+        ):
+            user = None
+        if user is None:
+            # Fetch user from the database
+            user = await self.users_collection.find_one({"_id": user_id})
+            if user is not None:
+                self.user_cache.set(user_id, user)
+        return user
 
+    @traced("db.get_dialog")
     async def get_dialog(self, dialog_id):
-        # Fetch dialog from the database
-        return await self.dialogs_collection.find_one({"_id": dialog_id})
+        dialog = self.dialog_cache.get(dialog_id)
+        if dialog is None:
+            # Fetch dialog metadata without the (legacy) messages array
+            dialog = await self.dialogs_collection.find_one(
+                {"_id": dialog_id}, {"messages": 0}
+            )
+            if dialog is not None:
+                self.dialog_cache.set(dialog_id, dialog)
+        return dialog
 
+    @traced("db.update_user_last_interaction")
     async def update_user_last_interaction(self, user_id):
-        # Update the user's last_interaction timestamp
-        await self.users_collection.update_one(
-            {"_id": user_id}, {"$set": {"last_interaction": datetime.now()}}
-        )
+        now = datetime.now()
+        # Queue the user's last_interaction update, repeated touches are coalesced
+        self.write_queue.touch(user_id, now)
+        user = self.user_cache.peek(user_id)
+        if user is not None:
+            user["last_interaction"] = now
 
+    @traced("db.update_user_model")
     async def update_user_model(self, user_id, selected_model):
         await self.users_collection.update_one(
-            {"_id": user_id}, {"$set": {"selected_model": selected_model}}
+            {"_id": user_id},
+            {
+                "$set": {
+                    "selected_model": selected_model,
+                    "session_stamp": self._new_stamp(),
+                }
+            },
         )
+        self.user_cache.invalidate(user_id)
 
+    @traced("db.get_selected_model")
     async def get_selected_model(self, user_id):
-        user = await self.users_collection.find_one({"_id": user_id})
-        return user.get("selected_model", OLLAMA_DEFAULT_MODEL)
+        user = await self.get_user(user_id)
+        return (user or {}).get("selected_model", OLLAMA_DEFAULT_MODEL)
+
+    @traced("db.save_cached_response")
+    async def save_cached_response(self, entry):
+        await self.response_cache_collection.insert_one(entry)
+
+    async def load_cached_responses(self, limit):
+        """
+        Returns the newest response cache entries, newest first.
+        """
+        cursor = self.response_cache_collection.find().sort("created_at", DESCENDING)
+        return await cursor.to_list(length=limit)
+
+    async def delete_expired_cached_responses(self, created_before):
+        await self.response_cache_collection.delete_many(
+            {"created_at": {"$lt": created_before}}
+        )
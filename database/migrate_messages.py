@@ -0,0 +1,164 @@
+# database/migrate_messages.py
+#
+# Moves legacy `dialogs.messages` arrays into the bucketed `dialog_messages`
+# collection. Safe to run while the bot is serving traffic:
+#
+#   python -m database.migrate_messages --batch-size 100 --pause 0.5
+#
+# Legacy turns are written with negative sequence numbers so they always sort
+# before anything the running bot appended after the upgrade. Readers ignore
+# negative buckets while the legacy array is still present, and the array is
+# only removed once its buckets are fully written, so a dialog is never seen
+# with missing or duplicated turns.
+#
+# Afterwards, buckets written before buckets carried their dialog's
+# last_activity get it, so DIALOG_TTL_DAYS expires them with their dialog.
+
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from config.config_loader import MESSAGE_BUCKET_SIZE
+from database.bot_database import BotDatabase
+
+
+def build_bucket_updates(dialog, last_activity):
+    """
+    Builds idempotent bucket upserts for one dialog's legacy messages array.
+    """
+    legacy_messages = dialog["messages"]
+    total = len(legacy_messages)
+
+    buckets = {}
+    for index, message in enumerate(legacy_messages):
+        seq = index - total
+        bucket = seq // MESSAGE_BUCKET_SIZE
+        buckets.setdefault(bucket, []).append({"seq": seq, **message})
+
+    updates = []
+    for bucket, messages in buckets.items():
+        updates.append(
+            UpdateOne(
+                {"_id": f"{dialog['_id']}:{bucket}"},
+                {
+                    "$set": {
+                        "user_id": dialog["user_id"],
+                        "dialog_id": dialog["_id"],
+                        "bucket": bucket,
+                        "messages": messages,
+                        "count": len(messages),
+                    },
+                    "$max": {"last_activity": last_activity},
+                },
+                upsert=True,
+            )
+        )
+    return updates
+
+
+async def migrate_dialog(db: BotDatabase, dialog):
+    legacy_messages = dialog["messages"]
+    # The running bot may have appended turns since, so the dialog's own
+    # last_activity can be the later one
+    last_activity = max(
+        filter(
+            None,
+            (
+                legacy_messages[-1].get("date") if legacy_messages else None,
+                dialog.get("last_activity"),
+                dialog.get("start_time"),
+            ),
+        ),
+        default=datetime.now(),
+    )
+    updates = build_bucket_updates(dialog, last_activity)
+    if updates:
+        await db.messages_collection.bulk_write(updates, ordered=False)
+
+    # Drop the array only if nobody touched it since we read it
+    result = await db.dialogs_collection.update_one(
+        {"_id": dialog["_id"], "messages": {"$size": len(legacy_messages)}},
+        {"$unset": {"messages": ""}, "$max": {"last_activity": last_activity}},
+    )
+    return result.modified_count == 1
+
+
+async def migrate(batch_size: int, pause: float):
+    db = BotDatabase()
+    await db.ensure_indexes()
+
+    migrated = 0
+    skipped = 0
+    while True:
+        batch = await db.dialogs_collection.find(
+            {"messages": {"$exists": True}},
+            {"user_id": 1, "messages": 1, "start_time": 1, "last_activity": 1},
+        ).to_list(length=batch_size)
+        if not batch:
+            break
+
+        for dialog in batch:
+            if await migrate_dialog(db, dialog):
+                migrated += 1
+            else:
+                skipped += 1
+        logging.info(f"Migrated {migrated} dialogs so far ({skipped} retried)")
+
+        # Give the live workload some room between batches
+        await asyncio.sleep(pause)
+
+    logging.info(f"Migration finished: {migrated} dialogs moved to dialog_messages")
+    await stamp_buckets(db, batch_size, pause)
+    db.client.close()
+
+
+async def stamp_buckets(db: BotDatabase, batch_size: int, pause: float):
+    """
+    Copies each dialog's last_activity onto its buckets that lack one, and
+    deletes buckets whose dialog has already expired.
+    """
+    stamped = 0
+    while True:
+        buckets = await db.messages_collection.find(
+            {"last_activity": {"$exists": False}}, {"dialog_id": 1}
+        ).to_list(length=batch_size)
+        if not buckets:
+            break
+
+        dialog_ids = list({bucket["dialog_id"] for bucket in buckets})
+        dialogs = await db.dialogs_collection.find(
+            {"_id": {"$in": dialog_ids}}, {"last_activity": 1, "start_time": 1}
+        ).to_list(length=None)
+        for dialog in dialogs:
+            last_activity = (
+                dialog.get("last_activity")
+                or dialog.get("start_time")
+                or datetime.now()
+            )
+            result = await db.messages_collection.update_many(
+                {"dialog_id": dialog["_id"], "last_activity": {"$exists": False}},
+                {"$set": {"last_activity": last_activity}},
+            )
+            stamped += result.modified_count
+        expired = set(dialog_ids) - {dialog["_id"] for dialog in dialogs}
+        if expired:
+            await db.messages_collection.delete_many(
+                {"dialog_id": {"$in": list(expired)}}
+            )
+        logging.info(f"Stamped {stamped} buckets with their dialog's last_activity")
+
+        await asyncio.sleep(pause)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Move dialog messages into the bucketed store"
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--pause", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.pause))
@@ -0,0 +1,102 @@
+# database/pool_monitor.py
+
+from pymongo import monitoring
+
+from bot.helpers.metrics import FAST_LATENCY_BUCKETS, metrics
+
+command_latency = metrics.histogram(
+    "mongo_command_seconds",
+    "MongoDB command latency, by command",
+    ("command",),
+    FAST_LATENCY_BUCKETS,
+)
+command_failures = metrics.counter(
+    "mongo_command_failures_total", "MongoDB commands that failed", ("command",)
+)
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Tracks connection pool utilisation so the pool can be sized for real traffic.
+    """
+
+    def __init__(self, max_pool_size: int):
+        self.max_pool_size = max_pool_size
+        self.open_connections = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open_connections += 1
+        self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open_connections -= 1
+        self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checkouts += 1
+        self.checked_out += 1
+        self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def stats(self):
+        return {
+            "max_pool_size": self.max_pool_size,
+            "open_connections": self.open_connections,
+            "checked_out": self.checked_out,
+            "peak_checked_out": self.peak_checked_out,
+            "utilisation": (
+                self.checked_out / self.max_pool_size if self.max_pool_size else 0.0
+            ),
+            "connections_created": self.connections_created,
+            "connections_closed": self.connections_closed,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.pool_clears,
+        }
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    Records the latency of every command the driver sends, e.g. find or
+    update, as reported by the server round trip.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        command_latency.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        command_latency.labels(event.command_name).observe(event.duration_micros / 1e6)
+        command_failures.inc(event.command_name)
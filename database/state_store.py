@@ -0,0 +1,340 @@
+# database/state_store.py
+
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from config.config_loader import STATE_BACKEND
+
+
+class StateStore(ABC):
+    """
+    Shared state that must survive restarts and be visible to every replica:
+    FSM state, open menus with their deadlines, and per-chat locks.
+
+    Deadlines and lock expiries are Unix timestamps (seconds).
+    """
+
+    async def ensure_indexes(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # Key/value entries, used for aiogram FSM state and data
+    @abstractmethod
+    async def get(self, key: str):
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    # Open menus
+    @abstractmethod
+    async def save_menu(self, key: str, menu: dict, deadline: float):
+        ...
+
+    @abstractmethod
+    async def get_menu(self, key: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def delete_menu(self, key: str):
+        ...
+
+    @abstractmethod
+    async def claim_menu(self, key: str, now: float) -> Optional[dict]:
+        """
+        Removes and returns the menu if its deadline has passed. Only one
+        caller, on any replica, gets it.
+        """
+
+    @abstractmethod
+    async def claim_expired_menus(self, before: float) -> list:
+        ...
+
+    @abstractmethod
+    async def pending_menus(self) -> list:
+        ...
+
+    # Locks
+    @abstractmethod
+    async def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def refresh_lock(self, name: str, owner: str, ttl: float):
+        """
+        Extends a held lock. Returns None if the lock was lost, otherwise
+        whether another owner asked for it to be released.
+        """
+
+    @abstractmethod
+    async def release_lock(self, name: str, owner: str):
+        ...
+
+    @abstractmethod
+    async def request_release(self, name: str) -> bool:
+        """
+        Asks the holder of a lock to let go. Returns False if nobody holds it.
+        """
+
+
+class MemoryStateStore(StateStore):
+    """
+    Process-local store, for a single bot instance.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.menus = {}  # key -> (deadline, menu)
+        self.locks = {}  # name -> {"owner", "expires_at", "release_requested"}
+
+    async def get(self, key: str):
+        return self.values.get(key)
+
+    async def set(self, key: str, value):
+        self.values[key] = value
+
+    async def delete(self, key: str):
+        self.values.pop(key, None)
+
+    async def save_menu(self, key: str, menu: dict, deadline: float):
+        self.menus[key] = (deadline, menu)
+
+    async def get_menu(self, key: str) -> Optional[dict]:
+        entry = self.menus.get(key)
+        if entry is None:
+            return None
+        return {**entry[1], "key": key, "deadline": entry[0]}
+
+    async def delete_menu(self, key: str):
+        self.menus.pop(key, None)
+
+    async def claim_menu(self, key: str, now: float) -> Optional[dict]:
+        entry = self.menus.get(key)
+        if entry is None or entry[0] > now:
+            return None
+        del self.menus[key]
+        return {**entry[1], "key": key, "deadline": entry[0]}
+
+    async def claim_expired_menus(self, before: float) -> list:
+        expired = [
+            key for key, (deadline, _) in self.menus.items() if deadline <= before
+        ]
+        return [await self.claim_menu(key, before) for key in expired]
+
+    async def pending_menus(self) -> list:
+        return [await self.get_menu(key) for key in list(self.menus)]
+
+    async def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        lock = self.locks.get(name)
+        if lock is not None and lock["owner"] != owner and lock["expires_at"] > now:
+            return False
+        self.locks[name] = {
+            "owner": owner,
+            "expires_at": now + ttl,
+            "release_requested": False,
+        }
+        return True
+
+    async def refresh_lock(self, name: str, owner: str, ttl: float):
+        lock = self.locks.get(name)
+        if lock is None or lock["owner"] != owner:
+            return None
+        lock["expires_at"] = time.time() + ttl
+        return lock["release_requested"]
+
+    async def release_lock(self, name: str, owner: str):
+        lock = self.locks.get(name)
+        if lock is not None and lock["owner"] == owner:
+            del self.locks[name]
+
+    async def request_release(self, name: str) -> bool:
+        lock = self.locks.get(name)
+        if lock is None or lock["expires_at"] <= time.time():
+            return False
+        lock["release_requested"] = True
+        return True
+
+
+def _to_datetime(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+class MongoStateStore(StateStore):
+    """
+    Store shared by every replica through MongoDB. Claims and lock takeovers
+    are single atomic operations, so replicas never both act on one menu or
+    both hold one lock.
+    """
+
+    def __init__(self, database):
+        self.values = database["bot_state"]
+        self.menus = database["open_menus"]
+        self.locks = database["locks"]
+
+    async def ensure_indexes(self):
+        await self.menus.create_index("deadline")
+        # Locks left by crashed replicas disappear on their own
+        await self.locks.create_index("expires_at", expireAfterSeconds=60)
+
+    async def get(self, key: str):
+        document = await self.values.find_one({"_id": key})
+        return document["value"] if document else None
+
+    async def set(self, key: str, value):
+        await self.values.update_one(
+            {"_id": key}, {"$set": {"value": value}}, upsert=True
+        )
+
+    async def delete(self, key: str):
+        await self.values.delete_one({"_id": key})
+
+    @staticmethod
+    def _menu(document) -> Optional[dict]:
+        if document is None:
+            return None
+        return {
+            **document["menu"],
+            "key": document["_id"],
+            "deadline": document["deadline"]
+            .replace(tzinfo=timezone.utc)
+            .timestamp(),
+        }
+
+    async def save_menu(self, key: str, menu: dict, deadline: float):
+        await self.menus.update_one(
+            {"_id": key},
+            {"$set": {"menu": menu, "deadline": _to_datetime(deadline)}},
+            upsert=True,
+        )
+
+    async def get_menu(self, key: str) -> Optional[dict]:
+        return self._menu(await self.menus.find_one({"_id": key}))
+
+    async def delete_menu(self, key: str):
+        await self.menus.delete_one({"_id": key})
+
+    async def claim_menu(self, key: str, now: float) -> Optional[dict]:
+        return self._menu(
+            await self.menus.find_one_and_delete(
+                {"_id": key, "deadline": {"$lte": _to_datetime(now)}}
+            )
+        )
+
+    async def claim_expired_menus(self, before: float) -> list:
+        claimed = []
+        while True:
+            document = await self.menus.find_one_and_delete(
+                {"deadline": {"$lte": _to_datetime(before)}}
+            )
+            if document is None:
+                return claimed
+            claimed.append(self._menu(document))
+
+    async def pending_menus(self) -> list:
+        return [self._menu(document) async for document in self.menus.find()]
+
+    async def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        try:
+            # Matches a free, expired or already owned lock; a lock held by
+            # someone else makes the upsert hit the unique _id and fail
+            await self.locks.update_one(
+                {
+                    "_id": name,
+                    "$or": [
+                        {"owner": owner},
+                        {"expires_at": {"$lte": _to_datetime(now)}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "owner": owner,
+                        "expires_at": _to_datetime(now + ttl),
+                        "release_requested": False,
+                    }
+                },
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def refresh_lock(self, name: str, owner: str, ttl: float):
+        lock = await self.locks.find_one_and_update(
+            {"_id": name, "owner": owner},
+            {"$set": {"expires_at": _to_datetime(time.time() + ttl)}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if lock is None:
+            return None
+        return lock.get("release_requested", False)
+
+    async def release_lock(self, name: str, owner: str):
+        await self.locks.delete_one({"_id": name, "owner": owner})
+
+    async def request_release(self, name: str) -> bool:
+        result = await self.locks.update_one(
+            {"_id": name, "expires_at": {"$gt": _to_datetime(time.time())}},
+            {"$set": {"release_requested": True}},
+        )
+        return result.matched_count > 0
+
+
+class StoreFSMStorage(BaseStorage):
+    """
+    aiogram FSM storage on top of a StateStore.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        storage_key = self.key_builder.build(key, "state")
+        if state is None:
+            await self.store.delete(storage_key)
+        else:
+            await self.store.set(storage_key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.store.get(self.key_builder.build(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key, "data")
+        if not data:
+            await self.store.delete(storage_key)
+        else:
+            await self.store.set(storage_key, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self.store.get(self.key_builder.build(key, "data"))
+        return dict(data or {})
+
+    async def close(self) -> None:
+        await self.store.close()
+
+
+def create_state_store(db) -> StateStore:
+    """
+    Builds the store selected by STATE_BACKEND ("memory" or "mongo").
+    """
+    if STATE_BACKEND == "mongo":
+        return MongoStateStore(db.db)
+    return MemoryStateStore()
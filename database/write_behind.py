@@ -0,0 +1,324 @@
+# database/write_behind.py
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from config.config_loader import MESSAGE_BUCKET_SIZE
+
+
+class WriteBehindQueue:
+    """
+    Buffers dialog appends and `last_interaction` touches and writes them to
+    MongoDB in batches, so handlers do not wait on the database after the
+    user already has their answer.
+
+    Touches are coalesced per user (only the newest timestamp is written),
+    and so are daily token usage increments (summed per user and day).
+    Appends are flushed once `batch_size` are pending or every
+    `flush_interval` seconds. At most `max_pending` appends are buffered;
+    past that, `add_message` waits for the next flush.
+    """
+
+    def __init__(
+        self, db, max_pending: int, batch_size: int, flush_interval: float
+    ):
+        self.db = db
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.pending_appends = []  # (user_id, dialog_id, message_data)
+        self.pending_touches = {}  # user_id -> datetime
+        self.pending_usage = {}  # (user_id, day) -> generated tokens
+
+        self._wake = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+
+        # Counters
+        self.flushes = 0
+        self.flush_errors = 0
+        self.appends_written = 0
+        self.touches_written = 0
+        self.usage_written = 0
+        self.backpressure_waits = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def _ensure_flusher(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def touch(self, user_id, timestamp):
+        """
+        Records a `last_interaction` update; repeated touches collapse into one write.
+        """
+        previous = self.pending_touches.get(user_id)
+        if previous is None or previous < timestamp:
+            self.pending_touches[user_id] = timestamp
+        self._ensure_flusher()
+        if len(self.pending_touches) >= self.max_pending:
+            self._wake.set()
+
+    def add_usage(self, user_id, day: str, tokens: int):
+        """
+        Adds generated tokens to a user's usage counter for `day`.
+        """
+        key = (user_id, day)
+        self.pending_usage[key] = self.pending_usage.get(key, 0) + tokens
+        self._ensure_flusher()
+
+    async def add_message(self, user_id, dialog_id, message_data):
+        """
+        Queues a dialog append, waiting for a flush if the buffer is full.
+        """
+        if len(self.pending_appends) >= self.max_pending:
+            self.backpressure_waits += 1
+            self._wake.set()
+            async with self._space:
+                await self._space.wait_for(
+                    lambda: len(self.pending_appends) < self.max_pending
+                )
+
+        self.pending_appends.append((user_id, dialog_id, message_data))
+        self._ensure_flusher()
+        if len(self.pending_appends) >= self.batch_size:
+            self._wake.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """
+        Writes everything currently buffered.
+        """
+        async with self._flush_lock:
+            appends, self.pending_appends = self.pending_appends, []
+            touches, self.pending_touches = self.pending_touches, {}
+            usage, self.pending_usage = self.pending_usage, {}
+            if not appends and not touches and not usage:
+                return
+
+            batch_size = len(appends) + len(touches) + len(usage)
+            start_time = time.perf_counter()
+            try:
+                if touches:
+                    await self.db.users_collection.bulk_write(
+                        [
+                            UpdateOne(
+                                {"_id": user_id},
+                                {"$max": {"last_interaction": timestamp}},
+                            )
+                            for user_id, timestamp in touches.items()
+                        ],
+                        ordered=False,
+                    )
+                    self.touches_written += len(touches)
+                    touches = {}
+                if usage:
+                    await self._write_usage(usage)
+                    self.usage_written += len(usage)
+                    usage = {}
+                if appends:
+                    await self._write_appends(appends)
+                    self.appends_written += len(appends)
+            except Exception as e:
+                self.flush_errors += 1
+                logging.error(f"Write-behind flush failed, will retry: {e}")
+                # Put the unwritten items back in front of anything queued
+                # meanwhile. Appends keep their seqs, and pushing one again
+                # is a no-op if it was written before the failure.
+                self.pending_appends[:0] = appends
+                for user_id, timestamp in touches.items():
+                    self.touch(user_id, timestamp)
+                for (user_id, day), tokens in usage.items():
+                    self.add_usage(user_id, day, tokens)
+            else:
+                elapsed = time.perf_counter() - start_time
+                self.flushes += 1
+                self.last_batch_size = batch_size
+                self.max_batch_size = max(self.max_batch_size, batch_size)
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+                self.total_flush_seconds += elapsed
+
+        async with self._space:
+            self._space.notify_all()
+
+    async def _write_usage(self, usage):
+        # In order: the reset starts a counter not on `day` yet at zero, then
+        # the increment adds the tokens. Running the pair again after the
+        # reset only repeats a no-op, so a failed pair is safe to retry.
+        # The increment upserts, so usage of a user without a document (a
+        # group member who never wrote to the bot) is not lost. It cannot
+        # collide with an existing document: after the reset, any document
+        # of the user is on `day`.
+        now = datetime.now()
+        requests = []
+        for (user_id, day), tokens in usage.items():
+            requests.append(
+                UpdateOne(
+                    {"_id": user_id, "usage_day": {"$ne": day}},
+                    {"$set": {"usage_day": day, "usage_tokens": 0}},
+                )
+            )
+            requests.append(
+                UpdateOne(
+                    {"_id": user_id, "usage_day": day},
+                    {
+                        "$inc": {"usage_tokens": tokens},
+                        "$setOnInsert": {"first_seen": now, "current_dialog_id": None},
+                    },
+                    upsert=True,
+                )
+            )
+        try:
+            await self.db.users_collection.bulk_write(requests, ordered=True)
+        except BulkWriteError as e:
+            # Pairs before the failed write are applied: drop them from
+            # `usage` so only the rest is queued again
+            failed = e.details["writeErrors"][0]["index"]
+            for key in list(usage)[: failed // 2]:
+                del usage[key]
+            raise
+
+    async def _write_appends(self, appends):
+        # Group by dialog so each dialog reserves its sequence numbers once.
+        # Messages back from a failed flush keep the seqs they already got.
+        dialogs = {}
+        bucket_pushes = {}
+        for user_id, dialog_id, message_data in appends:
+            if "seq" in message_data:
+                self._add_to_bucket(bucket_pushes, user_id, dialog_id, message_data)
+            else:
+                dialogs.setdefault((user_id, dialog_id), []).append(message_data)
+
+        for (user_id, dialog_id), messages in dialogs.items():
+            dialog = await self.db.dialogs_collection.find_one_and_update(
+                {"_id": dialog_id, "user_id": user_id},
+                {
+                    "$inc": {"message_count": len(messages)},
+                    "$max": {"last_activity": messages[-1]["date"]},
+                },
+                projection={"message_count": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if not dialog:
+                logging.warning(
+                    f"Dropping {len(messages)} messages for missing dialog {dialog_id}"
+                )
+                continue
+
+            first_seq = dialog["message_count"] - len(messages)
+            for offset, message_data in enumerate(messages):
+                # Set in place, so the cached history window learns the seq too
+                message_data["seq"] = first_seq + offset
+                self._add_to_bucket(bucket_pushes, user_id, dialog_id, message_data)
+
+        if not bucket_pushes:
+            return
+        requests = []
+        last_activity = {}
+        for (user_id, dialog_id, bucket), messages in bucket_pushes.items():
+            bucket_id = f"{dialog_id}:{bucket}"
+            requests.append(
+                UpdateOne(
+                    {"_id": bucket_id},
+                    {
+                        "$setOnInsert": {
+                            "user_id": user_id,
+                            "dialog_id": dialog_id,
+                            "bucket": bucket,
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+            # A message a failed flush already pushed does not match again
+            for message_data in sorted(messages, key=lambda m: m["seq"]):
+                seq = message_data["seq"]
+                requests.append(
+                    UpdateOne(
+                        {"_id": bucket_id, "messages.seq": {"$ne": seq}},
+                        {"$push": {"messages": message_data}, "$inc": {"count": 1}},
+                    )
+                )
+            latest = max(message["date"] for message in messages)
+            key = (user_id, dialog_id)
+            last_activity[key] = max(last_activity.get(key, latest), latest)
+        # Every bucket carries its dialog's last_activity, so the TTL index
+        # expires a dialog's turns together, never leaving gaps in one
+        for (user_id, dialog_id), date in last_activity.items():
+            requests.append(
+                UpdateMany(
+                    {"user_id": user_id, "dialog_id": dialog_id},
+                    {"$max": {"last_activity": date}},
+                )
+            )
+        # In order, so every bucket exists before its messages are pushed
+        await self.db.messages_collection.bulk_write(requests, ordered=True)
+        # Other replicas must reload these users' history
+        await self.db.stamp_sessions(
+            list(dict.fromkeys(user_id for user_id, _, _ in bucket_pushes))
+        )
+
+    @staticmethod
+    def _add_to_bucket(bucket_pushes, user_id, dialog_id, message_data):
+        bucket = message_data["seq"] // MESSAGE_BUCKET_SIZE
+        bucket_pushes.setdefault((user_id, dialog_id, bucket), []).append(
+            message_data
+        )
+
+    async def close(self):
+        """
+        Stops the background flusher and writes out whatever is still buffered.
+        """
+        self._closing = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        if self.pending_appends or self.pending_touches or self.pending_usage:
+            # One more attempt after a failed final flush
+            await self.flush()
+
+    def stats(self):
+        return {
+            "queue_depth": (
+                len(self.pending_appends)
+                + len(self.pending_touches)
+                + len(self.pending_usage)
+            ),
+            "pending_appends": len(self.pending_appends),
+            "pending_touches": len(self.pending_touches),
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "appends_written": self.appends_written,
+            "touches_written": self.touches_written,
+            "usage_written": self.usage_written,
+            "backpressure_waits": self.backpressure_waits,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": (
+                self.total_flush_seconds / self.flushes if self.flushes else 0.0
+            ),
+        }
@@ -7,11 +7,41 @@ from aiogram import Bot, F, types
 from aiogram.filters import Command
 
 from bot.dispatcher import bot, dp, router
+from bot.handlers.admin import command_profile_handler
 from bot.handlers.bot_settings import command_settings_handler
 from bot.handlers.modes import process_mode_selection, process_pagination, show_modes
 from bot.handlers.start import command_start_handler
-from bot.handlers.text_input import handle_text_input
+from bot.handlers.stop_generation import stop_generation
+from bot.handlers.text_input import handle_ask_command, handle_text_input
 from bot.handlers.unexpected_input import handle_unexpected_input
+from bot.helpers.metrics import metrics
+from bot.helpers.stream_editor import stream_metrics
+from bot.helpers.streaming_response import streaming_client
+from bot.helpers.tracing import tracer
+from bot.middlewares.metrics import (
+    HandlerMetricsMiddleware,
+    TelegramMetricsMiddleware,
+    UpdateMetricsMiddleware,
+)
+from bot.middlewares.rate_limit import RateLimitMiddleware
+from bot.middlewares.tracing import TracingRequestMiddleware, UpdateTracingMiddleware
+from bot.services.coalescer import coalescer
+from bot.services.compaction import compactor
+from bot.services.generations import generations
+from bot.services.group_replies import group_replies
+from bot.services.menu_timeouts import menu_timeouts
+from bot.services.metrics_server import metrics_server
+from bot.services.mode_registry import mode_registry
+from bot.services.model_catalog import model_catalog
+from bot.services.ollama_pool import ollama_pool
+from bot.services.residency import residency
+from bot.services.response_cache import response_cache
+from bot.services.scheduler import scheduler
+from bot.services.usage_limiter import usage_limiter
+from bot.webhook import run_webhook
+from config.config_loader import BOT_MODE
+from database.bot_database import BotDatabase
+from database.state_store import StoreFSMStorage, create_state_store
 
 
 # Define bot commands
@@ -19,6 +49,7 @@ async def set_bot_commands(bot: Bot):
     commands = [
         types.BotCommand(command="start", description="Start"),
         types.BotCommand(command="mode", description="Choose a chatbot mode"),
+        types.BotCommand(command="ask", description="Ask a question (in groups)"),
         types.BotCommand(
             command="settings", description="Change AI Model and BOT language"
         ),
@@ -26,14 +57,130 @@ async def set_bot_commands(bot: Bot):
     await bot.set_my_commands(commands)
 
 
-# Main function to start polling
-async def main():
+def register_stats_metrics(db: BotDatabase):
+    """
+    Exports the counters and histograms the services already keep, read when
+    /metrics is scraped.
+    """
+    metrics.stats_gauges(
+        "scheduler", "Inference queue", scheduler.stats, labels={"models": "model"}
+    )
+    metrics.stats_histograms(
+        "scheduler_queue_wait_seconds",
+        "Time requests waited for a generation slot",
+        lambda: {(): scheduler.queue_wait},
+    )
+    metrics.stats_histograms(
+        "scheduler_service_seconds",
+        "Time requests held a generation slot",
+        lambda: {(): scheduler.service_time},
+    )
+    metrics.stats_gauges(
+        "generations", "Running and stopped replies", generations.stats
+    )
+    metrics.stats_gauges("stream", "Streamed reply edits", lambda: stream_metrics)
+    metrics.stats_gauges("mongo_pool", "MongoDB connection pool", db.pool_stats)
+    metrics.stats_gauges("write_queue", "Write-behind queue", db.write_queue_stats)
+    metrics.stats_gauges("db_cache", "Session caches", db.cache_stats)
+    metrics.stats_gauges(
+        "response_cache",
+        "Response cache",
+        response_cache.stats,
+        labels={"modes": "mode"},
+    )
+    metrics.stats_gauges("menu_timeouts", "Open menu timers", menu_timeouts.stats)
+    metrics.stats_gauges("tracer", "Update traces", tracer.stats)
+    metrics.stats_gauges("compaction", "Conversation compaction", compactor.stats)
+    metrics.stats_gauges("usage_limiter", "Rate limiter", usage_limiter.stats)
+    metrics.stats_gauges("coalescer", "Coalesced generations", coalescer.stats)
+    metrics.stats_gauges("group_replies", "Group reply queue", group_replies.stats)
+    metrics.stats_gauges(
+        "ollama_http", "Streamed Ollama responses", streaming_client.stats
+    )
+    metrics.stats_gauges(
+        "ollama_pool",
+        "Ollama hosts",
+        ollama_pool.stats,
+        labels={"hosts": "host", "routing": "route"},
+    )
+    metrics.stats_gauges(
+        "residency", "Model residency", residency.stats, labels={"models": "model"}
+    )
+    metrics.stats_histograms(
+        "residency_load_seconds",
+        "Model load time, on cold starts and preloads",
+        lambda: residency.load_latency,
+        labels=("model",),
+    )
+    metrics.stats_gauges("model_catalog", "Installed models", model_catalog.stats)
+
+
+async def setup(db: BotDatabase):
+    """
+    Starts the background services and registers the handlers around `db`.
+    """
     await set_bot_commands(bot)
 
+    await db.ensure_indexes()
+    dp["db"] = db
+    # Flush queued writes and close the pool on shutdown
+    dp.shutdown.register(db.close)
+    # Warm the response cache from entries persisted by earlier runs
+    await response_cache.load(db)
+
+    # FSM state, open menus and chat locks, shared by replicas with the mongo backend
+    state_store = create_state_store(db)
+    await state_store.ensure_indexes()
+    dp.fsm.storage = StoreFSMStorage(state_store)
+    generations.attach(state_store)
+    await menu_timeouts.start(state_store)
+    dp.shutdown.register(menu_timeouts.close)
+
+    # Health-check the Ollama hosts in the background
+    ollama_pool.start()
+    dp.shutdown.register(ollama_pool.close)
+    dp.shutdown.register(streaming_client.close)
+    dp.shutdown.register(compactor.close)
+    dp.shutdown.register(group_replies.close)
+
+    # Keep the model list for the settings menu fresh in the background
+    model_catalog.start()
+    dp.shutdown.register(model_catalog.close)
+
+    # Preload the default model and unload idle ones
+    residency.start()
+    dp.shutdown.register(residency.close)
+
+    # Pick up edits to chat_modes.yml without a restart
+    mode_registry.start()
+    dp.shutdown.register(mode_registry.close)
+
+    # Update, handler and Bot API call metrics
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    # Inner middlewares on dp also wrap the handlers of included routers
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(TelegramMetricsMiddleware())
+    # One trace per update, with a span per Bot API call
+    dp.update.outer_middleware(UpdateTracingMiddleware())
+    bot.session.middleware(TracingRequestMiddleware())
+    dp.shutdown.register(tracer.close)
+    # Throttled users are dropped after metrics and tracing saw the update
+    dp.update.outer_middleware(RateLimitMiddleware())
+    usage_limiter.start()
+    dp.shutdown.register(usage_limiter.close)
+
+    register_stats_metrics(db)
+    await metrics_server.start()
+    dp.shutdown.register(metrics_server.close)
+
     # Register command handlers
     router.message.register(command_start_handler, Command("start"))
     router.message.register(show_modes, Command("mode"))
     router.message.register(command_settings_handler, Command("settings"))
+    router.message.register(handle_ask_command, Command("ask"))
+    # Admin only, not listed in the command menu
+    router.message.register(command_profile_handler, Command("profile"))
 
     # Callback query handlers
     router.callback_query.register(
@@ -42,18 +189,35 @@ async def main():
     router.callback_query.register(
         process_mode_selection, lambda c: c.data.startswith("mode:")
     )
+    router.callback_query.register(
+        stop_generation, lambda c: c.data.startswith("stop_generation:")
+    )
 
-    # Text input handler (excluding commands)
+    # Text input handler (excluding commands); in groups it only answers
+    # mentions of the bot and replies to it
     router.message.register(
         handle_text_input,
         F.text & ~F.is_command(),  # Use built-in filter to exclude commands
     )
 
-    # Unexpected input handler (non-text messages)
-    router.message.register(handle_unexpected_input, ~F.text)
+    # Unexpected input handler (non-text messages), private chats only
+    router.message.register(
+        handle_unexpected_input, ~F.text, F.chat.type == "private"
+    )
+
+
+# Main function to start polling
+async def main():
+    # One database service (and connection pool) for the whole process,
+    # injected into handlers as the `db` argument
+    await setup(BotDatabase())
 
-    # Start polling
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        # Telegram pushes updates to our aiohttp server
+        await run_webhook(dp, bot)
+    else:
+        # Start polling
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
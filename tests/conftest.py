@@ -0,0 +1,24 @@
+# tests/conftest.py
+#
+# The bot reads its configuration at import time, so the test environment is
+# set up here, before any test module imports it. Bot API and Ollama calls go
+# to the fakes in benchmarks/, MongoDB to benchmarks/fake_mongo.py.
+
+import os
+
+TELEGRAM_PORT = 8791
+OLLAMA_PORTS = (8792, 8793)
+SCRAPE_PORT = 8794
+TEST_MODEL = "llama3.1:8b"
+
+os.environ.update(
+    BOT_TOKEN="123456:test",
+    BOT_MODE="polling",
+    STATE_BACKEND="memory",
+    TELEGRAM_API_URL=f"http://127.0.0.1:{TELEGRAM_PORT}",
+    OLLAMA_HOSTS=",".join(f"http://127.0.0.1:{port}" for port in OLLAMA_PORTS),
+    OLLAMA_DEFAULT_MODEL=TEST_MODEL,
+    METRICS_PORT="0",
+    TRACE_SAMPLE_RATE="0",
+    TRACE_SLOW_SECONDS="1000000",
+)
@@ -0,0 +1,55 @@
+# tests/fakes.py
+
+import time
+from contextlib import asynccontextmanager
+
+from aiogram.types import Chat, Message, User
+
+from benchmarks.fake_mongo import install
+from benchmarks.fake_ollama import FakeOllama
+from benchmarks.fake_telegram import FakeTelegramAPI
+from bot.dispatcher import bot
+from bot.helpers.streaming_response import streaming_client
+from database.bot_database import BotDatabase
+from tests.conftest import OLLAMA_PORTS, TELEGRAM_PORT, TEST_MODEL
+
+
+def make_message(
+    user_id: int, text: str, chat_id: int = None, chat_type: str = "private"
+) -> Message:
+    return Message(
+        message_id=int(time.monotonic() * 1000) % 1_000_000,
+        date=int(time.time()),
+        chat=Chat(id=chat_id or user_id, type=chat_type),
+        from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}"),
+        text=text,
+    )
+
+
+@asynccontextmanager
+async def fake_services(*host_models, reply_tokens: int = 3):
+    """
+    Starts the fake Bot API and one fake Ollama per model list, and yields
+    (telegram, ollama hosts, db) with an in-memory database.
+    """
+    telegram = FakeTelegramAPI(port=TELEGRAM_PORT)
+    hosts = [
+        FakeOllama(
+            port=port, tokens_per_sec=1000, reply_tokens=reply_tokens, models=models
+        )
+        for port, models in zip(OLLAMA_PORTS, host_models or ([TEST_MODEL],))
+    ]
+    await telegram.start()
+    for host in hosts:
+        await host.start()
+    db = BotDatabase()
+    install(db)
+    try:
+        yield telegram, hosts, db
+    finally:
+        # Sessions belong to this test's event loop
+        await streaming_client.close()
+        await bot.session.close()
+        for host in hosts:
+            await host.close()
+        await telegram.close()
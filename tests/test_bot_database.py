@@ -0,0 +1,48 @@
+# tests/test_bot_database.py
+
+import asyncio
+
+from benchmarks.fake_mongo import install
+from database.bot_database import BotDatabase
+
+USER_ID = 4242
+
+
+def test_session_changes_reach_the_other_replica():
+    async def main():
+        # Two replicas with their own session caches on one database
+        first = BotDatabase(shared_sessions=True)
+        fake = install(first)
+        second = BotDatabase(shared_sessions=True)
+        install(second, fake)
+
+        await first.create_user(USER_ID, USER_ID, None, "user", None)
+        old_dialog = await first.create_dialog(USER_ID)
+        # The second replica caches the user, the dialog and its history
+        assert (await second.get_user(USER_ID))["current_dialog_id"] == old_dialog
+        assert (await second.get_dialog(old_dialog))["chat_mode"] == "assistant"
+        assert await second.get_recent_messages(USER_ID, old_dialog, 10) == []
+
+        await first.add_message_to_dialog(USER_ID, old_dialog, "q", "a")
+        await first.write_queue.flush()
+        await second.get_user(USER_ID)
+        history = await second.get_recent_messages(USER_ID, old_dialog, 10)
+        assert [turn["user"] for turn in history] == ["q"]
+
+        await first.update_user_model(USER_ID, "phi3:latest")
+        assert await second.get_selected_model(USER_ID) == "phi3:latest"
+
+        await first.get_user(USER_ID)
+        new_dialog = await first.create_dialog(USER_ID, chat_mode="psychologist")
+        user = await second.get_user(USER_ID)
+        assert user["current_dialog_id"] == new_dialog
+        assert (await second.get_dialog(new_dialog))["chat_mode"] == "psychologist"
+
+        # The writer's own cached user stays valid
+        misses = first.user_cache.misses
+        assert (await first.get_user(USER_ID))["current_dialog_id"] == new_dialog
+        assert first.user_cache.misses == misses
+        for db in (first, second):
+            db.client.close()
+
+    asyncio.run(main())
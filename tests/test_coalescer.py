@@ -0,0 +1,122 @@
+# tests/test_coalescer.py
+
+import asyncio
+
+import pytest
+
+from bot.services.coalescer import GenerationCoalescer
+
+KEY = GenerationCoalescer.key("llama3.1:8b", "You are helpful.", "Hi there")
+
+
+class Upstream:
+    """
+    Stands in for an Ollama stream; the test hands it chunks one by one.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.queue.get()
+        if item is None:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def settle():
+    # Lets the pump task and the readers run
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_key_ignores_case_and_spacing():
+    assert KEY == GenerationCoalescer.key(
+        "llama3.1:8b", "You are helpful.", "  hi\n THERE "
+    )
+    assert KEY != GenerationCoalescer.key("phi3", "You are helpful.", "Hi there")
+
+
+def test_late_subscriber_catches_up_and_shares_the_stream():
+    async def main():
+        coalescer = GenerationCoalescer(enabled=True)
+        upstreams = []
+
+        def start():
+            upstreams.append(Upstream())
+            return upstreams[-1]
+
+        first, leader = coalescer.subscribe(KEY, start)
+        assert leader
+        upstreams[0].queue.put_nowait("a")
+        assert await first.__anext__() == "a"
+
+        second, leader = coalescer.subscribe(KEY, start)
+        assert not leader
+        assert coalescer.stats() == {"shared_streams": 1, "subscribers": 2}
+        for chunk in ("b", None):
+            upstreams[0].queue.put_nowait(chunk)
+        assert [chunk async for chunk in second] == ["a", "b"]
+        assert [chunk async for chunk in first] == ["b"]
+
+        await settle()
+        assert len(upstreams) == 1 and upstreams[0].closed
+        # A finished stream is forgotten; the next request starts a new one
+        assert coalescer.stats() == {"shared_streams": 0, "subscribers": 0}
+        _, leader = coalescer.subscribe(KEY, start)
+        assert leader and len(upstreams) == 2
+        upstreams[1].queue.put_nowait(None)
+        await settle()
+
+    asyncio.run(main())
+
+
+def test_upstream_error_reaches_every_subscriber():
+    async def main():
+        coalescer = GenerationCoalescer(enabled=True)
+        upstream = Upstream()
+        readers = [coalescer.subscribe(KEY, lambda: upstream)[0] for _ in range(2)]
+        upstream.queue.put_nowait("a")
+        upstream.queue.put_nowait(ConnectionError("host went away"))
+
+        for reader in readers:
+            assert await reader.__anext__() == "a"
+            with pytest.raises(ConnectionError):
+                await reader.__anext__()
+
+    asyncio.run(main())
+
+
+def test_upstream_is_cancelled_when_the_last_subscriber_leaves():
+    async def main():
+        coalescer = GenerationCoalescer(enabled=True)
+        upstream = Upstream()
+        first, _ = coalescer.subscribe(KEY, lambda: upstream)
+        second, _ = coalescer.subscribe(KEY, lambda: upstream)
+        upstream.queue.put_nowait("a")
+        assert await first.__anext__() == "a"
+        assert await second.__anext__() == "a"
+
+        # One chat stops its reply: the other keeps receiving chunks
+        await first.aclose()
+        await settle()
+        assert not upstream.closed
+        upstream.queue.put_nowait("b")
+        assert await second.__anext__() == "b"
+
+        # The last one stops too: nobody reads, so the upstream is cancelled
+        await second.aclose()
+        await settle()
+        assert upstream.closed
+        assert coalescer.stats() == {"shared_streams": 0, "subscribers": 0}
+
+    asyncio.run(main())
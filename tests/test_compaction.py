@@ -0,0 +1,92 @@
+# tests/test_compaction.py
+
+import asyncio
+
+from bot.services.compaction import ConversationCompactor
+from tests.conftest import TEST_MODEL
+from tests.fakes import fake_services
+
+USER_ID = 4242
+# About 110 estimated tokens per turn
+QUESTION = "q" * 200
+ANSWER = "a" * 200
+
+
+async def add_turns(db, dialog_id: str, count: int, flush: bool = True):
+    for _ in range(count):
+        await db.add_message_to_dialog(USER_ID, dialog_id, QUESTION, ANSWER)
+    if flush:
+        await db.write_queue.flush()
+
+
+def test_older_turns_are_folded_into_a_summary():
+    compactor = ConversationCompactor(TEST_MODEL, threshold=300, keep_turns=2)
+
+    async def main():
+        async with fake_services([TEST_MODEL]) as (_, hosts, db):
+            dialog_id = await db.create_dialog(USER_ID)
+            # Below the threshold: no summary is asked for
+            await add_turns(db, dialog_id, 2)
+            await compactor.compact(db, USER_ID, dialog_id)
+            assert "chat" not in hosts[0].calls
+
+            await add_turns(db, dialog_id, 4)
+            await compactor.compact(db, USER_ID, dialog_id)
+            assert hosts[0].calls["chat"] == 1
+            dialog = await db.get_dialog(dialog_id)
+            # All but the newest two turns are covered
+            assert dialog["summary"]["through_seq"] == 3
+            assert dialog["summary"]["text"] == "model token stream"
+
+            history = await db.get_recent_messages(USER_ID, dialog_id, 20)
+            summary, recent = compactor.prompt_history(dialog, history)
+            assert summary == "model token stream"
+            assert [turn["seq"] for turn in recent] == [4, 5]
+
+            # The turns after the summary are below the threshold again
+            await compactor.compact(db, USER_ID, dialog_id)
+            assert hosts[0].calls["chat"] == 1
+
+    asyncio.run(main())
+
+
+def test_turns_not_written_yet_are_left_for_a_later_run():
+    compactor = ConversationCompactor(TEST_MODEL, threshold=300, keep_turns=1)
+
+    async def main():
+        async with fake_services([TEST_MODEL]) as (_, hosts, db):
+            dialog_id = await db.create_dialog(USER_ID)
+            await add_turns(db, dialog_id, 2)
+            await db.get_recent_messages(USER_ID, dialog_id, 20)
+            # In the cached history, but still queued: these have no seq
+            await add_turns(db, dialog_id, 3, flush=False)
+
+            await compactor.compact(db, USER_ID, dialog_id)
+            dialog = await db.get_dialog(dialog_id)
+            assert dialog["summary"]["through_seq"] == 1
+            history = await db.get_recent_messages(USER_ID, dialog_id, 20)
+            _, recent = compactor.prompt_history(dialog, history)
+            assert len(recent) == 3
+
+    asyncio.run(main())
+
+
+def test_one_job_per_dialog_and_failures_are_contained():
+    compactor = ConversationCompactor(TEST_MODEL, threshold=300, keep_turns=2)
+
+    async def main():
+        async with fake_services([TEST_MODEL]) as (_, hosts, db):
+            dialog_id = await db.create_dialog(USER_ID)
+            await add_turns(db, dialog_id, 6)
+            hosts[0].stream_error = "model is busy"
+
+            compactor.schedule(db, USER_ID, dialog_id)
+            compactor.schedule(db, USER_ID, dialog_id)
+            assert compactor.stats() == {"running": 1}
+            await asyncio.gather(*compactor._jobs.values())
+            # The failure is logged and counted, and nothing is stored
+            assert compactor.stats() == {"running": 0}
+            assert hosts[0].calls["chat"] == 1
+            assert "summary" not in await db.get_dialog(dialog_id)
+
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+# tests/test_groups.py
+
+import asyncio
+import time
+
+from aiogram.types import CallbackQuery
+
+from bot.dispatcher import bot
+from bot.handlers.modes import process_mode_selection
+from bot.handlers.text_input import answer_group
+from bot.services.generations import generations
+from bot.services.menu_timeouts import menu_timeouts
+from bot.services.usage_limiter import usage_limiter
+from database.state_store import MemoryStateStore
+from tests.conftest import TEST_MODEL
+from tests.fakes import fake_services, make_message
+
+GROUP_ID = -1001
+ADMIN_ID = 1
+MEMBER_ID = 2
+
+
+def group_messages() -> list:
+    return [
+        (make_message(ADMIN_ID, "hi", GROUP_ID, "group"), "hi"),
+        (make_message(MEMBER_ID, "hello", GROUP_ID, "group"), "hello"),
+    ]
+
+
+def mode_button(user_id: int, mode: str) -> CallbackQuery:
+    chat = {"id": GROUP_ID, "type": "group", "title": "group"}
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return CallbackQuery.model_validate(
+        {
+            "id": str(user_id),
+            "from": user,
+            "chat_instance": str(GROUP_ID),
+            "data": f"mode:{mode}",
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": chat,
+                "text": "Choose a mode",
+            },
+        },
+        context={"bot": bot},
+    )
+
+
+def test_admin_mode_switch_stops_the_group_reply(monkeypatch):
+    monkeypatch.setattr(menu_timeouts, "store", MemoryStateStore())
+
+    async def main():
+        async with fake_services([TEST_MODEL], reply_tokens=5000) as (
+            telegram,
+            _,
+            db,
+        ):
+            telegram.chat_admins[GROUP_ID] = {ADMIN_ID}
+            reply = asyncio.create_task(answer_group(db, group_messages()))
+            while (GROUP_ID, GROUP_ID) not in generations.by_key:
+                await asyncio.sleep(0.01)
+
+            # Members may not change the group's mode
+            await process_mode_selection(mode_button(MEMBER_ID, "psychologist"), db)
+            assert telegram.callback_answers[-1] == (
+                "Only chat admins can change the group's mode."
+            )
+            assert not reply.done()
+
+            await process_mode_selection(mode_button(ADMIN_ID, "psychologist"), db)
+            await asyncio.wait_for(reply, timeout=2)
+            texts = [event["text"] for event in telegram.outgoing[GROUP_ID]]
+            assert any(text.endswith("⏹ Stopped.") for text in texts)
+            group = await db.get_user(GROUP_ID)
+            dialog = await db.get_dialog(group["current_dialog_id"])
+            assert dialog["chat_mode"] == "psychologist"
+
+    asyncio.run(main())
+
+
+def test_group_reply_usage_is_split(monkeypatch):
+    charged = []
+    monkeypatch.setattr(
+        usage_limiter,
+        "record_generation",
+        lambda db, user_id, tokens: charged.append((user_id, tokens)),
+    )
+
+    async def main():
+        async with fake_services([TEST_MODEL], reply_tokens=5) as (_, _, db):
+            await answer_group(db, group_messages())
+
+    asyncio.run(main())
+    assert charged == [(ADMIN_ID, 3), (MEMBER_ID, 2)]
@@ -0,0 +1,102 @@
+# tests/test_metrics.py
+
+import asyncio
+import threading
+
+import aiohttp
+
+from benchmarks.fake_mongo import install
+from bot.helpers.metrics import Histogram, MetricsRegistry
+from bot.services.metrics_server import MetricsServer
+from bot.services.ollama_pool import ollama_pool
+from bot.services.residency import residency
+from bot.services.response_cache import response_cache
+from bot.services.scheduler import scheduler
+from database.bot_database import BotDatabase
+from main import register_stats_metrics
+from tests.conftest import SCRAPE_PORT, TEST_MODEL
+
+
+def test_metrics_recorded_from_threads_while_rendering():
+    registry = MetricsRegistry()
+    latency = registry.histogram("command_seconds", "Latency", ("command",))
+    failures = registry.counter("command_failures_total", "Failures", ("command",))
+    done = threading.Event()
+    errors = []
+
+    def record(worker: int):
+        for index in range(2000):
+            # New label values keep adding children while render iterates
+            command = f"command{worker}-{index % 50}"
+            latency.labels(command).observe(0.01)
+            failures.inc(command)
+
+    def render():
+        while not done.is_set():
+            try:
+                registry.render()
+            except RuntimeError as e:  # dictionary changed size during iteration
+                errors.append(e)
+
+    renderer = threading.Thread(target=render)
+    renderer.start()
+    workers = [threading.Thread(target=record, args=(i,)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    done.set()
+    renderer.join()
+
+    assert errors == []
+    assert sum(child.count for child in latency.children.values()) == 8000
+    assert sum(failures.values.values()) == 8000
+
+
+def test_metrics_scrape_exports_service_stats(monkeypatch):
+    monkeypatch.setattr(scheduler, "queue_wait", Histogram())
+    monkeypatch.setattr(scheduler, "service_time", Histogram())
+    monkeypatch.setattr(residency, "cold_starts", {})
+    monkeypatch.setattr(residency, "load_latency", {})
+    monkeypatch.setattr(
+        response_cache, "mode_stats", {"coder": {"hits": 1, "misses": 3, "stores": 3}}
+    )
+
+    async def main():
+        db = BotDatabase()
+        install(db)
+        register_stats_metrics(db)
+        server = MetricsServer("127.0.0.1", SCRAPE_PORT)
+        await server.start()
+        try:
+            async with scheduler.slot(TEST_MODEL, user_id=1):
+                pass
+            residency.record_load(TEST_MODEL, {"load_duration": 2e9})
+            await db.get_user(1)
+            async with aiohttp.ClientSession() as session:
+                url = f"http://127.0.0.1:{SCRAPE_PORT}/metrics"
+                async with session.get(url) as response:
+                    return await response.text()
+        finally:
+            await server.close()
+            db.client.close()
+
+    lines = asyncio.run(main()).splitlines()
+    for series in (
+        "# TYPE scheduler_queue_wait_seconds histogram",
+        "scheduler_queue_wait_seconds_count 1",
+        "scheduler_service_seconds_count 1",
+        f'scheduler_models_active{{model="{TEST_MODEL}"}} 0',
+        f'residency_models_cold_starts{{model="{TEST_MODEL}"}} 1',
+        f'residency_load_seconds_bucket{{model="{TEST_MODEL}",le="2.5"}} 1',
+        f'residency_load_seconds_sum{{model="{TEST_MODEL}"}} 2',
+        'response_cache_modes_hit_rate{mode="coder"} 0.25',
+        "db_cache_users_misses 1",
+    ):
+        assert series in lines
+    # Earlier tests may have used the pool, so only the series are checked
+    for series in [
+        f'ollama_pool_hosts_healthy{{host="{backend.url}"}} '
+        for backend in ollama_pool.backends
+    ] + ['ollama_pool_routing{route="resident"} ', "model_catalog_refreshes "]:
+        assert any(line.startswith(series) for line in lines)
@@ -0,0 +1,56 @@
+# tests/test_model_catalog.py
+
+import asyncio
+
+from aiogram.enums.parse_mode import ParseMode
+
+from bot.services.model_catalog import ModelCatalog, model_catalog
+from bot.services.ollama import ollama_request
+from bot.services.ollama_pool import ollama_pool
+from tests.conftest import TEST_MODEL
+from tests.fakes import fake_services, make_message
+
+
+def test_catalog_lists_models_of_all_hosts():
+    async def main():
+        async with fake_services([TEST_MODEL], [TEST_MODEL, "phi3:latest"]) as (
+            _,
+            hosts,
+            _,
+        ):
+            catalog = ModelCatalog(ttl=60)
+            await catalog.refresh()
+            assert catalog.models == (TEST_MODEL, "phi3:latest")
+
+            # A host that does not answer is left out, not fatal
+            await hosts[1].close()
+            await catalog.refresh()
+            assert catalog.models == (TEST_MODEL,)
+            await hosts[1].start()
+
+    asyncio.run(main())
+
+
+def test_removed_model_refreshes_the_catalog(monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(model_catalog, "invalidate", lambda: refreshed.append(True))
+
+    async def main():
+        async with fake_services([TEST_MODEL], [TEST_MODEL]) as (telegram, _, db):
+            message = make_message(4242, "hello")
+            await db.create_user(4242, 4242, None, "user4242", None)
+            await db.update_user_model(4242, "removed:latest")
+            dialog_id = await db.create_dialog(4242)
+
+            await ollama_request(
+                db, ParseMode.HTML, dialog_id, message=message, prompt="hello"
+            )
+
+            texts = [event["text"] for event in telegram.outgoing[4242]]
+            assert "Something went wrong while processing your request." in texts
+        assert refreshed == [True]
+        # The model is gone, the hosts are fine
+        assert all(backend.healthy for backend in ollama_pool.backends)
+        assert all(backend.failures == 0 for backend in ollama_pool.backends)
+
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+# tests/test_ollama_pool.py
+
+import asyncio
+
+import pytest
+from ollama import ResponseError
+
+from benchmarks.fake_ollama import FakeOllama
+from bot.helpers.streaming_response import streaming_client
+from bot.services.ollama_pool import OllamaPool
+from config.config_loader import OLLAMA_EJECT_AFTER
+from tests.conftest import OLLAMA_PORTS, TEST_MODEL
+
+
+async def chat(pool: OllamaPool, model: str) -> list:
+    stream = pool.chat(model=model, messages=[{"role": "user", "content": "hi"}])
+    return [chunk async for chunk in stream]
+
+
+def run_with_hosts(test, *host_models):
+    """
+    Runs `await test(pool, fakes)` against one fake Ollama per model list.
+    """
+
+    async def main():
+        fakes = [
+            FakeOllama(port=port, tokens_per_sec=1000, reply_tokens=3, models=models)
+            for port, models in zip(OLLAMA_PORTS, host_models)
+        ]
+        for fake in fakes:
+            await fake.start()
+        pool = OllamaPool([fake.base_url for fake in fakes])
+        try:
+            await test(pool, fakes)
+        finally:
+            await streaming_client.close()
+            for fake in fakes:
+                await fake.close()
+
+    asyncio.run(main())
+
+
+def test_unknown_model_raises_404_without_ejecting_hosts():
+    async def test(pool, fakes):
+        for _ in range(OLLAMA_EJECT_AFTER + 2):
+            with pytest.raises(ResponseError) as error:
+                await chat(pool, "missing:latest")
+            assert error.value.status_code == 404
+        assert all(backend.healthy for backend in pool.backends)
+        assert all(backend.failures == 0 for backend in pool.backends)
+
+    run_with_hosts(test, [TEST_MODEL], [TEST_MODEL])
+
+
+def test_model_on_another_host_is_found():
+    async def test(pool, fakes):
+        for _ in range(OLLAMA_EJECT_AFTER + 2):
+            chunks = await chat(pool, "phi3:latest")
+            assert chunks[-1]["done"]
+        assert fakes[1].calls["chat"] == OLLAMA_EJECT_AFTER + 2
+        assert all(backend.healthy for backend in pool.backends)
+
+    run_with_hosts(test, [TEST_MODEL], [TEST_MODEL, "phi3:latest"])
+
+
+def test_unreachable_host_counts_as_failure():
+    async def test(pool, fakes):
+        await fakes[0].close()
+        chunks = await chat(pool, TEST_MODEL)
+        assert chunks[-1]["done"]
+        assert pool.backends[0].failures == 1
+        assert pool.backends[1].failures == 0
+        # Back up, so the shared teardown can close it
+        await fakes[0].start()
+
+    run_with_hosts(test, [TEST_MODEL], [TEST_MODEL])
+
+
+def test_error_in_the_stream_does_not_eject_the_host():
+    async def test(pool, fakes):
+        fakes[0].stream_error = "input length exceeds the context length"
+        for _ in range(OLLAMA_EJECT_AFTER + 2):
+            with pytest.raises(ResponseError) as error:
+                await chat(pool, TEST_MODEL)
+            assert 400 <= error.value.status_code < 500
+        assert all(backend.healthy for backend in pool.backends)
+        assert all(backend.failures == 0 for backend in pool.backends)
+        # Not retried either: the other host would fail the same way
+        assert "chat" not in fakes[1].calls
+
+    run_with_hosts(test, [TEST_MODEL], [TEST_MODEL])
@@ -0,0 +1,37 @@
+# tests/test_rate_limit.py
+
+import asyncio
+
+from aiogram.types import CallbackQuery, Update, User
+
+from bot.middlewares.rate_limit import RateLimitMiddleware
+from bot.services.usage_limiter import NOTICES, usage_limiter
+
+
+class RecordingBot:
+    def __init__(self):
+        self.answered = []
+
+    async def answer_callback_query(self, callback_query_id, text=None):
+        self.answered.append((callback_query_id, text))
+
+
+def test_dropped_button_press_is_answered(monkeypatch):
+    monkeypatch.setattr(usage_limiter, "check_update", lambda user_id: "updates")
+    user = User(id=4242, is_bot=False, first_name="user4242")
+    event = Update(
+        update_id=1,
+        callback_query=CallbackQuery(
+            id="7", from_user=user, chat_instance="4242", data="settings"
+        ),
+    )
+    bot = RecordingBot()
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+
+    data = {"event_from_user": user, "bot": bot, "db": None}
+    asyncio.run(RateLimitMiddleware()(handler, event, data))
+    assert handled == []
+    assert bot.answered == [("7", NOTICES["updates"])]
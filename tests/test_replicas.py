@@ -0,0 +1,136 @@
+# tests/test_replicas.py
+#
+# Two bot replicas, each with its own Dispatcher, MenuTimeouts and
+# GenerationRegistry, sharing one StateStore: in memory, and Mongo-backed on
+# the fake Motor collections from benchmarks/fake_mongo.py.
+
+import asyncio
+import time
+
+import pytest
+from aiogram import Dispatcher
+
+from benchmarks.fake_mongo import FakeMongo
+from bot.dispatcher import bot
+from bot.services import generations
+from bot.services.generations import GenerationRegistry
+from bot.services.menu_timeouts import MenuTimeouts
+from database.state_store import MemoryStateStore, MongoStateStore, StoreFSMStorage
+
+CHAT_ID = 4242
+USER_ID = 4242
+
+STORES = {
+    "memory": MemoryStateStore,
+    "mongo": lambda: MongoStateStore(FakeMongo()),
+}
+
+
+class Replica:
+    def __init__(self, store):
+        self.dispatcher = Dispatcher(storage=StoreFSMStorage(store))
+        self.menu_timeouts = MenuTimeouts()
+        self.generations = GenerationRegistry()
+        self.generations.attach(store)
+
+    def fsm(self):
+        return self.dispatcher.fsm.get_context(bot, CHAT_ID, USER_ID)
+
+
+def run_replicas(test, backend: str):
+    """
+    Runs `await test(store, first, second)` with two replicas on one store.
+    """
+
+    async def main():
+        store = STORES[backend]()
+        replicas = Replica(store), Replica(store)
+        try:
+            await test(store, *replicas)
+        finally:
+            for replica in replicas:
+                await replica.menu_timeouts.close()
+            await bot.session.close()
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("backend", STORES)
+def test_fsm_state_is_shared(backend):
+    async def test(store, first, second):
+        await first.fsm().set_state("Settings:waiting_for_prompt")
+        await first.fsm().update_data(mode="coder")
+        assert await second.fsm().get_state() == "Settings:waiting_for_prompt"
+        assert await second.fsm().get_data() == {"mode": "coder"}
+
+        await second.fsm().clear()
+        assert await first.fsm().get_state() is None
+        assert await first.fsm().get_data() == {}
+
+    run_replicas(test, backend)
+
+
+@pytest.mark.parametrize("backend", STORES)
+def test_open_menu_expires_once(backend):
+    async def test(store, first, second):
+        expired = []
+
+        async def close_menu(menu):
+            expired.append(menu)
+
+        for replica in (first, second):
+            replica.menu_timeouts.register("settings", close_menu)
+            await replica.menu_timeouts.start(store)
+
+        await first.menu_timeouts.open("menu:1", "settings", 0.2, chat_id=CHAT_ID)
+        # The second replica learns about the menu the way a restarted one does
+        await second.menu_timeouts.close()
+        await second.menu_timeouts.start(store)
+        assert "menu:1" in second.menu_timeouts.timers
+
+        await asyncio.sleep(0.6)
+        assert [menu["key"] for menu in expired] == ["menu:1"]
+        assert await store.pending_menus() == []
+        # The sweep finds nothing left to close either
+        assert await store.claim_expired_menus(time.time() + 60) == []
+
+    run_replicas(test, backend)
+
+
+@pytest.mark.parametrize("backend", STORES)
+def test_chat_lock_excludes_the_other_replica(backend, monkeypatch):
+    # Heartbeats every 0.1 s, so the holder notices a stop request quickly
+    monkeypatch.setattr(generations, "GENERATION_LOCK_TTL", 0.3)
+
+    async def test(store, first, second):
+        events = []
+        holding = asyncio.Event()
+
+        async def stream(replica, name):
+            generation = replica.generations.start(CHAT_ID, USER_ID)
+            async with replica.generations.exclusive(generation):
+                events.append(f"{name} acquired")
+                holding.set()
+                await generation._stop.wait()
+                events.append(f"{name} stopped")
+            replica.generations.finish(generation)
+
+        first_task = asyncio.create_task(stream(first, "first"))
+        await holding.wait()
+        holding.clear()
+        second_task = asyncio.create_task(stream(second, "second"))
+        await asyncio.sleep(0.05)
+        assert events == ["first acquired"]
+
+        # The second replica's wait asked the holder to let go
+        await asyncio.wait_for(first_task, timeout=2)
+        await asyncio.wait_for(holding.wait(), timeout=2)
+        assert events == ["first acquired", "first stopped", "second acquired"]
+
+        # The Stop button on the first replica reaches the second one
+        assert await first.generations.request_stop(CHAT_ID, USER_ID)
+        await asyncio.wait_for(second_task, timeout=2)
+        assert events[-1] == "second stopped"
+        assert not await first.generations.request_stop(CHAT_ID, USER_ID)
+
+    run_replicas(test, backend)
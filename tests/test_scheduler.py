@@ -0,0 +1,121 @@
+# tests/test_scheduler.py
+
+import asyncio
+
+import pytest
+
+from bot.services.scheduler import InferenceScheduler, QueueFullError
+
+MODEL = "llama3.1:8b"
+
+
+def make_scheduler(**limits) -> InferenceScheduler:
+    options = dict(max_queue=10, max_queued_per_user=5)
+    options.update(limits)
+    return InferenceScheduler(1, {}, **options)
+
+
+def test_waiting_users_are_served_round_robin():
+    async def main():
+        scheduler = make_scheduler()
+        served = []
+        release = asyncio.Event()
+        positions = {}
+
+        async def generate(user_id: int, name: str):
+            async def on_position(position):
+                positions.setdefault(name, position)
+
+            async with scheduler.slot(MODEL, user_id, on_position):
+                served.append(name)
+                if name == "a0":
+                    await release.wait()
+
+        tasks = [asyncio.create_task(generate(1, "a0"))]
+        await asyncio.sleep(0)
+        # User 1 queues three more before users 2 and 3 ask once each
+        for name in ("a1", "a2", "a3"):
+            tasks.append(asyncio.create_task(generate(1, name)))
+        tasks.append(asyncio.create_task(generate(2, "b0")))
+        tasks.append(asyncio.create_task(generate(3, "c0")))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["waiting"] == 5
+        # Places in line when queued: the other users go ahead of user 1's
+        # second and third requests
+        assert positions == {"a1": 1, "a2": 2, "a3": 3, "b0": 2, "c0": 3}
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert served == ["a0", "a1", "b0", "c0", "a2", "a3"]
+        assert scheduler.stats()["models"][MODEL] == {
+            "active": 0,
+            "limit": 1,
+            "waiting": 0,
+        }
+
+    asyncio.run(main())
+
+
+def test_queue_wait_is_recorded_once_per_slot():
+    async def main():
+        scheduler = make_scheduler()
+        holding = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot(MODEL, 1):
+                holding.set()
+                await release.wait()
+
+        async def wait_for_slot(user_id: int):
+            async with scheduler.slot(MODEL, user_id):
+                pass
+
+        holder = asyncio.create_task(hold())
+        await holding.wait()
+        waiter = asyncio.create_task(wait_for_slot(2))
+        # Cancelled while queued: never served, so no wait is recorded
+        cancelled = asyncio.create_task(wait_for_slot(3))
+        await asyncio.sleep(0.1)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert scheduler.waiting == 1
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+        counts, count, total = scheduler.queue_wait.state()
+        assert count == 2
+        # The holder got its slot at once, the waiter after about 0.1 s
+        assert counts[0] == 1
+        assert 0.1 <= total < 1
+        assert scheduler.service_time.state()[1] == 2
+        assert scheduler.queues[MODEL].active == 0
+
+    asyncio.run(main())
+
+
+def test_queue_bounds_reject_requests():
+    async def main():
+        scheduler = make_scheduler(max_queue=3, max_queued_per_user=2)
+        release = asyncio.Event()
+
+        async def generate(user_id: int):
+            async with scheduler.slot(MODEL, user_id):
+                await release.wait()
+
+        tasks = [asyncio.create_task(generate(1)) for _ in range(3)]
+        await asyncio.sleep(0)
+        # One running and two queued: the user's third waiting request fails
+        with pytest.raises(QueueFullError):
+            await generate(1)
+        tasks.append(asyncio.create_task(generate(2)))
+        await asyncio.sleep(0)
+        # Three queued in total: a new user is turned away too
+        with pytest.raises(QueueFullError):
+            await generate(3)
+        assert scheduler.rejected == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+# tests/test_streaming_response.py
+
+import asyncio
+import json
+
+import pytest
+from ollama import ResponseError
+
+from benchmarks.fake_ollama import FakeOllama
+from bot.helpers.streaming_response import NDJSONDecoder, StreamingClient
+from tests.conftest import OLLAMA_PORTS, TEST_MODEL
+
+CHUNKS = [
+    {"message": {"role": "assistant", "content": " héllo"}, "done": False},
+    {"message": {"role": "assistant", "content": ""}, "done": True},
+]
+
+
+def encode(chunk: dict) -> bytes:
+    # Non-ASCII text as raw UTF-8, as Ollama sends it
+    return json.dumps(chunk, ensure_ascii=False).encode()
+
+
+def test_lines_split_across_network_chunks():
+    data = b"".join(encode(chunk) + b"\n" for chunk in CHUNKS)
+    # Every possible split, including one inside the two-byte "é"
+    for split in range(1, len(data)):
+        decoder = NDJSONDecoder()
+        objects = decoder.feed(data[:split]) + decoder.feed(data[split:])
+        assert objects == CHUNKS
+        assert decoder.flush() == []
+
+
+def test_blank_lines_and_a_last_line_without_newline():
+    decoder = NDJSONDecoder()
+    first, last = (encode(chunk) for chunk in CHUNKS)
+    assert decoder.feed(b"\n" + first + b"\n\n" + last[:5]) == [CHUNKS[0]]
+    assert decoder.feed(last[5:]) == []
+    assert decoder.flush() == [CHUNKS[1]]
+    assert decoder.flush() == []
+
+
+def test_error_chunk_is_raised_as_a_request_error():
+    async def main():
+        ollama = FakeOllama(port=OLLAMA_PORTS[0], models=[TEST_MODEL])
+        ollama.stream_error = "input length exceeds the context length"
+        await ollama.start()
+        client = StreamingClient(pool_size=4, keepalive=5, timeout=10)
+        try:
+            messages = [{"role": "user", "content": "hi"}]
+            stream = client.chat(ollama.base_url, TEST_MODEL, messages)
+            with pytest.raises(ResponseError) as error:
+                await stream.__anext__()
+            assert error.value.error == ollama.stream_error
+            assert 400 <= error.value.status_code < 500
+            assert client.stats()["errors"] == 1
+        finally:
+            await client.close()
+            await ollama.close()
+
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+# tests/test_timer_wheel.py
+
+import asyncio
+
+from bot.helpers.timer_wheel import TimerWheel
+
+TICK = 0.02
+# Room for event loop jitter on top of the documented two ticks
+LATE_BOUND = 2 * TICK + 0.05
+
+
+def run_wheel(test, **options):
+    """
+    Runs `await test(wheel, fired)`, where `fired` maps each key to the loop
+    time its timer fired at.
+    """
+
+    async def main():
+        wheel = TimerWheel(tick=TICK, **options)
+        try:
+            await test(wheel, {})
+        finally:
+            await wheel.close()
+
+    asyncio.run(main())
+
+
+def test_timers_fire_in_order_and_never_early():
+    async def test(wheel, fired):
+        loop = asyncio.get_running_loop()
+
+        def callback(key):
+            fired[key] = loop.time()
+
+        started = loop.time()
+        delays = {"late": 0.15, "first": 0.01, "middle": 0.07}
+        for key, delay in delays.items():
+            wheel.schedule(key, delay, callback)
+        assert len(wheel) == 3
+        await asyncio.sleep(0.3)
+
+        assert sorted(fired, key=fired.get) == ["first", "middle", "late"]
+        for key, delay in delays.items():
+            assert delay <= fired[key] - started <= delay + LATE_BOUND
+        assert len(wheel) == 0
+        assert wheel.stats() == {"scheduled": 0, "fired": 3}
+
+    run_wheel(test)
+
+
+def test_delays_longer_than_one_turn_of_the_wheel():
+    async def test(wheel, fired):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        # 4 slots of 0.02 s: 0.2 s takes the cursor round the wheel twice
+        wheel.schedule("menu", 0.2, lambda key: fired.setdefault(key, loop.time()))
+        await asyncio.sleep(0.15)
+        assert fired == {}
+        await asyncio.sleep(0.2)
+        assert 0.2 <= fired["menu"] - started <= 0.2 + LATE_BOUND
+
+    run_wheel(test, slots=4)
+
+
+def test_reset_cancel_and_reschedule():
+    async def test(wheel, fired):
+        def callback(key):
+            fired[key] = "first"
+
+        def replacement(key):
+            fired[key] = "replacement"
+
+        wheel.schedule("reset", 0.05, callback)
+        wheel.schedule("cancelled", 0.05, callback)
+        wheel.schedule("replaced", 0.05, callback)
+        wheel.schedule("replaced", 0.05, replacement)
+        await asyncio.sleep(0.03)
+        assert wheel.reset("reset", 0.1)
+        assert wheel.cancel("cancelled")
+        assert not wheel.cancel("cancelled")
+        assert not wheel.reset("missing", 0.1)
+
+        await asyncio.sleep(0.08)
+        assert fired == {"replaced": "replacement"}
+        await asyncio.sleep(0.15)
+        assert fired == {"replaced": "replacement", "reset": "first"}
+        assert "cancelled" not in wheel
+
+    run_wheel(test)
+
+
+def test_failing_callback_does_not_stop_the_wheel():
+    async def test(wheel, fired):
+        def failing(key):
+            # Expired timers are removed before their callback runs
+            fired[key] = key in wheel
+            raise RuntimeError("menu already closed")
+
+        wheel.schedule("failing", 0.01, failing)
+        wheel.schedule("next", 0.05, lambda key: fired.setdefault(key, True))
+        await asyncio.sleep(0.15)
+        assert fired == {"failing": False, "next": True}
+
+        # An empty wheel sleeps until the next timer is scheduled
+        wheel.schedule("later", 0.01, lambda key: fired.setdefault(key, True))
+        await asyncio.sleep(0.1)
+        assert fired["later"]
+
+    run_wheel(test)
@@ -0,0 +1,62 @@
+# tests/test_webhook.py
+
+import asyncio
+
+from bot.webhook import UpdateWorkerPool, is_control_update
+
+
+class StreamingDispatcher:
+    """
+    Holds every text message for as long as `release` is unset, like a
+    generation that streams for a long time.
+    """
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.handled = []
+
+    async def feed_raw_update(self, bot, update: dict):
+        if "message" in update and not is_control_update(update):
+            await self.release.wait()
+        self.handled.append(update)
+
+
+def message_update(update_id: int, text: str) -> dict:
+    message = {"message_id": update_id, "text": text}
+    return {"update_id": update_id, "message": message}
+
+
+def test_stop_is_handled_while_generations_fill_the_pool():
+    async def main():
+        dispatcher = StreamingDispatcher()
+        pool = UpdateWorkerPool(
+            dispatcher, bot=None, workers=2, max_queued=10, control_workers=1
+        )
+        pool.start()
+        # Every message worker streams, and more messages wait behind them
+        for update_id in range(4):
+            assert pool.submit(message_update(update_id, "tell me a story"))
+        await asyncio.sleep(0)
+
+        stop = {"update_id": 10, "callback_query": {"id": "1", "data": "stop"}}
+        assert pool.submit(stop)
+        assert pool.submit(message_update(11, "/settings"))
+        for _ in range(50):
+            if len(dispatcher.handled) == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert [update["update_id"] for update in dispatcher.handled] == [10, 11]
+        assert pool.queue.qsize() == 2
+
+        dispatcher.release.set()
+        await pool.close(timeout=5)
+        assert pool.stats()["processed"] == 6
+
+    asyncio.run(main())
+
+
+def test_generating_commands_take_the_message_lane():
+    assert not is_control_update(message_update(1, "/ask what is rust?"))
+    assert not is_control_update(message_update(1, "/ask@some_bot hi"))
+    assert not is_control_update(message_update(1, "hello"))
+    assert is_control_update(message_update(1, "/mode@some_bot"))
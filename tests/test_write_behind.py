@@ -0,0 +1,129 @@
+# tests/test_write_behind.py
+
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from benchmarks.fake_mongo import install
+from database import write_behind
+from database.bot_database import BotDatabase
+
+USER_ID = 4242
+
+
+def fail_once(collection, apply_first: bool):
+    """
+    Makes the next bulk_write on `collection` fail. With `apply_first`, the
+    writes land but the acknowledgement is lost, as after a network error.
+    """
+    bulk_write = collection.bulk_write
+
+    async def failing(requests, ordered=True):
+        collection.bulk_write = bulk_write
+        if apply_first:
+            await bulk_write(requests, ordered=ordered)
+        raise AutoReconnect("connection reset")
+
+    collection.bulk_write = failing
+
+
+@pytest.mark.parametrize("apply_first", [False, True])
+def test_failed_flush_keeps_seqs(apply_first):
+    async def main():
+        db = BotDatabase()
+        fake = install(db)
+        dialog_id = await db.create_dialog(USER_ID)
+        for turn in range(3):
+            await db.add_message_to_dialog(USER_ID, dialog_id, f"q{turn}", f"a{turn}")
+
+        fail_once(db.messages_collection, apply_first)
+        await db.write_queue.flush()
+        assert db.write_queue.flush_errors == 1
+        await db.add_message_to_dialog(USER_ID, dialog_id, "q3", "a3")
+        await db.write_queue.flush()
+
+        messages = [
+            message
+            for bucket in fake["dialog_messages"].documents.values()
+            for message in bucket["messages"]
+        ]
+        assert [message["seq"] for message in messages] == [0, 1, 2, 3]
+        assert [message["user"] for message in messages] == ["q0", "q1", "q2", "q3"]
+        dialog = fake["dialogs"].documents[dialog_id]
+        assert dialog["message_count"] == 4
+        db.client.close()
+
+    asyncio.run(main())
+
+
+def test_failed_usage_write_is_not_charged_twice():
+    async def main():
+        db = BotDatabase()
+        fake = install(db)
+        for user_id in (1, 2, 3):
+            await db.create_user(user_id, user_id, None, f"user{user_id}", None)
+            db.write_queue.add_usage(user_id, "2026-10-18", 100)
+
+        # The first two users' writes land, the third user's reset fails
+        bulk_write = db.users_collection.bulk_write
+
+        async def failing(requests, ordered=True):
+            db.users_collection.bulk_write = bulk_write
+            await bulk_write(requests[:4], ordered=ordered)
+            raise BulkWriteError(
+                {"writeErrors": [{"index": 4, "code": 91, "errmsg": "shutdown"}]}
+            )
+
+        db.users_collection.bulk_write = failing
+        await db.write_queue.flush()
+        assert db.write_queue.pending_usage == {(3, "2026-10-18"): 100}
+        await db.write_queue.flush()
+
+        users = fake["users"].documents
+        assert [users[user_id]["usage_tokens"] for user_id in (1, 2, 3)] == [100] * 3
+        db.client.close()
+
+    asyncio.run(main())
+
+
+def test_usage_of_a_user_without_a_document_is_kept():
+    async def main():
+        db = BotDatabase()
+        fake = install(db)
+        # A group member is charged without ever having written to the bot
+        db.write_queue.add_usage(USER_ID, "2026-10-18", 100)
+        await db.write_queue.flush()
+        db.write_queue.add_usage(USER_ID, "2026-10-18", 50)
+        await db.write_queue.flush()
+
+        user = fake["users"].documents[USER_ID]
+        assert user["usage_day"] == "2026-10-18"
+        assert user["usage_tokens"] == 150
+        assert user["current_dialog_id"] is None
+        db.client.close()
+
+    asyncio.run(main())
+
+
+def test_buckets_carry_the_dialogs_last_activity(monkeypatch):
+    monkeypatch.setattr(write_behind, "MESSAGE_BUCKET_SIZE", 2)
+
+    async def main():
+        db = BotDatabase()
+        fake = install(db)
+        dialog_id = await db.create_dialog(USER_ID)
+        for turn in range(5):
+            await db.add_message_to_dialog(USER_ID, dialog_id, f"q{turn}", f"a{turn}")
+            # One flush per turn, so older buckets are left behind
+            await db.write_queue.flush()
+
+        # The TTL index on last_activity then expires them all at once
+        dialog = fake["dialogs"].documents[dialog_id]
+        buckets = fake["dialog_messages"].documents.values()
+        assert len(buckets) == 3
+        for bucket in buckets:
+            assert bucket["last_activity"] == dialog["last_activity"]
+        db.client.close()
+
+    asyncio.run(main())